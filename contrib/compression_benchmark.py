@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# ====================================================================
+# Copyright (c) 2000-2009 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Measure the compression of --use-internal-co texts.
+
+usage: compression_benchmark.py [--repeat=N] PATH...
+
+Read the revision texts (the head fulltexts and the deltas) of all RCS
+files under the PATHs, which are what InternalRevisionCollector stores
+in its delta database.  Compress and decompress each of them with
+
+  - zlib at level 9 without a dictionary (how the databases were
+    compressed before CompressingSerializer used dictionaries);
+
+  - CompressingSerializer with a dictionary, but compressing every
+    record with a copy of a compressor of the default memLevel;
+
+  - CompressingSerializer as configured for --use-internal-co.
+
+The dictionaries are built from the first
+config.INTERNAL_CO_DICTIONARY_SAMPLE_SIZE bytes of texts, as in a
+conversion.  For records in several ranges of sizes, print the best
+time of N runs (default 5) per record and the compressed size as a
+percentage of the original size."""
+
+import sys
+import os
+import time
+import gc
+import marshal
+import zlib
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cvs2svn_lib import config
+from cvs2svn_lib.serializer import MarshalSerializer
+from cvs2svn_lib.serializer import CompressingSerializer
+from cvs2svn_lib.rcsparser import Sink
+from cvs2svn_lib.rcsparser import parse
+
+
+SIZE_RANGES = [
+    (0, 64), (64, 256), (256, 1024), (1024, 4096), (4096, None), (0, None),
+    ]
+
+
+class ZlibSerializer(MarshalSerializer):
+  """Compress each record on its own with zlib.compress()."""
+
+  def dumps(self, object):
+    return marshal.dumps(zlib.compress(marshal.dumps(object), 9))
+
+  def loads(self, s):
+    return marshal.loads(zlib.decompress(marshal.loads(s)))
+
+
+class UnthresholdedCompressingSerializer(CompressingSerializer):
+  """Copy a compressor of the default memLevel for every record."""
+
+  MEM_LEVEL = 8
+  MIN_COMPRESSED_SIZE = 0
+
+
+class TextCollector(Sink):
+  def __init__(self, texts):
+    self.texts = texts
+
+  def set_revision_info(self, revision, log, text):
+    self.texts.append(text)
+
+
+def read_texts(paths):
+  texts = []
+  sink = TextCollector(texts)
+  for path in paths:
+    for (dirpath, dirnames, filenames) in os.walk(path):
+      dirnames.sort()
+      filenames.sort()
+      for filename in filenames:
+        if filename.endswith(',v'):
+          parse(open(os.path.join(dirpath, filename), 'rb'), sink)
+  return texts
+
+
+def get_sample(texts):
+  sample = []
+  size = 0
+  for text in texts:
+    if size >= config.INTERNAL_CO_DICTIONARY_SAMPLE_SIZE:
+      break
+    sample.append(text)
+    size += len(text)
+  return sample
+
+
+def best_time(f, args, repeat):
+  """Return the shortest time of REPEAT runs of F over ARGS, per arg."""
+
+  best = None
+  for i in range(repeat):
+    # As in timeit, keep the garbage collector from distorting the times:
+    gc.collect()
+    gc.disable()
+    try:
+      start = time.time()
+      for arg in args:
+        f(arg)
+      t = time.time() - start
+    finally:
+      gc.enable()
+    if best is None or t < best:
+      best = t
+  return best / len(args)
+
+
+def benchmark(label, serializer, texts, repeat):
+  print '%s:' % (label,)
+  for (lo, hi) in SIZE_RANGES:
+    records = [
+        text for text in texts
+        if lo <= len(text) and (hi is None or len(text) < hi)
+        ]
+    if not records:
+      continue
+    strings = [serializer.dumps(record) for record in records]
+    dump_time = best_time(serializer.dumps, records, repeat)
+    load_time = best_time(serializer.loads, strings, repeat)
+    if hi is None:
+      size_range = '>= %d' % (lo,)
+    else:
+      size_range = '%d-%d' % (lo, hi - 1,)
+    print (
+        '  %-10s %6d records  dumps %6.1f us  loads %5.1f us  %5.1f%%'
+        % (
+            size_range, len(records), dump_time * 1e6, load_time * 1e6,
+            100.0 * sum(map(len, strings)) / sum(map(len, records)),
+            )
+        )
+
+
+def main(args):
+  parser = OptionParser(usage='%prog [--repeat=N] PATH...')
+  parser.add_option(
+      '--repeat', type='int', default=5,
+      help='the number of times to time each measurement (default 5)',
+      )
+  (options, args) = parser.parse_args(args)
+  if not args:
+    parser.error('no PATH specified')
+
+  texts = read_texts(args)
+  sample = get_sample(texts)
+  level = config.INTERNAL_CO_COMPRESSION_LEVEL
+  print '%d texts of %d bytes; dictionary sample of %d texts' % (
+      len(texts), sum(map(len, texts)), len(sample),
+      )
+
+  for (label, serializer) in [
+        ('zlib level 9, no dictionary', ZlibSerializer()),
+        ('zlib level %d, dictionary, memLevel 8, no threshold' % (level,),
+         UnthresholdedCompressingSerializer(
+             MarshalSerializer(), level, sample
+             )),
+        ('CompressingSerializer(level=%d), dictionary' % (level,),
+         CompressingSerializer(MarshalSerializer(), level, sample)),
+        ]:
+    benchmark(label, serializer, texts, options.repeat)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# ====================================================================
+# Copyright (c) 2000-2009 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Compare the speed of the RecordTable backends.
+
+usage: record_table_benchmark.py [--items=N] [--tmpdir=PATH]
+
+For each backend ('file' and 'mmap'), build the index tables that a
+conversion of N CVS items (default 10 million) would use, then read
+them back sequentially and randomly and print the elapsed times.  The
+tables are a FileOffsetPacker index, as used by IndexedDatabase for
+cvs_items.pck, and an UnsignedIntegerPacker table, as used by
+CVSItemToChangesetTable.  Random accesses touch 10% of the items."""
+
+import sys
+import os
+import time
+import random
+import shutil
+import tempfile
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cvs2svn_lib.common import DB_OPEN_NEW
+from cvs2svn_lib.common import DB_OPEN_WRITE
+from cvs2svn_lib.common import DB_OPEN_READ
+from cvs2svn_lib.record_table import FileOffsetPacker
+from cvs2svn_lib.record_table import UnsignedIntegerPacker
+from cvs2svn_lib.record_table import RecordTable
+from cvs2svn_lib.record_table import MmapRecordTable
+
+
+def open_table(backend, filename, mode, packer):
+  if backend == 'mmap':
+    return MmapRecordTable(filename, mode, packer)
+  else:
+    return RecordTable(filename, mode, packer)
+
+
+def timed(label, fn):
+  start = time.time()
+  fn()
+  print '  %-28s %8.2f s' % (label, time.time() - start,)
+
+
+def benchmark(backend, filename, packer, n, sample):
+  def write_sequential():
+    table = open_table(backend, filename, DB_OPEN_NEW, packer)
+    for i in xrange(n):
+      table[i] = i * 7 + 1
+    table.close()
+
+  def read_sequential():
+    table = open_table(backend, filename, DB_OPEN_READ, packer)
+    for i in xrange(n):
+      table[i]
+    table.close()
+
+  def read_random():
+    table = open_table(backend, filename, DB_OPEN_READ, packer)
+    for i in sample:
+      table[i]
+    table.close()
+
+  def update_random():
+    table = open_table(backend, filename, DB_OPEN_WRITE, packer)
+    for i in sample:
+      table[i] = table[i] + 1
+    table.close()
+
+  timed('sequential write', write_sequential)
+  timed('sequential read', read_sequential)
+  timed('random read', read_random)
+  timed('random read-modify-write', update_random)
+  print '  %-28s %8.1f MiB' % (
+      'file size', os.path.getsize(filename) / (1024.0 * 1024.0),
+      )
+
+
+def main(args):
+  parser = OptionParser(usage='%prog [--items=N] [--tmpdir=PATH]')
+  parser.add_option(
+      '--items', type='int', default=10000000,
+      help='the number of CVS items to simulate (default 10000000)',
+      )
+  parser.add_option(
+      '--tmpdir', type='string', default=None,
+      help='the directory in which to create the tables',
+      )
+  (options, args) = parser.parse_args(args)
+
+  n = options.items
+  random.seed(0)
+  sample = [random.randrange(n) for i in xrange(n // 10)]
+
+  tmpdir = tempfile.mkdtemp(prefix='record-table-', dir=options.tmpdir)
+  try:
+    filename = os.path.join(tmpdir, 'table.dat')
+    for (name, packer) in [
+          ('FileOffsetPacker', FileOffsetPacker()),
+          ('UnsignedIntegerPacker', UnsignedIntegerPacker()),
+          ]:
+      for backend in ['file', 'mmap']:
+        print '%s, %s backend, %d items:' % (name, backend, n,)
+        benchmark(backend, filename, packer, n, sample)
+  finally:
+    shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
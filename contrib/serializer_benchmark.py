@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# ====================================================================
+# Copyright (c) 2000-2009 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""Measure the per-record cost of the serializers used by cvs2svn.
+
+usage: serializer_benchmark.py [--records=N]
+
+For the records stored in IndexedCVSItemStore (CVSRevisions),
+ChangesetDatabase (RevisionChangesets) and the PersistenceManager
+commit store (SVNPrimaryCommits), serialize and deserialize N
+synthetic records (default 100000) and print the average time per
+record and the average serialized size.  Each record type is measured
+with a PrimedPickleSerializer that creates a new pickler/unpickler and
+copies the primed memo for each record (the old behavior) and with the
+current PrimedPickleSerializer, which reuses its pickler and memo.
+CVSRevisions are also measured with the CVSItemSerializer that
+IndexedCVSItemStore actually uses."""
+
+import sys
+import os
+import time
+import gc
+import cStringIO
+import cPickle
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cvs2svn_lib.context import Ctx
+from cvs2svn_lib.serializer import PrimedPickleSerializer
+from cvs2svn_lib.cvs_item import CVSRevisionChange
+from cvs2svn_lib.cvs_item_database import cvs_item_primer
+from cvs2svn_lib.cvs_item_database import CVSItemSerializer
+from cvs2svn_lib.changeset import Changeset
+from cvs2svn_lib.changeset import RevisionChangeset
+from cvs2svn_lib.changeset import OrderedChangeset
+from cvs2svn_lib.changeset import SymbolChangeset
+from cvs2svn_lib.changeset import BranchChangeset
+from cvs2svn_lib.changeset import TagChangeset
+from cvs2svn_lib.svn_commit import SVNInitialProjectCommit
+from cvs2svn_lib.svn_commit import SVNPrimaryCommit
+from cvs2svn_lib.svn_commit import SVNPostCommit
+from cvs2svn_lib.svn_commit import SVNBranchCommit
+from cvs2svn_lib.svn_commit import SVNTagCommit
+
+
+class PerRecordPickleSerializer(PrimedPickleSerializer):
+  """A PrimedPickleSerializer that creates a pickler/unpickler per record."""
+
+  def dumps(self, object):
+    f = cStringIO.StringIO()
+    pickler = cPickle.Pickler(f, -1)
+    pickler.memo = self.pickler_memo.copy()
+    pickler.dump(object)
+    return f.getvalue()
+
+  def loads(self, s):
+    unpickler = cPickle.Unpickler(cStringIO.StringIO(s))
+    unpickler.memo = self.unpickler_memo.copy()
+    return unpickler.load()
+
+
+class Stub(object):
+  """Stands in for the CVSFiles, symbols and CVSItems referred to by ID."""
+
+  def __init__(self, id):
+    self.id = id
+
+
+class StubDatabase(object):
+  """Stands in for the databases that records look up IDs in."""
+
+  def get_path(self, id):
+    return Stub(id)
+
+  def get_symbol(self, id):
+    return Stub(id)
+
+  def get_many(self, ids):
+    return [(id, Stub(id)) for id in ids]
+
+
+def create_cvs_revisions(n):
+  return [
+      CVSRevisionChange(
+          i, Stub(i // 10), 1234567890 + i, i % 1000,
+          i - 1, i + 1, '1.%d' % (i % 10 + 1,), True,
+          Stub(i % 7), None, False, None, None,
+          [], [i + 2], [], None,
+          )
+      for i in xrange(n)
+      ]
+
+
+def create_changesets(n):
+  return [
+      RevisionChangeset(i, range(i * 5, i * 5 + 1 + i % 9))
+      for i in xrange(n)
+      ]
+
+
+def create_svn_commits(n):
+  return [
+      SVNPrimaryCommit(
+          [Stub(id) for id in range(i * 5, i * 5 + 1 + i % 9)],
+          1234567890 + i, i + 2,
+          )
+      for i in xrange(n)
+      ]
+
+
+def benchmark(label, serializer, records):
+  n = len(records)
+  # As in timeit, keep the garbage collector from distorting the times:
+  gc.collect()
+  gc.disable()
+  try:
+    start = time.time()
+    strings = [serializer.dumps(record) for record in records]
+    dump_time = time.time() - start
+    start = time.time()
+    for s in strings:
+      serializer.loads(s)
+    load_time = time.time() - start
+  finally:
+    gc.enable()
+  size = sum([len(s) for s in strings])
+  print '  %-28s dumps %6.2f us  loads %6.2f us  %6.1f bytes' % (
+      label, dump_time * 1e6 / n, load_time * 1e6 / n, float(size) / n,
+      )
+
+
+def main(args):
+  parser = OptionParser(usage='%prog [--records=N]')
+  parser.add_option(
+      '--records', type='int', default=100000,
+      help='the number of records of each type to serialize (default 100000)',
+      )
+  (options, args) = parser.parse_args(args)
+  n = options.records
+
+  db = StubDatabase()
+  Ctx()._cvs_path_db = db
+  Ctx()._symbol_db = db
+  Ctx()._cvs_items_db = db
+
+  changeset_primer = (
+      Changeset, RevisionChangeset, OrderedChangeset,
+      SymbolChangeset, BranchChangeset, TagChangeset,
+      )
+  svn_commit_primer = (
+      SVNInitialProjectCommit, SVNPrimaryCommit, SVNPostCommit,
+      SVNBranchCommit, SVNTagCommit,
+      )
+
+  for (name, records, primer, extra) in [
+        ('IndexedCVSItemStore', create_cvs_revisions(n), cvs_item_primer,
+         [('CVSItemSerializer', CVSItemSerializer(cvs_item_primer))]),
+        ('ChangesetDatabase', create_changesets(n), changeset_primer, []),
+        ('PersistenceManager', create_svn_commits(n), svn_commit_primer, []),
+        ]:
+    print '%s, %d records:' % (name, n,)
+    for (label, serializer) in [
+          ('per-record pickler', PerRecordPickleSerializer(primer)),
+          ('reused pickler', PrimedPickleSerializer(primer)),
+          ] + extra:
+      benchmark(label, serializer, records)
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -44,10 +44,28 @@ class Changeset(object):
 
     raise NotImplementedError()
 
+  def get_graph_dependencies(self):
+    """Return the information needed for this Changeset's graph node.
+
+    Return (time_range, pred_item_ids, succ_item_ids), where
+    PRED_ITEM_IDS and SUCC_ITEM_IDS are lists of the ids of the
+    CVSItems that the CVSItems in this Changeset depend on and that
+    depend on them, respectively."""
+
+    raise NotImplementedError()
+
+  def _create_graph_node(self, time_range, pred_ids, succ_ids):
+    """Return a ChangesetGraphNode with the specified dependencies.
+
+    PRED_IDS and SUCC_IDS are the sets of the ids of the changesets
+    that contain the CVSItems reported by get_graph_dependencies()."""
+
+    return ChangesetGraphNode(self, time_range, pred_ids, succ_ids)
+
   def create_graph_node(self, cvs_item_to_changeset_id):
     """Return a ChangesetGraphNode for this Changeset."""
 
-    raise NotImplementedError()
+    return create_graph_nodes([self], cvs_item_to_changeset_id)[0]
 
   def create_split_changeset(self, id, cvs_item_ids):
     """Return a Changeset with the specified contents.
@@ -81,25 +99,17 @@ class RevisionChangeset(Changeset):
 
   _sort_order = 3
 
-  def create_graph_node(self, cvs_item_to_changeset_id):
+  def get_graph_dependencies(self):
     time_range = TimeRange()
-    pred_ids = set()
-    succ_ids = set()
+    pred_item_ids = []
+    succ_item_ids = []
 
     for cvs_item in self.iter_cvs_items():
       time_range.add(cvs_item.timestamp)
+      pred_item_ids.extend(cvs_item.get_pred_ids())
+      succ_item_ids.extend(cvs_item.get_succ_ids())
 
-      for pred_id in cvs_item.get_pred_ids():
-        changeset_id = cvs_item_to_changeset_id.get(pred_id)
-        if changeset_id is not None:
-          pred_ids.add(changeset_id)
-
-      for succ_id in cvs_item.get_succ_ids():
-        changeset_id = cvs_item_to_changeset_id.get(succ_id)
-        if changeset_id is not None:
-          succ_ids.add(changeset_id)
-
-    return ChangesetGraphNode(self, time_range, pred_ids, succ_ids)
+    return (time_range, pred_item_ids, succ_item_ids)
 
   def create_split_changeset(self, id, cvs_item_ids):
     return RevisionChangeset(id, cvs_item_ids)
@@ -143,31 +153,27 @@ class OrderedChangeset(Changeset):
       retval.add(cvs_item.cvs_file.project)
     return retval
 
-  def create_graph_node(self, cvs_item_to_changeset_id):
+  def get_graph_dependencies(self):
     time_range = TimeRange()
+    pred_item_ids = []
+    succ_item_ids = []
+
+    for cvs_item in self.iter_cvs_items():
+      time_range.add(cvs_item.timestamp)
+      pred_item_ids.extend(cvs_item.get_symbol_pred_ids())
+      succ_item_ids.extend(cvs_item.get_symbol_succ_ids())
 
-    pred_ids = set()
-    succ_ids = set()
+    return (time_range, pred_item_ids, succ_item_ids)
 
+  def _create_graph_node(self, time_range, pred_ids, succ_ids):
+    # The dependencies on the other OrderedChangesets are not
+    # expressed by the CVSItems:
     if self.prev_id is not None:
       pred_ids.add(self.prev_id)
 
     if self.next_id is not None:
       succ_ids.add(self.next_id)
 
-    for cvs_item in self.iter_cvs_items():
-      time_range.add(cvs_item.timestamp)
-
-      for pred_id in cvs_item.get_symbol_pred_ids():
-        changeset_id = cvs_item_to_changeset_id.get(pred_id)
-        if changeset_id is not None:
-          pred_ids.add(changeset_id)
-
-      for succ_id in cvs_item.get_symbol_succ_ids():
-        changeset_id = cvs_item_to_changeset_id.get(succ_id)
-        if changeset_id is not None:
-          succ_ids.add(changeset_id)
-
     return ChangesetGraphNode(self, time_range, pred_ids, succ_ids)
 
   def __getstate__(self):
@@ -198,22 +204,15 @@ class SymbolChangeset(Changeset):
     # A SymbolChangeset can never open a project.
     return set()
 
-  def create_graph_node(self, cvs_item_to_changeset_id):
-    pred_ids = set()
-    succ_ids = set()
+  def get_graph_dependencies(self):
+    pred_item_ids = []
+    succ_item_ids = []
 
     for cvs_item in self.iter_cvs_items():
-      for pred_id in cvs_item.get_pred_ids():
-        changeset_id = cvs_item_to_changeset_id.get(pred_id)
-        if changeset_id is not None:
-          pred_ids.add(changeset_id)
+      pred_item_ids.extend(cvs_item.get_pred_ids())
+      succ_item_ids.extend(cvs_item.get_succ_ids())
 
-      for succ_id in cvs_item.get_succ_ids():
-        changeset_id = cvs_item_to_changeset_id.get(succ_id)
-        if changeset_id is not None:
-          succ_ids.add(changeset_id)
-
-    return ChangesetGraphNode(self, TimeRange(), pred_ids, succ_ids)
+    return (TimeRange(), pred_item_ids, succ_item_ids)
 
   def __cmp__(self, other):
     return cmp(self._sort_order, other._sort_order) \
@@ -253,6 +252,49 @@ class TagChangeset(SymbolChangeset):
     return 'TagChangeset<%x>("%s")' % (self.id, self.symbol,)
 
 
+def create_graph_nodes(changesets, cvs_item_to_changeset_id):
+  """Return a list of ChangesetGraphNodes for CHANGESETS.
+
+  The result is the same as calling create_graph_node() for each of
+  CHANGESETS, but the CVSItem ids that they report are looked up in
+  CVS_ITEM_TO_CHANGESET_ID all together, in sorted order."""
+
+  dependencies = [
+      changeset.get_graph_dependencies()
+      for changeset in changesets
+      ]
+
+  item_ids = set()
+  for (time_range, pred_item_ids, succ_item_ids) in dependencies:
+    item_ids.update(pred_item_ids)
+    item_ids.update(succ_item_ids)
+
+  # A map {cvs_item_id : changeset_id}, omitting the CVSItems that are
+  # not in any changeset:
+  changeset_ids = {}
+  for (item_id, changeset_id) in cvs_item_to_changeset_id.get_many(item_ids):
+    if changeset_id is not None:
+      changeset_ids[item_id] = changeset_id
+  del item_ids
+
+  nodes = []
+  for (changeset, (time_range, pred_item_ids, succ_item_ids)) \
+          in zip(changesets, dependencies):
+    pred_ids = set([
+        changeset_ids[item_id]
+        for item_id in pred_item_ids
+        if item_id in changeset_ids
+        ])
+    succ_ids = set([
+        changeset_ids[item_id]
+        for item_id in succ_item_ids
+        if item_id in changeset_ids
+        ])
+    nodes.append(changeset._create_graph_node(time_range, pred_ids, succ_ids))
+
+  return nodes
+
+
 def create_symbol_changeset(id, symbol, cvs_item_ids):
   """Factory function for SymbolChangesets.
 
@@ -24,29 +24,20 @@ from cvs2svn_lib.changeset import SymbolChangeset
 from cvs2svn_lib.changeset import BranchChangeset
 from cvs2svn_lib.changeset import TagChangeset
 from cvs2svn_lib.record_table import UnsignedIntegerPacker
-from cvs2svn_lib.record_table import MmapRecordTable
-from cvs2svn_lib.record_table import RecordTable
+from cvs2svn_lib.record_table import open_record_table
 from cvs2svn_lib.indexed_database import IndexedStore
 from cvs2svn_lib.serializer import PrimedPickleSerializer
 
 
-# Should the CVSItemToChangesetTable database files be memory mapped?
-# This speeds up the converstion but can cause the computer's virtual
-# address space to be exhausted.  This option can be changed
-# externally, affecting any CVSItemToChangesetTables opened subsequent
-# to the change:
-use_mmap_for_cvs_item_to_changeset_table = False
-
-
 def CVSItemToChangesetTable(filename, mode):
-  if use_mmap_for_cvs_item_to_changeset_table:
-    return MmapRecordTable(filename, mode, UnsignedIntegerPacker())
-  else:
-    return RecordTable(filename, mode, UnsignedIntegerPacker())
+  return open_record_table(filename, mode, UnsignedIntegerPacker())
 
 
 class ChangesetDatabase(IndexedStore):
-  def __init__(self, filename, index_filename, mode):
+  def __init__(
+        self, filename, index_filename, mode,
+        cache_memory=0, readahead=False,
+        ):
     primer = (
         Changeset,
         RevisionChangeset,
@@ -56,7 +47,9 @@ class ChangesetDatabase(IndexedStore):
         TagChangeset,
         )
     IndexedStore.__init__(
-        self, filename, index_filename, mode, PrimedPickleSerializer(primer))
+        self, filename, index_filename, mode, PrimedPickleSerializer(primer),
+        cache_memory=cache_memory, readahead=readahead,
+        )
 
   def store(self, changeset):
     self.add(changeset)
@@ -18,8 +18,11 @@
 
 
 import heapq
+from collections import deque
 
+from cvs2svn_lib import config
 from cvs2svn_lib.log import logger
+from cvs2svn_lib.changeset import create_graph_nodes
 from cvs2svn_lib.changeset import RevisionChangeset
 from cvs2svn_lib.changeset import OrderedChangeset
 from cvs2svn_lib.changeset import BranchChangeset
@@ -47,40 +50,47 @@ class _NoPredNodes(object):
   def __init__(self, changeset_db, initial_nodes):
     """Initialize.
 
-    INITIAL_NODES is an iterable over node to add to this object on
-    initialization."""
+    INITIAL_NODES is an iterable over (id, time_range) tuples for the
+    nodes to add to this object on initialization."""
 
     self.changeset_db = changeset_db
 
-    # A heapified list of (node.time_range, changeset, node) tuples
+    # A heapified list of (time_range, changeset) tuples for nodes
     # that have no predecessors.  These tuples sort in the desired
     # commit order:
     self._nodes = [
-      (node.time_range, self.changeset_db[node.id], node)
-      for node in initial_nodes
+      (time_range, self.changeset_db[id])
+      for (id, time_range) in initial_nodes
       ]
     heapq.heapify(self._nodes)
 
   def __len__(self):
     return len(self._nodes)
 
-  def add(self, node):
-    node = (node.time_range, self.changeset_db[node.id], node)
+  def add(self, id, time_range):
+    node = (time_range, self.changeset_db[id])
     heapq.heappush(self._nodes, node)
 
   def get(self):
-    """Return (node, changeset,) of the next node to be committed.
+    """Return (changeset, time_range,) of the next node to be committed.
 
     'Smallest' is defined by the ordering of the tuples in
     self._nodes; namely, the changeset with the earliest time_range,
     with ties broken by comparing the changesets themselves."""
 
-    (time_range, changeset, node) = heapq.heappop(self._nodes)
-    return (node, changeset)
+    (time_range, changeset) = heapq.heappop(self._nodes)
+    return (changeset, time_range)
 
 
 class ChangesetGraph(object):
-  """A graph of changesets and their dependencies."""
+  """A graph of changesets and their dependencies.
+
+  The nodes are stored as ChangesetGraphNodes.  The graph algorithms
+  only access them via iterkeys(), __contains__(), __delitem__(), and
+  the _get_*() and _has_pred_ids() methods, which subclasses can
+  override to store the nodes differently.  Where the algorithms have
+  to choose among several nodes, they choose in a way that does not
+  depend on the order in which the ids are stored."""
 
   def __init__(self, changeset_db, cvs_item_to_changeset_id):
     self._changeset_db = changeset_db
@@ -88,9 +98,34 @@ class ChangesetGraph(object):
     # A map { id : ChangesetGraphNode }
     self.nodes = {}
 
+    # While consume_graph() is breaking a cycle, a list of the ids of
+    # the nodes that are added to the graph and a set of the ids of
+    # nodes that lose a predecessor; otherwise None:
+    self._added_ids = None
+    self._orphan_ids = None
+
+    # The number of nodes that the most recent call of search_for_path()
+    # visited:
+    self.search_visit_count = 0
+
+    # Statistics about search_for_path(), logged at DEBUG level when
+    # the graph is closed: the number of calls, and the total and the
+    # maximum number of nodes visited by a call:
+    self._search_count = 0
+    self._search_visit_total = 0
+    self._search_visit_max = 0
+
   def close(self):
-    self._cvs_item_to_changeset_id.close()
-    self._cvs_item_to_changeset_id = None
+    if self._search_count:
+      logger.debug(
+          'search_for_path() was called %d times, '
+          'visiting %d nodes in total and at most %d in one call'
+          % (self._search_count, self._search_visit_total,
+             self._search_visit_max,)
+          )
+    if self._cvs_item_to_changeset_id is not None:
+      self._cvs_item_to_changeset_id.close()
+      self._cvs_item_to_changeset_id = None
     self._changeset_db.close()
     self._changeset_db = None
 
@@ -100,7 +135,32 @@ class ChangesetGraph(object):
     Determine and record any dependencies to changesets that are
     already in the graph.  This method does not affect the databases."""
 
-    node = changeset.create_graph_node(self._cvs_item_to_changeset_id)
+    self._add_node(
+        changeset.create_graph_node(self._cvs_item_to_changeset_id)
+        )
+
+  def add_changesets(self, changesets):
+    """Add each of the changesets in iterable CHANGESETS to this graph.
+
+    The effect is the same as calling add_changeset() for each of
+    them, but the dependencies of config.CHANGESET_GRAPH_BATCH_SIZE
+    changesets at a time are looked up together (see
+    create_graph_nodes()).  So CHANGESETS should be ordered by id, to
+    keep the accesses to the databases sequential."""
+
+    batch = []
+    for changeset in changesets:
+      batch.append(changeset)
+      if len(batch) >= config.CHANGESET_GRAPH_BATCH_SIZE:
+        for node in create_graph_nodes(batch, self._cvs_item_to_changeset_id):
+          self._add_node(node)
+        batch = []
+
+    for node in create_graph_nodes(batch, self._cvs_item_to_changeset_id):
+      self._add_node(node)
+
+  def _add_node(self, node):
+    """Add NODE, a ChangesetGraphNode just created for a changeset."""
 
     # Now tie the node into our graph.  If a changeset referenced by
     # node is already in our graph, then add the backwards connection
@@ -122,6 +182,8 @@ class ChangesetGraph(object):
         node.succ_ids.remove(succ_id)
 
     self.nodes[node.id] = node
+    if self._added_ids is not None:
+      self._added_ids.append(node.id)
 
   def store_changeset(self, changeset):
     for cvs_item_id in changeset.cvs_item_ids:
@@ -185,38 +247,71 @@ class ChangesetGraph(object):
       pred.succ_ids.remove(node.id)
 
     del self.nodes[node.id]
+    if self._orphan_ids is not None:
+      self._orphan_ids.update(node.succ_ids)
 
   def keys(self):
     return self.nodes.keys()
 
+  def iterkeys(self):
+    return self.nodes.iterkeys()
+
   def __iter__(self):
     return self.nodes.itervalues()
 
-  def _get_path(self, reachable_changesets, starting_node_id, ending_node_id):
-    """Return the shortest path from ENDING_NODE_ID to STARTING_NODE_ID.
+  def _get_pred_ids(self, id):
+    """Return an iterable over the ids of the predecessors of node ID."""
 
-    Find a path from ENDING_NODE_ID to STARTING_NODE_ID in
-    REACHABLE_CHANGESETS, where STARTING_NODE_ID is the id of a
-    changeset that depends on the changeset with ENDING_NODE_ID.  (See
-    the comment in search_for_path() for a description of the format
-    of REACHABLE_CHANGESETS.)
+    return self.nodes[id].pred_ids
 
-    Return a list of changesets, where the 0th one has ENDING_NODE_ID
-    and the last one has STARTING_NODE_ID.  If there is no such path
-    described in in REACHABLE_CHANGESETS, return None."""
+  def _get_succ_ids(self, id):
+    """Return an iterable over the ids of the successors of node ID.
 
-    if ending_node_id not in reachable_changesets:
-      return None
+    The iterable must not be affected by deleting node ID."""
+
+    return self.nodes[id].succ_ids
 
-    path = [self._changeset_db[ending_node_id]]
-    id = reachable_changesets[ending_node_id][1]
-    while id != starting_node_id:
-      path.append(self._changeset_db[id])
-      id = reachable_changesets[id][1]
-    path.append(self._changeset_db[starting_node_id])
-    return path
+  def _has_pred_ids(self, id):
+    """Return True iff node ID has any predecessors."""
 
-  def search_for_path(self, starting_node_id, stop_set):
+    return bool(self.nodes[id].pred_ids)
+
+  def _get_time_range(self, id):
+    return self.nodes[id].time_range
+
+  def _get_path(
+        self, starting_node_id, stop_set, backward_steps, forward_steps,
+        meeting_node_id, at_start,
+        ):
+    """Return the path through MEETING_NODE_ID found by search_for_path().
+
+    BACKWARD_STEPS and FORWARD_STEPS are the maps built by
+    search_for_path() (see the comments there).  The path runs from a
+    node in STOP_SET to MEETING_NODE_ID via FORWARD_STEPS, then to
+    STARTING_NODE_ID via BACKWARD_STEPS, unless AT_START is True, in
+    which case MEETING_NODE_ID is STARTING_NODE_ID and ends the path.
+
+    Return a list of changesets, where the 0th one has an id in
+    STOP_SET and the last one has STARTING_NODE_ID."""
+
+    ids = []
+    id = meeting_node_id
+    while id not in stop_set:
+      ids.append(id)
+      id = forward_steps[id][1]
+    ids.append(id)
+    ids.reverse()
+
+    if not at_start:
+      id = backward_steps[meeting_node_id][1]
+      while id != starting_node_id:
+        ids.append(id)
+        id = backward_steps[id][1]
+      ids.append(starting_node_id)
+
+    return [self._changeset_db[id] for id in ids]
+
+  def search_for_path(self, starting_node_id, stop_set, max_steps=None):
     """Search for paths to prerequisites of STARTING_NODE_ID.
 
     Try to find the shortest dependency path that causes the changeset
@@ -226,39 +321,135 @@ class ChangesetGraph(object):
     We consider direct and indirect dependencies in the sense that the
     changeset can be reached by following a chain of predecessor nodes.
 
-    When one of the changeset_ids in STOP_SET is found, terminate the
-    search and return the path from that changeset_id to
-    STARTING_NODE_ID.  If no path is found to a node in STOP_SET,
-    return None."""
-
-    # A map {node_id : (steps, next_node_id)} where NODE_ID can be
-    # reached from STARTING_NODE_ID in STEPS steps, and NEXT_NODE_ID
-    # is the id of the previous node in the path.  STARTING_NODE_ID is
-    # only included as a key if there is a loop leading back to it.
-    reachable_changesets = {}
-
-    # A list of (node_id, steps) that still have to be investigated,
-    # and STEPS is the number of steps to get to NODE_ID.
-    open_nodes = [(starting_node_id, 0)]
-    # A breadth-first search:
-    while open_nodes:
-      (id, steps) = open_nodes.pop(0)
-      steps += 1
-      node = self[id]
-      for pred_id in node.pred_ids:
-        # Since the search is breadth-first, we only have to set steps
-        # that don't already exist.
-        if pred_id not in reachable_changesets:
-          reachable_changesets[pred_id] = (steps, id)
-          open_nodes.append((pred_id, steps))
-
-          # See if we can stop now:
-          if pred_id in stop_set:
-            return self._get_path(
-                reachable_changesets, starting_node_id, pred_id
-                )
+    The search is a breadth-first search from both ends at once:
+    backwards from STARTING_NODE_ID via predecessors, and forwards
+    from the nodes in STOP_SET via successors, one step at a time on
+    whichever side has fewer nodes to investigate next.  (When STOP_SET
+    is large, only the first side is searched.)  If MAX_STEPS is not
+    None, only paths with at most MAX_STEPS dependencies are found.
+
+    When the two searches meet, terminate the search and return the
+    path from the changeset_id in STOP_SET to STARTING_NODE_ID.  If no
+    path is found to a node in STOP_SET, return None."""
+
+    # Maps {node_id : (steps, next_node_id)}.  In BACKWARD_STEPS,
+    # STARTING_NODE_ID can be reached from NODE_ID in STEPS steps, and
+    # NEXT_NODE_ID is the id of the next node in the path.
+    # STARTING_NODE_ID is only included as a key if there is a loop
+    # leading back to it.  In FORWARD_STEPS, NODE_ID can be reached
+    # from a node in STOP_SET in STEPS steps, and NEXT_NODE_ID is the
+    # id of the previous node in the path.  The nodes in STOP_SET
+    # themselves are not included.
+    backward_steps = {}
+    forward_steps = {}
+
+    # The ids of the nodes that were reached in the last step of each
+    # search, and have still to be investigated.  FORWARD_NODES is
+    # only filled once the forward search starts:
+    backward_nodes = deque([starting_node_id])
+    forward_nodes = None
+
+    # The number of steps taken by each search:
+    backward_step = forward_step = 0
+
+    visit_count = 0
+
+    # (meeting_node_id, at_start) for the path that was found, or None:
+    path = None
+
+    while backward_nodes and (forward_nodes is None or forward_nodes):
+      if max_steps is not None and backward_step + forward_step >= max_steps:
+        # Any path that remains to be found would be too long.
+        break
+
+      if forward_nodes is None:
+        forward_size = len(stop_set)
+      else:
+        forward_size = len(forward_nodes)
+
+      # The number of steps needed to reach the other search from the
+      # node where the two searches meet, for the best path found in
+      # this step:
+      best_remaining_steps = None
+
+      if len(backward_nodes) <= forward_size:
+        backward_step += 1
+        for i in xrange(len(backward_nodes)):
+          id = backward_nodes.popleft()
+          for pred_id in sorted(self._get_pred_ids(id)):
+            # Since the search is breadth-first, we only have to set
+            # steps that don't already exist.
+            if pred_id in backward_steps:
+              continue
+            backward_steps[pred_id] = (backward_step, id)
+            backward_nodes.append(pred_id)
+            visit_count += 1
+
+            # See if the searches meet here:
+            if pred_id in stop_set:
+              remaining_steps = 0
+            elif pred_id in forward_steps:
+              remaining_steps = forward_steps[pred_id][0]
+            else:
+              continue
+            if best_remaining_steps is None \
+                   or remaining_steps < best_remaining_steps:
+              best_remaining_steps = remaining_steps
+              path = (pred_id, False)
+            if remaining_steps == 0:
+              break
+          if best_remaining_steps == 0:
+            break
+      else:
+        if forward_nodes is None:
+          forward_nodes = deque(sorted([id for id in stop_set if id in self]))
+        forward_step += 1
+        for i in xrange(len(forward_nodes)):
+          id = forward_nodes.popleft()
+          for succ_id in sorted(self._get_succ_ids(id)):
+            if succ_id in stop_set or succ_id in forward_steps:
+              continue
+            forward_steps[succ_id] = (forward_step, id)
+            forward_nodes.append(succ_id)
+            visit_count += 1
+
+            # See if the searches meet here:
+            if succ_id == starting_node_id:
+              remaining_steps = 0
+            elif succ_id in backward_steps:
+              remaining_steps = backward_steps[succ_id][0]
+            else:
+              continue
+            if best_remaining_steps is None \
+                   or remaining_steps < best_remaining_steps:
+              best_remaining_steps = remaining_steps
+              path = (succ_id, remaining_steps == 0)
+            if remaining_steps == 0:
+              break
+          if best_remaining_steps == 0:
+            break
+
+      if path is not None:
+        break
+
+    self.search_visit_count = visit_count
+    self._search_count += 1
+    self._search_visit_total += visit_count
+    self._search_visit_max = max(self._search_visit_max, visit_count)
+    if logger.is_on(logger.DEBUG):
+      logger.debug(
+          'search_for_path(%x) visited %d nodes'
+          % (starting_node_id, visit_count,)
+          )
+
+    if path is None:
+      return None
 
-    return None
+    (meeting_node_id, at_start) = path
+    return self._get_path(
+        starting_node_id, stop_set, backward_steps, forward_steps,
+        meeting_node_id, at_start,
+        )
 
   def consume_nopred_nodes(self):
     """Remove and yield changesets in dependency order.
@@ -278,26 +469,34 @@ class ChangesetGraph(object):
     The graph should not be otherwise altered while this generator is
     running."""
 
-    # Find a list of (node,changeset,) where the node has no
-    # predecessors:
+    # Find the nodes that have no predecessors:
+    return self._consume_nopred_nodes(
+        id
+        for id in self.iterkeys()
+        if not self._has_pred_ids(id)
+        )
+
+  def _consume_nopred_nodes(self, nopred_ids):
+    """Remove and yield changesets in dependency order.
+
+    Work like consume_nopred_nodes(), except that NOPRED_IDS, an
+    iterable over the ids of nodes without predecessors, must include
+    every node in the graph that has no predecessors."""
+
     nopred_nodes = _NoPredNodes(
-      self._changeset_db,
-      (
-          node
-          for node in self.nodes.itervalues()
-          if not node.pred_ids
-          ),
-      )
+        self._changeset_db,
+        ((id, self._get_time_range(id)) for id in nopred_ids),
+        )
 
     while nopred_nodes:
-      (node, changeset,) = nopred_nodes.get()
-      del self[node.id]
+      (changeset, time_range,) = nopred_nodes.get()
+      succ_ids = self._get_succ_ids(changeset.id)
+      del self[changeset.id]
       # See if any successors are now ready for extraction:
-      for succ_id in node.succ_ids:
-        succ = self[succ_id]
-        if not succ.pred_ids:
-          nopred_nodes.add(succ)
-      yield (changeset, node.time_range)
+      for succ_id in succ_ids:
+        if not self._has_pred_ids(succ_id):
+          nopred_nodes.add(succ_id, self._get_time_range(succ_id))
+      yield (changeset, time_range)
 
   def find_cycle(self, starting_node_id):
     """Find a cycle in the dependency graph and return it.
@@ -312,29 +511,115 @@ class ChangesetGraph(object):
     # graph must either be involved in a cycle or depend (directly or
     # indirectly) on nodes that are in a cycle.
 
-    # Pick an arbitrary node:
-    node = self[starting_node_id]
+    return self._find_cycle(starting_node_id, self)
+
+  def _find_cycle(self, starting_node_id, ids):
+    """Find a cycle among the nodes with IDS and return it.
+
+    IDS is a container of node ids.  Start looking at STARTING_NODE_ID,
+    which must be in IDS, and follow predecessors that are in IDS.
+    Every node in IDS must have such a predecessor.  Return the cycle
+    in the form described in find_cycle()."""
 
-    seen_nodes = [node]
+    id = starting_node_id
+
+    seen_ids = [id]
+
+    # A map {node_id : index} of the positions of the nodes in
+    # seen_ids:
+    seen_id_indexes = {id : 0}
 
     # Follow it backwards until a node is seen a second time; then we
     # have our cycle.
     while True:
-      # Pick an arbitrary predecessor of node.  It must exist, because
-      # there are no nopred nodes:
-      try:
-        node_id = node.pred_ids.__iter__().next()
-      except StopIteration:
-        raise NoPredNodeInGraphException(node)
-      node = self[node_id]
-      try:
-        i = seen_nodes.index(node)
-      except ValueError:
-        seen_nodes.append(node)
+      # Pick the predecessor of the node in IDS that has the smallest
+      # id.  It must exist, because there are no nopred nodes:
+      pred_ids = [
+          pred_id
+          for pred_id in self._get_pred_ids(id)
+          if pred_id in ids
+          ]
+      if not pred_ids:
+        raise NoPredNodeInGraphException(self[id])
+      id = min(pred_ids)
+      i = seen_id_indexes.get(id)
+      if i is None:
+        seen_id_indexes[id] = len(seen_ids)
+        seen_ids.append(id)
       else:
-        seen_nodes = seen_nodes[i:]
-        seen_nodes.reverse()
-        return [self._changeset_db[node.id] for node in seen_nodes]
+        seen_ids = seen_ids[i:]
+        seen_ids.reverse()
+        return [self._changeset_db[id] for id in seen_ids]
+
+  def _find_cyclic_components(self, ids):
+    """Return the strongly connected components among IDS with cycles.
+
+    IDS is a set of node ids; only the dependencies among those nodes
+    are considered.  Return a list of the components
+    that contain at least one cycle, each as a set of node ids.  Any
+    component is listed after the components that it depends on.
+
+    This is an iterative version of Tarjan's algorithm, following the
+    dependencies from each node to its predecessors."""
+
+    # Maps {node_id : index} and {node_id : lowlink}, where INDEX is
+    # the order in which the node was visited and LOWLINK is the
+    # lowest index of any node on the stack that is known to be
+    # reachable from it:
+    indexes = {}
+    lowlinks = {}
+
+    # The nodes that have been visited but not yet assigned to a
+    # component, and the same ids as a set:
+    stack = []
+    on_stack = set()
+
+    components = []
+
+    for root_id in sorted(ids):
+      if root_id in indexes:
+        continue
+
+      indexes[root_id] = lowlinks[root_id] = len(indexes)
+      stack.append(root_id)
+      on_stack.add(root_id)
+      # A list of (node_id, pred_ids_iterator) for the depth-first
+      # search that is in progress:
+      path = [(root_id, iter(sorted(self._get_pred_ids(root_id))))]
+      while path:
+        (id, pred_ids) = path[-1]
+        for pred_id in pred_ids:
+          if pred_id not in ids:
+            pass
+          elif pred_id not in indexes:
+            indexes[pred_id] = lowlinks[pred_id] = len(indexes)
+            stack.append(pred_id)
+            on_stack.add(pred_id)
+            path.append(
+                (pred_id, iter(sorted(self._get_pred_ids(pred_id))))
+                )
+            break
+          elif pred_id in on_stack:
+            lowlinks[id] = min(lowlinks[id], indexes[pred_id])
+        else:
+          # All of the predecessors of ID have been searched.
+          del path[-1]
+          if path:
+            parent_id = path[-1][0]
+            lowlinks[parent_id] = min(lowlinks[parent_id], lowlinks[id])
+          if lowlinks[id] == indexes[id]:
+            # ID is the root of a strongly connected component, which
+            # consists of the nodes above it on the stack:
+            i = len(stack) - 1
+            while stack[i] != id:
+              i -= 1
+            component = set(stack[i:])
+            del stack[i:]
+            on_stack.difference_update(component)
+            if len(component) > 1 or id in self._get_pred_ids(id):
+              components.append(component)
+
+    return components
 
   def consume_graph(self, cycle_breaker=None):
     """Remove and yield changesets from this graph in dependency order.
@@ -346,34 +631,64 @@ class ChangesetGraph(object):
     is the list of changesets that are involved in the cycle (ordered
     such that cycle[n-1] is a predecessor of cycle[n] and cycle[-1] is
     a predecessor of cycle[0]).  CYCLE_BREAKER should break the cycle
-    in place then return.
+    in place then return.  It may only delete changesets of the cycle
+    from the graph and add changesets that they are split into.
 
     If a cycle is found and CYCLE_BREAKER was not specified, raise
-    CycleInGraphException."""
+    CycleInGraphException.
 
-    while True:
-      for (changeset, time_range) in self.consume_nopred_nodes():
-        yield (changeset, time_range)
+    Once no more nodes without predecessors are left, the graph is
+    divided into strongly connected components, and cycles are found
+    and broken in one component at a time.  Breaking a cycle cannot
+    affect the other components, so afterwards only the nodes that
+    are left of the component have to be examined again."""
 
-      # If there are any nodes left in the graph, then there must be
-      # at least one cycle.  Find a cycle and process it.
+    for (changeset, time_range) in self.consume_nopred_nodes():
+      yield (changeset, time_range)
 
-      # This might raise StopIteration, but that indicates that the
-      # graph has been fully consumed, so we just let the exception
-      # escape.
-      start_node_id = self.nodes.iterkeys().next()
+    # A stack of the components that still have to be processed, with
+    # the first component that has to be processed at the end:
+    components = self._find_cyclic_components(set(self.iterkeys()))
+    components.reverse()
 
-      cycle = self.find_cycle(start_node_id)
+    while components:
+      component = components.pop()
 
-      if cycle_breaker is not None:
-        cycle_breaker(cycle)
-      else:
+      cycle = self._find_cycle(min(component), component)
+
+      if cycle_breaker is None:
         raise CycleInGraphException(cycle)
 
+      self._added_ids = []
+      self._orphan_ids = set()
+      try:
+        cycle_breaker(cycle)
+        added_ids = self._added_ids
+        orphan_ids = self._orphan_ids
+      finally:
+        self._added_ids = None
+        self._orphan_ids = None
+
+      # Any nodes that have no predecessors now must have been added
+      # or have lost a predecessor:
+      orphan_ids.update(added_ids)
+      for (changeset, time_range) in self._consume_nopred_nodes(
+            id
+            for id in orphan_ids
+            if id in self and not self._has_pred_ids(id)
+            ):
+        yield (changeset, time_range)
+
+      component.update(added_ids)
+      component = set([id for id in component if id in self])
+      new_components = self._find_cyclic_components(component)
+      new_components.reverse()
+      components.extend(new_components)
+
   def __repr__(self):
     """For convenience only.  The format is subject to change at any time."""
 
-    if self.nodes:
+    if self:
       return 'ChangesetGraph:\n%s' \
              % ''.join(['  %r\n' % node for node in self])
     else:
@@ -51,7 +51,8 @@ TextRecords come in several varieties:
 
 FullTextRecord -- Used for revisions whose fulltext is derived
     directly from the RCS file by the InternalRevisionCollector (i.e.,
-    typically revision 1.1 of each file).
+    typically revision 1.1 of each file), or whose fulltext it stored
+    to keep the chains of deltas short.
 
 DeltaTextRecord -- Used for revisions that are defined via a delta
     relative to some other TextRecord.  These records record the id of
@@ -89,8 +90,10 @@ from cvs2svn_lib.log import logger
 from cvs2svn_lib.artifact_manager import artifact_manager
 from cvs2svn_lib.cvs_item import CVSRevisionModification
 from cvs2svn_lib.indexed_database import IndexedDatabase
+from cvs2svn_lib.checkout_store import CheckoutStore
 from cvs2svn_lib.rcs_stream import RCSStream
 from cvs2svn_lib.rcs_stream import MalformedDeltaException
+from cvs2svn_lib.rcs_stream import generate_edits
 from cvs2svn_lib.keyword_expander import expand_keywords
 from cvs2svn_lib.keyword_expander import collapse_keywords
 from cvs2svn_lib.revision_manager import RevisionCollector
@@ -223,7 +226,7 @@ class DeltaTextRecord(TextRecord):
       del text_record_db[self.id]
     else:
       # Store a new CheckedOutTextRecord in place of ourselves:
-      text_record_db.checkout_db['%x' % self.id] = text
+      text_record_db.checkout_db[self.id] = text
       new_text_record = CheckedOutTextRecord(self.id)
       new_text_record.refcount = self.refcount
       text_record_db.replace(new_text_record)
@@ -255,12 +258,12 @@ class CheckedOutTextRecord(TextRecord):
     (self.id, self.refcount,) = state
 
   def checkout(self, text_record_db):
-    text = text_record_db.checkout_db['%x' % self.id]
+    text = text_record_db.checkout_db[self.id]
     self.decrement_refcount(text_record_db)
     return text
 
   def free(self, text_record_db):
-    del text_record_db.checkout_db['%x' % self.id]
+    del text_record_db.checkout_db[self.id]
 
   def __str__(self):
     return 'CheckedOutTextRecord(%x, %d)' % (self.id, self.refcount,)
@@ -482,6 +485,11 @@ class _Sink(Sink):
     for branch in branches:
       self.base_revisions[branch] = revision
 
+  def accepts_deltatext_handles(self):
+    # The deltas are parsed directly out of the parser's buffer, so
+    # only the added lines need to be copied:
+    return True
+
   def set_revision_info(self, revision, log, text):
     if revision in self.revisions_seen:
       # One common form of CVS repository corruption is that the
@@ -510,7 +518,7 @@ class _Sink(Sink):
       if revision == self.head_revision:
         # This is HEAD, as fulltext.  Initialize the RCSStream so
         # that we can compute deltas backwards in time.
-        self._rcs_stream = RCSStream(text)
+        self._rcs_stream = RCSStream(text.read())
         self._rcs_stream_revision = revision
       else:
         # Any other trunk revision is a backward delta.  Apply the
@@ -518,7 +526,9 @@ class _Sink(Sink):
         # revision, and also to get the reverse delta, which we store
         # as the forward delta of our child revision.
         try:
-          text = self._rcs_stream.invert_diff(text)
+          text = self._rcs_stream.invert_edits(
+              generate_edits(*text.get_buffer())
+              )
         except MalformedDeltaException, e:
           logger.error(
               'Malformed RCS delta in %s, revision %s: %s'
@@ -558,11 +568,75 @@ class _Sink(Sink):
           cvs_rev_id,
           self.cvs_file_items.original_ids[self.base_revisions[revision]]
           )
-      self.revision_collector._writeout(text_record, text)
+      self.revision_collector._writeout(text_record, text.read())
 
     return None
 
 
+class _DeltaDatabaseWriter(object):
+  """Writes the texts collected by InternalRevisionCollector to the delta_db.
+
+  If the texts are to be compressed, the first
+  config.INTERNAL_CO_DICTIONARY_SAMPLE_SIZE bytes of them are held in
+  memory until they can be used to build the compression dictionary,
+  which has to be known when the IndexedDatabase is created."""
+
+  def __init__(self, compress):
+    self._db = None
+
+    # A map {cvs_rev_id : text} of the texts that have not been written
+    # to self._db yet, and their total size:
+    self._sample = {}
+    self._sample_size = 0
+
+    if not compress:
+      self._open(MarshalSerializer())
+
+  def _open(self, serializer):
+    self._db = IndexedDatabase(
+        artifact_manager.get_temp_file(config.RCS_DELTAS_STORE),
+        artifact_manager.get_temp_file(config.RCS_DELTAS_INDEX_TABLE),
+        DB_OPEN_NEW, serializer,
+        )
+    ids = self._sample.keys()
+    ids.sort()
+    for id in ids:
+      self._db[id] = self._sample[id]
+    self._sample = None
+
+  def _open_compressed(self):
+    self._open(CompressingSerializer(
+        MarshalSerializer(), config.INTERNAL_CO_COMPRESSION_LEVEL,
+        self._sample.values(),
+        ))
+
+  def __setitem__(self, id, text):
+    if self._db is not None:
+      self._db[id] = text
+    else:
+      self._sample[id] = text
+      self._sample_size += len(text)
+      if self._sample_size >= config.INTERNAL_CO_DICTIONARY_SAMPLE_SIZE:
+        self._open_compressed()
+
+  def __getitem__(self, id):
+    if self._db is not None:
+      return self._db[id]
+    else:
+      return self._sample[id]
+
+  def __delitem__(self, id):
+    if self._db is not None:
+      del self._db[id]
+    else:
+      del self._sample[id]
+
+  def close(self):
+    if self._db is None:
+      self._open_compressed()
+    self._db.close()
+
+
 class InternalRevisionCollector(RevisionCollector):
   """The RevisionCollector used by InternalRevisionReader."""
 
@@ -581,14 +655,7 @@ class InternalRevisionCollector(RevisionCollector):
     artifact_manager.register_temp_file(config.RCS_TREES_STORE, which_pass)
 
   def start(self):
-    serializer = MarshalSerializer()
-    if self._compress:
-      serializer = CompressingSerializer(serializer)
-    self._delta_db = IndexedDatabase(
-        artifact_manager.get_temp_file(config.RCS_DELTAS_STORE),
-        artifact_manager.get_temp_file(config.RCS_DELTAS_INDEX_TABLE),
-        DB_OPEN_NEW, serializer,
-        )
+    self._delta_db = _DeltaDatabaseWriter(self._compress)
     primer = (FullTextRecord, DeltaTextRecord)
     self._rcs_trees = IndexedDatabase(
         artifact_manager.get_temp_file(config.RCS_TREES_STORE),
@@ -599,6 +666,60 @@ class InternalRevisionCollector(RevisionCollector):
   def _writeout(self, text_record, text):
     self.text_record_db.add(text_record)
     self._delta_db[text_record.id] = text
+    self._text_sizes[text_record.id] = len(text)
+
+  def _store_snapshots(self):
+    """Store fulltexts in place of deltas that end overlong delta chains.
+
+    Rebuilding the text of a DeltaTextRecord requires applying the
+    deltas of all of its ancestors back to the nearest FullTextRecord.
+    Whenever that would mean applying more than
+    config.INTERNAL_CO_MAX_DELTA_CHAIN deltas, or more than
+    config.INTERNAL_CO_MAX_DELTA_CHAIN_SIZE bytes of deltas, replace
+    the DeltaTextRecord with a FullTextRecord and store the revision's
+    fulltext to the delta_db instead of its delta."""
+
+    text_record_db = self.text_record_db
+
+    # A map {pred_id : [id, ...]} of the DeltaTextRecords that are
+    # defined relative to each record, and the ids of the
+    # FullTextRecords:
+    children = {}
+    roots = []
+    for text_record in text_record_db.itervalues():
+      if isinstance(text_record, DeltaTextRecord):
+        children.setdefault(text_record.pred_id, []).append(text_record.id)
+      else:
+        roots.append(text_record.id)
+
+    # Walk the records depth-first.  Each stack entry is (ids, size),
+    # where IDS are the ids of a record and of its ancestors back to
+    # the nearest FullTextRecord (in reverse order), and SIZE is the
+    # total size of their deltas:
+    stack = [([id], 0) for id in roots]
+    while stack:
+      (ids, size) = stack.pop()
+      for child_id in children.get(ids[-1], []):
+        child_ids = ids + [child_id]
+        child_size = size + self._text_sizes[child_id]
+        if len(ids) > config.INTERNAL_CO_MAX_DELTA_CHAIN \
+               or child_size > config.INTERNAL_CO_MAX_DELTA_CHAIN_SIZE:
+          rcs_stream = RCSStream(self._delta_db[child_ids[0]])
+          for id in child_ids[1:]:
+            rcs_stream.apply_diff(self._delta_db[id])
+          self._delta_db[child_id] = rcs_stream.get_text()
+          del rcs_stream
+
+          text_record = text_record_db[child_id]
+          new_text_record = FullTextRecord(child_id)
+          new_text_record.refcount = text_record.refcount
+          text_record_db.replace(new_text_record)
+          text_record_db[text_record.pred_id].decrement_refcount(
+              text_record_db
+              )
+          stack.append(([child_id], 0))
+        else:
+          stack.append((child_ids, child_size))
 
   def process_file(self, cvs_file_items):
     """Read revision information for the file described by CVS_FILE_ITEMS.
@@ -610,6 +731,10 @@ class InternalRevisionCollector(RevisionCollector):
     # A map from cvs_rev_id to TextRecord instance:
     self.text_record_db = TextRecordDatabase(self._delta_db, NullDatabase())
 
+    # A map {cvs_rev_id : size} of the sizes of the texts written for
+    # this file:
+    self._text_sizes = {}
+
     f = open(cvs_file_items.cvs_file.rcs_path, 'rb')
     try:
       parse(f, _Sink(self, cvs_file_items))
@@ -618,8 +743,10 @@ class InternalRevisionCollector(RevisionCollector):
 
     self.text_record_db.recompute_refcounts(cvs_file_items)
     self.text_record_db.free_unused()
+    self._store_snapshots()
     self._rcs_trees[cvs_file_items.cvs_file.id] = self.text_record_db
     del self.text_record_db
+    del self._text_sizes
 
   def finish(self):
     self._delta_db.close()
@@ -630,12 +757,6 @@ class InternalRevisionReader(RevisionReader):
   """A RevisionReader that reads the contents from an own delta store."""
 
   def __init__(self, compress):
-    # Only import Database if an InternalRevisionReader is really
-    # instantiated, because the import fails if a decent dbm is not
-    # installed.
-    from cvs2svn_lib.database import Database
-    self._Database = Database
-
     self._compress = compress
 
   def register_artifacts(self, which_pass):
@@ -665,12 +786,19 @@ class InternalRevisionReader(RevisionReader):
         artifact_manager.get_temp_file(config.RCS_TREES_INDEX_TABLE),
         DB_OPEN_READ,
         )
-    serializer = MarshalSerializer()
     if self._compress:
-      serializer = CompressingSerializer(serializer)
-    self._co_db = self._Database(
+      # The fulltexts resemble the texts in the delta_db, so use the
+      # same compression dictionary:
+      serializer = self._delta_db.serializer
+      if not isinstance(serializer, CompressingSerializer):
+        serializer = CompressingSerializer(
+            MarshalSerializer(), config.INTERNAL_CO_COMPRESSION_LEVEL
+            )
+    else:
+      serializer = MarshalSerializer()
+    self._co_db = CheckoutStore(
         artifact_manager.get_temp_file(config.CVS_CHECKOUT_DB),
-        DB_OPEN_NEW, serializer,
+        serializer, config.CHECKOUT_STORE_MEMORY,
         )
 
     # The set of CVSFile instances whose TextRecords have already been
@@ -756,4 +884,10 @@ class InternalRevisionReader(RevisionReader):
     self._delta_db.close()
     self._tree_db.close()
     self._co_db.close()
+    self._peak_sizes = (
+        self._co_db.peak_memory_size, self._co_db.peak_file_size,
+        )
+
+  def record_statistics(self, stats_keeper):
+    stats_keeper.set_checkout_store_peak_sizes(*self._peak_sizes)
 
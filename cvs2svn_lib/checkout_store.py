@@ -0,0 +1,279 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2000-2009 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""This module contains class CheckoutStore."""
+
+
+import bisect
+
+from cvs2svn_lib.log import logger
+
+
+class CheckoutStore:
+  """A store for the transient fulltexts used by InternalRevisionReader.
+
+  A fulltext is stored when it is checked out and deleted when the
+  last revision that depends on it has been checked out, so most
+  fulltexts are short-lived.  The keys are cvs_rev_ids and the values
+  are strings.
+
+  Up to about MEMORY_LIMIT bytes of fulltexts are held in memory.
+  When that limit is exceeded, fulltexts are spilled to a file in the
+  order in which they were stored, except that a fulltext that has
+  been read since it was last considered gets a second chance (as in
+  the CLOCK algorithm).  Spilled fulltexts are serialized using
+  SERIALIZER.
+
+  The file is written by appending, but the extents freed by deleted
+  fulltexts are recorded in a free-space map and reused (best fit) for
+  fulltexts spilled later.  Adjacent free extents are merged, and free
+  space at the end of the file is given back.  If more than
+  COMPACTION_RATIO of the file is nevertheless free, the live
+  fulltexts are moved to the start of the file, in place, and the file
+  is truncated."""
+
+  # The approximate overhead of a fulltext held in memory, in bytes,
+  # in addition to its length:
+  OVERHEAD_PER_TEXT = 100
+
+  # The fraction of free space in the file above which the file is
+  # compacted, and the size below which it is never compacted:
+  COMPACTION_RATIO = 0.5
+  MIN_COMPACTION_SIZE = 1024 * 1024
+
+  # Compaction copies fulltexts in chunks of at most this many bytes:
+  COMPACTION_CHUNK_SIZE = 1024 * 1024
+
+  def __init__(self, filename, serializer, memory_limit):
+    self.filename = filename
+    self.serializer = serializer
+    self.memory_limit = memory_limit
+
+    # The fulltexts held in memory, as a map {id : [referenced, text]},
+    # and the approximate amount of memory that they use.  REFERENCED
+    # is set when the text is read, and cleared when it is given a
+    # second chance.
+    self._memory = {}
+    self._memory_size = 0
+
+    # The ids of the fulltexts held in memory, in the order in which
+    # they are to be considered for spilling, starting at
+    # self._queue_pos.  Deleted fulltexts are not removed from this
+    # list, so it can contain ids that are no longer in self._memory.
+    self._queue = []
+    self._queue_pos = 0
+
+    self.f = open(self.filename, 'wb+')
+
+    # The spilled fulltexts, as a map {id : (offset, length)}:
+    self._index = {}
+
+    # The end of the used part of the file:
+    self._eof = 0
+
+    # The free-space map.  The free extents in the file (excluding the
+    # space after self._eof) as a sorted list of (length, offset)
+    # tuples, and maps {offset : length} and {offset + length : offset}
+    # for finding the neighbours of extents that are freed:
+    self._free = []
+    self._free_starts = {}
+    self._free_ends = {}
+    self._free_size = 0
+
+    # Statistics:
+    self.peak_memory_size = 0
+    self.peak_file_size = 0
+    self._spills = 0
+    self._compactions = 0
+
+  def __getitem__(self, id):
+    try:
+      entry = self._memory[id]
+    except KeyError:
+      (offset, length) = self._index[id]
+      self.f.seek(offset)
+      return self.serializer.loads(self.f.read(length))
+    else:
+      entry[0] = True
+      return entry[1]
+
+  def __setitem__(self, id, text):
+    if id in self._memory or id in self._index:
+      del self[id]
+
+    self._memory[id] = [False, text]
+    self._queue.append(id)
+    self._memory_size += len(text) + self.OVERHEAD_PER_TEXT
+    while self._memory_size > self.memory_limit:
+      self._spill_one()
+    if self._memory_size > self.peak_memory_size:
+      self.peak_memory_size = self._memory_size
+
+  def __delitem__(self, id):
+    try:
+      entry = self._memory.pop(id)
+    except KeyError:
+      (offset, length) = self._index.pop(id)
+      self._release(offset, length)
+    else:
+      self._memory_size -= len(entry[1]) + self.OVERHEAD_PER_TEXT
+      if len(self._queue) > 2 * len(self._memory) + 1000:
+        self._clean_queue()
+
+  def _clean_queue(self):
+    """Remove the ids of deleted fulltexts from self._queue."""
+
+    memory = self._memory
+    self._queue = [
+        id for id in self._queue[self._queue_pos:] if id in memory
+        ]
+    self._queue_pos = 0
+
+  def _spill_one(self):
+    """Move one fulltext from memory to the file, choosing it via CLOCK."""
+
+    while True:
+      if self._queue_pos >= len(self._queue):
+        self._clean_queue()
+      id = self._queue[self._queue_pos]
+      self._queue_pos += 1
+      entry = self._memory.get(id)
+      if entry is None:
+        # The fulltext was deleted.
+        pass
+      elif entry[0]:
+        # Give the fulltext a second chance:
+        entry[0] = False
+        self._queue.append(id)
+      else:
+        break
+
+    if self._queue_pos > len(self._queue) // 2:
+      self._clean_queue()
+
+    del self._memory[id]
+    text = entry[1]
+    self._memory_size -= len(text) + self.OVERHEAD_PER_TEXT
+
+    data = self.serializer.dumps(text)
+    offset = self._allocate(len(data))
+    self.f.seek(offset)
+    self.f.write(data)
+    self._index[id] = (offset, len(data))
+    self._spills += 1
+
+  def _add_free(self, offset, length):
+    bisect.insort(self._free, (length, offset))
+    self._free_starts[offset] = length
+    self._free_ends[offset + length] = offset
+    self._free_size += length
+
+  def _remove_free(self, offset, length):
+    del self._free[bisect.bisect_left(self._free, (length, offset))]
+    del self._free_starts[offset]
+    del self._free_ends[offset + length]
+    self._free_size -= length
+
+  def _allocate(self, length):
+    """Return the offset of a new extent of LENGTH bytes in the file."""
+
+    i = bisect.bisect_left(self._free, (length, 0))
+    if i < len(self._free):
+      (free_length, offset) = self._free[i]
+      self._remove_free(offset, free_length)
+      if free_length > length:
+        self._add_free(offset + length, free_length - length)
+    else:
+      offset = self._eof
+      self._eof += length
+      if self._eof > self.peak_file_size:
+        self.peak_file_size = self._eof
+    return offset
+
+  def _release(self, offset, length):
+    """Record that the extent of LENGTH bytes at OFFSET is free."""
+
+    next_length = self._free_starts.get(offset + length)
+    if next_length is not None:
+      self._remove_free(offset + length, next_length)
+      length += next_length
+
+    prev_offset = self._free_ends.get(offset)
+    if prev_offset is not None:
+      prev_length = self._free_starts[prev_offset]
+      self._remove_free(prev_offset, prev_length)
+      offset = prev_offset
+      length += prev_length
+
+    if offset + length == self._eof:
+      self._eof = offset
+    else:
+      self._add_free(offset, length)
+
+    if self._eof >= self.MIN_COMPACTION_SIZE \
+           and self._free_size > self.COMPACTION_RATIO * self._eof:
+      self._compact()
+
+  def _compact(self):
+    """Move the spilled fulltexts to the start of the file.
+
+    Fulltexts are moved in file order, each to an offset no greater
+    than its old one, so they can be moved within the file."""
+
+    extents = [
+        (offset, length, id)
+        for (id, (offset, length)) in self._index.iteritems()
+        ]
+    extents.sort()
+
+    new_offset = 0
+    for (offset, length, id) in extents:
+      if offset != new_offset:
+        # Copy the fulltext in chunks, each of which is read before it
+        # is overwritten:
+        done = 0
+        while done < length:
+          n = min(length - done, self.COMPACTION_CHUNK_SIZE)
+          self.f.seek(offset + done)
+          data = self.f.read(n)
+          self.f.seek(new_offset + done)
+          self.f.write(data)
+          done += n
+        self._index[id] = (new_offset, length)
+      new_offset += length
+
+    self._eof = new_offset
+    self.f.truncate(self._eof)
+    self._free = []
+    self._free_starts = {}
+    self._free_ends = {}
+    self._free_size = 0
+    self._compactions += 1
+
+  def close(self):
+    logger.debug(
+        'Checkout store %s: peak memory %d bytes, peak file size %d bytes, '
+        '%d fulltexts spilled, %d compactions'
+        % (self.filename, self.peak_memory_size, self.peak_file_size,
+           self._spills, self._compactions,)
+        )
+    self._memory = None
+    self._queue = None
+    self._index = None
+    self.f.close()
+    self.f = None
+
+
@@ -48,9 +48,11 @@ or branch.
 
 
 import re
+from collections import deque
 
 from cvs2svn_lib import config
 from cvs2svn_lib.common import DB_OPEN_NEW
+from cvs2svn_lib.common import FatalError
 from cvs2svn_lib.common import warning_prefix
 from cvs2svn_lib.common import error_prefix
 from cvs2svn_lib.common import is_trunk_revision
@@ -73,6 +75,7 @@ from cvs2svn_lib.cvs_item_database import NewCVSItemStore
 from cvs2svn_lib.symbol_statistics import SymbolStatisticsCollector
 from cvs2svn_lib.metadata_database import MetadataDatabase
 from cvs2svn_lib.metadata_database import MetadataLogger
+from cvs2svn_lib.rcs_parse_cache import RCSParseCache
 
 from cvs2svn_lib.rcsparser import Sink
 from cvs2svn_lib.rcsparser import parse
@@ -791,6 +794,14 @@ class _FileDataCollector(Sink):
     self.cvs_file.description = description
     self.cvs_file.determine_file_properties(Ctx().file_property_setters)
 
+  def accepts_deltatext_handles(self):
+    """This is a callback method declared in Sink.
+
+    The deltatexts are not needed during data collection (we only
+    check whether they are empty), so let the parser skip them."""
+
+    return True
+
   def set_revision_info(self, revision, log, text):
     """This is a callback method declared in Sink."""
 
@@ -978,11 +989,200 @@ class _FileDataCollector(Sink):
     self._cvs_file_items.check_link_consistency()
 
 
+class _RecordingSink(Sink):
+  """A Sink that records the callbacks that it receives.
+
+  This class is used to parse RCS files in a worker process or for the
+  RCSParseCache.  The recorded callbacks are later replayed into a
+  _FileDataCollector.  This way, all ids are still allocated in the
+  main process, in the same order as for a serial run, and all options
+  that affect the collected data are applied during the replay.
+
+  The deltatexts themselves are not needed by _FileDataCollector (it
+  only cares whether they are empty), so only that fact is recorded."""
+
+  def __init__(self):
+    # A list [(method_name, args), ...] of the callbacks received:
+    self.events = []
+
+  def set_principal_branch(self, branch):
+    self.events.append(('set_principal_branch', (branch,)))
+
+  def define_tag(self, name, revision):
+    self.events.append(('define_tag', (name, revision,)))
+
+  def set_expansion(self, mode):
+    self.events.append(('set_expansion', (mode,)))
+
+  def admin_completed(self):
+    self.events.append(('admin_completed', ()))
+
+  def define_revision(self, revision, timestamp, author, state,
+                      branches, next):
+    self.events.append((
+        'define_revision',
+        (revision, timestamp, author, state, branches, next,),
+        ))
+
+  def tree_completed(self):
+    self.events.append(('tree_completed', ()))
+
+  def set_description(self, description):
+    self.events.append(('set_description', (description,)))
+
+  def accepts_deltatext_handles(self):
+    return True
+
+  def set_revision_info(self, revision, log, text):
+    self.events.append(('set_revision_info', (revision, log, bool(text),)))
+
+  def parse_completed(self):
+    self.events.append(('parse_completed', ()))
+
+
+def _parse_rcs_file(rcs_path):
+  """Parse the RCS file at RCS_PATH, recording the Sink callbacks.
+
+  Return a tuple (events, error), where EVENTS is the list of
+  callbacks recorded by a _RecordingSink, and ERROR is None or a tuple
+  (exception_class, message) describing a parse error that occurred
+  after EVENTS.  (The exceptions themselves are not returned because
+  they cannot necessarily be pickled or cached.)"""
+
+  sink = _RecordingSink()
+  try:
+    f = open(rcs_path, 'rb')
+    try:
+      parse(f, sink)
+    finally:
+      f.close()
+  except RCSParseError, e:
+    return (sink.events, (RCSParseError, str(e),))
+  except RuntimeError, e:
+    return (sink.events, (RuntimeError, str(e),))
+  except ValueError, e:
+    return (sink.events, (ValueError, str(e),))
+  else:
+    return (sink.events, None)
+
+
+def _get_parsed_rcs_file(rcs_path, parse_cache=None):
+  """Return the results of parsing the RCS file at RCS_PATH.
+
+  Return a tuple (events, error, cached).  EVENTS and ERROR are as
+  returned by _parse_rcs_file().  If PARSE_CACHE is not None, it is an
+  RCSParseCache that is consulted first and updated if the file has to
+  be parsed; CACHED is True iff the results came from the cache.
+
+  This function is run in the worker processes of a
+  _ParallelFileParser."""
+
+  if parse_cache is None:
+    (events, error) = _parse_rcs_file(rcs_path)
+    return (events, error, False)
+
+  (signature, value) = parse_cache.lookup(rcs_path)
+  if value is not None:
+    (events, error) = value
+    return (events, error, True)
+
+  (events, error) = _parse_rcs_file(rcs_path)
+  parse_cache.store(rcs_path, signature, (events, error,))
+  return (events, error, False)
+
+
+class _ParsedRCSFile:
+  """The (pending) results of parsing an RCS file.
+
+  The results are obtained by calling FUNCTION(*ARGS), which must
+  return a tuple like _get_parsed_rcs_file().  The call is deferred
+  until replay() so that any unexpected exception is raised there."""
+
+  def __init__(self, function, *args):
+    self._function = function
+    self._args = args
+
+    # True iff the results came from the RCSParseCache (set by replay()):
+    self.cached = False
+
+  def replay(self, sink):
+    """Replay the recorded callbacks into SINK.
+
+    Wait for the worker process to finish parsing the file if
+    necessary.  If the parse failed, raise an exception of the same
+    type as the original one after the callbacks preceding the error
+    have been replayed.  Unexpected exceptions in the worker process
+    are re-raised here."""
+
+    (events, error, self.cached) = self._function(*self._args)
+    self._function = self._args = None
+
+    for (method_name, args) in events:
+      getattr(sink, method_name)(*args)
+
+    if error is not None:
+      (exception_class, message) = error
+      raise exception_class(message)
+
+
+class _ParallelFileParser:
+  """Parse RCS files in a pool of worker processes.
+
+  Files are submitted in the order that they are to be processed, and
+  the results are returned in the same order.  At most
+  WINDOW_PER_JOB * JOBS files are kept in flight at any time."""
+
+  WINDOW_PER_JOB = 8
+
+  def __init__(self, jobs, parse_cache=None):
+    try:
+      import multiprocessing
+    except ImportError:
+      raise FatalError(
+          'The --jobs option requires the multiprocessing module\n'
+          '(Python 2.6 or later).'
+          )
+
+    self.jobs = jobs
+    self.parse_cache = parse_cache
+    self.window = self.WINDOW_PER_JOB * self.jobs
+    self._pool = multiprocessing.Pool(self.jobs)
+
+  def iter_parsed(self, cvs_paths):
+    """Generate (cvs_path, parsed_file) for the CVSPaths in CVS_PATHS.
+
+    PARSED_FILE is a _ParsedRCSFile instance if CVS_PATH is a CVSFile,
+    otherwise None.  The output order is the same as the input order."""
+
+    pending = deque()
+    for cvs_path in cvs_paths:
+      if isinstance(cvs_path, CVSFile):
+        async_result = self._pool.apply_async(
+            _get_parsed_rcs_file, (cvs_path.rcs_path, self.parse_cache,)
+            )
+        parsed_file = _ParsedRCSFile(async_result.get)
+      else:
+        parsed_file = None
+      pending.append((cvs_path, parsed_file))
+
+      while len(pending) > self.window:
+        yield pending.popleft()
+
+    while pending:
+      yield pending.popleft()
+
+  def close(self):
+    self._pool.close()
+    self._pool.join()
+    self._pool = None
+
+
 class _ProjectDataCollector:
   def __init__(self, collect_data, project):
     self.collect_data = collect_data
     self.project = project
     self.num_files = 0
+    self.num_cached_files = 0
 
     # The Trunk LineOfDevelopment object for this project:
     self.trunk = Trunk(
@@ -1042,15 +1242,24 @@ class _ProjectDataCollector:
               % (old_name, new_name, count,)
               )
 
-  def process_file(self, cvs_file):
+  def process_file(self, cvs_file, parsed_file=None):
+    """Collect the data for CVS_FILE and return its CVSFileItems.
+
+    If PARSED_FILE is specified, it is a _ParsedRCSFile containing the
+    results of parsing the file in a worker process or of looking it
+    up in the RCSParseCache; otherwise, the file is parsed here."""
+
     logger.normal(cvs_file.rcs_path)
     fdc = _FileDataCollector(self, cvs_file)
     try:
-      f = open(cvs_file.rcs_path, 'rb')
-      try:
-        parse(f, fdc)
-      finally:
-        f.close()
+      if parsed_file is not None:
+        parsed_file.replay(fdc)
+      else:
+        f = open(cvs_file.rcs_path, 'rb')
+        try:
+          parse(f, fdc)
+        finally:
+          f.close()
     except (RCSParseError, RuntimeError):
       self.collect_data.record_fatal_error(
           "%r is not a valid ,v file" % (cvs_file.rcs_path,)
@@ -1070,6 +1279,8 @@ class _ProjectDataCollector:
       raise
     else:
       self.num_files += 1
+      if parsed_file is not None and parsed_file.cached:
+        self.num_cached_files += 1
 
     return fdc.get_cvs_file_items()
 
@@ -1082,7 +1293,14 @@ class CollectData:
   class by _FileDataCollector instances, one of which is created for
   each file to be parsed."""
 
-  def __init__(self, stats_keeper):
+  def __init__(self, stats_keeper, jobs=1, parse_cache_dir=None):
+    """Initialize.
+
+    If JOBS is greater than one, parse the RCS files in that many
+    worker processes.  If PARSE_CACHE_DIR is specified, it is the path
+    of a directory in which the results of parsing the RCS files are
+    kept from one conversion to the next (see RCSParseCache)."""
+
     self._cvs_item_store = NewCVSItemStore(
         artifact_manager.get_temp_file(config.CVS_ITEMS_STORE))
     self.metadata_db = MetadataDatabase(
@@ -1093,6 +1311,7 @@ class CollectData:
     self.metadata_logger = MetadataLogger(self.metadata_db)
     self.fatal_errors = []
     self.num_files = 0
+    self.num_cached_files = 0
     self.symbol_stats = SymbolStatisticsCollector()
     self.stats_keeper = stats_keeper
 
@@ -1102,6 +1321,18 @@ class CollectData:
     # Key generator for Symbols:
     self.symbol_key_generator = KeyGenerator()
 
+    if parse_cache_dir is not None:
+      self._parse_cache = RCSParseCache(parse_cache_dir)
+    else:
+      self._parse_cache = None
+
+    if jobs > 1:
+      self._parallel_file_parser = _ParallelFileParser(
+          jobs, self._parse_cache
+          )
+    else:
+      self._parallel_file_parser = None
+
   def record_fatal_error(self, err):
     """Record that fatal error ERR was found.
 
@@ -1157,15 +1388,39 @@ class CollectData:
     self.add_cvs_file_items(cvs_file_items)
     self.symbol_stats.register(cvs_file_items)
 
+  def _iter_cached(self, cvs_paths):
+    """Generate (cvs_path, parsed_file) for the CVSPaths in CVS_PATHS.
+
+    This is the serial counterpart of _ParallelFileParser.iter_parsed()
+    for use with the parse cache."""
+
+    for cvs_path in cvs_paths:
+      if isinstance(cvs_path, CVSFile):
+        yield (
+            cvs_path,
+            _ParsedRCSFile(
+                _get_parsed_rcs_file, cvs_path.rcs_path, self._parse_cache
+                ),
+            )
+      else:
+        yield (cvs_path, None)
+
   def process_project(self, project, cvs_paths):
     pdc = _ProjectDataCollector(self, project)
 
+    if self._parallel_file_parser is not None:
+      parsed_paths = self._parallel_file_parser.iter_parsed(cvs_paths)
+    elif self._parse_cache is not None:
+      parsed_paths = self._iter_cached(cvs_paths)
+    else:
+      parsed_paths = ((cvs_path, None) for cvs_path in cvs_paths)
+
     found_rcs_file = False
-    for cvs_path in cvs_paths:
+    for (cvs_path, parsed_file) in parsed_paths:
       if isinstance(cvs_path, CVSDirectory):
         self.add_cvs_directory(cvs_path)
       else:
-        cvs_file_items = pdc.process_file(cvs_path)
+        cvs_file_items = pdc.process_file(cvs_path, parsed_file)
         self._process_cvs_file_items(cvs_file_items)
         found_rcs_file = True
 
@@ -1180,7 +1435,12 @@ class CollectData:
     pdc.summarize_symbol_transforms()
 
     self.num_files += pdc.num_files
+    self.num_cached_files += pdc.num_cached_files
     logger.verbose('Processed', self.num_files, 'files')
+    if self._parse_cache is not None:
+      logger.verbose(
+          'Reused the parse cache for', self.num_cached_files, 'files'
+          )
 
   def _register_empty_subdirectories(self):
     """Set the CVSDirectory.empty_subdirectory_id members."""
@@ -1206,6 +1466,9 @@ class CollectData:
     Return a list of fatal errors encountered while processing input.
     Each list entry is a string describing one fatal error."""
 
+    if self._parallel_file_parser is not None:
+      self._parallel_file_parser.close()
+      self._parallel_file_parser = None
     self.symbol_stats.purge_ghost_symbols()
     self.symbol_stats.close()
     self.symbol_stats = None
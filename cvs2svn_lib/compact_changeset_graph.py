@@ -0,0 +1,409 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2000-2009 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""This module contains class CompactChangesetGraph."""
+
+
+import marshal
+from array import array
+from itertools import izip
+
+from cvs2svn_lib.time_range import TimeRange
+from cvs2svn_lib.changeset_graph_node import ChangesetGraphNode
+from cvs2svn_lib.changeset_graph import ChangesetGraph
+
+
+class CompactChangesetGraph(ChangesetGraph):
+  """A ChangesetGraph that stores its nodes in arrays.
+
+  The information about the nodes is held in arrays indexed by
+  changeset id, which works well because changeset ids are allocated
+  sequentially.  A ChangesetGraphNode is only created when a node is
+  requested via __getitem__(), and then it is a copy that does not
+  affect the graph.
+
+  While the graph is being filled via add_changeset(), the
+  dependencies reported by the changesets are just collected.  When
+  the graph is first used otherwise, the dependencies between nodes
+  that are in the graph are worked out (with the same result as in
+  ChangesetGraph) and stored in compressed sparse row form: the ids
+  of the predecessors of node ID are
+  self._pred_ids[self._pred_starts[ID]:self._pred_starts[ID + 1]],
+  and similarly for the successors.
+
+  After that, deleted nodes are only marked as deleted, and are
+  skipped when the predecessors or successors of a node are listed.
+  The dependencies of nodes that are added later are stored in
+  dictionaries of sets.  A changeset id must not be used again after
+  the node has been deleted.
+
+  The dependencies reported by all of the changesets that were ever
+  added are kept, so that save() can write the nodes of the changesets
+  that have not been deleted via delete_changeset() to a file, even
+  after the graph has been consumed.  A later pass can load() them
+  instead of calling add_changeset() for the same changesets again."""
+
+  def __init__(self, changeset_db, cvs_item_to_changeset_id):
+    ChangesetGraph.__init__(self, changeset_db, cvs_item_to_changeset_id)
+
+    # The nodes are not stored as ChangesetGraphNodes:
+    self.nodes = None
+
+    # The number of nodes in the graph:
+    self._node_count = 0
+
+    # Arrays indexed by changeset id, telling whether the node is in
+    # the graph (1 or 0) and holding the time_range of the node:
+    self._present = array('b')
+    self._t_mins = array('d')
+    self._t_maxs = array('d')
+
+    # The ids of the nodes, in the order that they were added, and the
+    # ids of the predecessors and successors that their changesets
+    # reported (concatenated), with the number of them for each node:
+    self._node_ids = array('i')
+    self._reported_pred_ids = array('i')
+    self._reported_pred_counts = array('i')
+    self._reported_succ_ids = array('i')
+    self._reported_succ_counts = array('i')
+
+    # The dependencies that were worked out, in compressed sparse row
+    # form (see the class docstring):
+    self._pred_starts = None
+    self._pred_ids = None
+    self._succ_starts = None
+    self._succ_ids = None
+
+    # Maps {id : set(id)} of the predecessors and successors that were
+    # added to each node after the dependencies were worked out:
+    self._extra_pred_ids = {}
+    self._extra_succ_ids = {}
+
+    # An array indexed by changeset id of the number of predecessors
+    # of each node that are still in the graph:
+    self._pred_counts = None
+
+    # The ids of the changesets that were removed via
+    # delete_changeset():
+    self._deleted_ids = set()
+
+  def _grow(self, id):
+    """Make the arrays indexed by changeset id long enough to hold ID."""
+
+    n = id + 1 - len(self._present)
+    if n > 0:
+      self._present.extend(array('b', [0]) * n)
+      self._t_mins.extend(array('d', [0.0]) * n)
+      self._t_maxs.extend(array('d', [0.0]) * n)
+      if self._pred_counts is not None:
+        self._pred_counts.extend(array('i', [0]) * n)
+
+  def _build_sparse_rows(self, row_ids, column_ids):
+    """Return (starts, ids) for the pairs in ROW_IDS and COLUMN_IDS.
+
+    Return the compressed sparse row form of the relation that holds
+    between ROW_IDS[i] and COLUMN_IDS[i] for each i, with one row for
+    each id in self._present."""
+
+    n = len(self._present)
+    starts = array('l', [0]) * (n + 1)
+    for id in row_ids:
+      starts[id + 1] += 1
+    for id in xrange(n):
+      starts[id + 1] += starts[id]
+
+    positions = array('l', starts)
+    ids = array('i', [0]) * len(row_ids)
+    for (row_id, column_id) in izip(row_ids, column_ids):
+      ids[positions[row_id]] = column_id
+      positions[row_id] += 1
+
+    return (starts, ids)
+
+  def _freeze(self):
+    """Work out the dependencies among the nodes added so far."""
+
+    n = len(self._present)
+
+    # An array indexed by changeset id holding the position of each
+    # node in self._node_ids, or -1:
+    positions = array('i', [-1]) * n
+    for (i, id) in enumerate(self._node_ids):
+      positions[id] = i
+
+    # When a node is added to a ChangesetGraph, the predecessors and
+    # successors that its changeset reports are recorded if they are
+    # in the graph already.  So the dependencies between two nodes are
+    # those reported by the one that was added later.
+    pred_ids = array('i')
+    succ_ids = array('i')
+    pred_end = succ_end = 0
+    for (i, id) in enumerate(self._node_ids):
+      pred_start = pred_end
+      pred_end += self._reported_pred_counts[i]
+      for pred_id in self._reported_pred_ids[pred_start:pred_end]:
+        if 0 <= pred_id < n and 0 <= positions[pred_id] < i:
+          pred_ids.append(pred_id)
+          succ_ids.append(id)
+
+      succ_start = succ_end
+      succ_end += self._reported_succ_counts[i]
+      for succ_id in self._reported_succ_ids[succ_start:succ_end]:
+        if 0 <= succ_id < n and 0 <= positions[succ_id] < i:
+          pred_ids.append(id)
+          succ_ids.append(succ_id)
+    del positions
+
+    (self._pred_starts, self._pred_ids) = self._build_sparse_rows(
+        succ_ids, pred_ids
+        )
+    (self._succ_starts, self._succ_ids) = self._build_sparse_rows(
+        pred_ids, succ_ids
+        )
+
+    starts = self._pred_starts
+    self._pred_counts = array('i', [0]) * n
+    for id in xrange(n):
+      self._pred_counts[id] = starts[id + 1] - starts[id]
+
+  def _add_node(self, node):
+    id = node.id
+
+    self._grow(id)
+    self._present[id] = 1
+    self._t_mins[id] = node.time_range.t_min
+    self._t_maxs[id] = node.time_range.t_max
+    self._node_count += 1
+
+    self._node_ids.append(id)
+    self._reported_pred_ids.extend(node.pred_ids)
+    self._reported_pred_counts.append(len(node.pred_ids))
+    self._reported_succ_ids.extend(node.succ_ids)
+    self._reported_succ_counts.append(len(node.succ_ids))
+
+    if self._pred_counts is not None:
+      # As in ChangesetGraph, only record the dependencies on nodes
+      # that are in the graph already:
+      pred_ids = set([
+          pred_id
+          for pred_id in node.pred_ids
+          if pred_id != id and pred_id in self
+          ])
+      succ_ids = set([
+          succ_id
+          for succ_id in node.succ_ids
+          if succ_id != id and succ_id in self
+          ])
+
+      for pred_id in pred_ids:
+        self._extra_succ_ids.setdefault(pred_id, set()).add(id)
+      for succ_id in succ_ids:
+        self._extra_pred_ids.setdefault(succ_id, set()).add(id)
+        self._pred_counts[succ_id] += 1
+
+      if pred_ids:
+        self._extra_pred_ids[id] = pred_ids
+      if succ_ids:
+        self._extra_succ_ids[id] = succ_ids
+      self._pred_counts[id] = len(pred_ids)
+
+    if self._added_ids is not None:
+      self._added_ids.append(id)
+
+  def delete_changeset(self, changeset):
+    ChangesetGraph.delete_changeset(self, changeset)
+    self._deleted_ids.add(changeset.id)
+
+  def save(self, filename):
+    """Write the nodes of the changesets in this graph to FILENAME.
+
+    Write the nodes of all of the changesets that were added and not
+    deleted via delete_changeset(), in the order that they were added,
+    whether or not they have been consumed since.  Loading the file
+    into a new graph via load() has the same effect as adding those
+    changesets to it in the same order, provided that the dependencies
+    reported by the changesets that were added after the first ones
+    are still up to date."""
+
+    node_ids = array('i')
+    t_mins = array('d')
+    t_maxs = array('d')
+    pred_counts = array('i')
+    pred_ids = array('i')
+    succ_counts = array('i')
+    succ_ids = array('i')
+
+    pred_end = succ_end = 0
+    for (i, id) in enumerate(self._node_ids):
+      pred_start = pred_end
+      pred_end += self._reported_pred_counts[i]
+      succ_start = succ_end
+      succ_end += self._reported_succ_counts[i]
+      if id in self._deleted_ids:
+        continue
+
+      node_ids.append(id)
+      t_mins.append(self._t_mins[id])
+      t_maxs.append(self._t_maxs[id])
+      pred_counts.append(pred_end - pred_start)
+      pred_ids.extend(self._reported_pred_ids[pred_start:pred_end])
+      succ_counts.append(succ_end - succ_start)
+      succ_ids.extend(self._reported_succ_ids[succ_start:succ_end])
+
+    f = open(filename, 'wb')
+    marshal.dump((len(node_ids), len(pred_ids), len(succ_ids)), f)
+    for a in [
+          node_ids, t_mins, t_maxs, pred_counts, pred_ids,
+          succ_counts, succ_ids,
+          ]:
+      a.tofile(f)
+    f.close()
+
+  def load(self, filename):
+    """Add the nodes that were written to FILENAME by save().
+
+    This method must be called before the dependencies have been
+    worked out, i.e., while the graph is being filled."""
+
+    assert self._pred_counts is None
+
+    f = open(filename, 'rb')
+    (node_count, pred_id_count, succ_id_count) = marshal.load(f)
+    node_ids = array('i')
+    node_ids.fromfile(f, node_count)
+    t_mins = array('d')
+    t_mins.fromfile(f, node_count)
+    t_maxs = array('d')
+    t_maxs.fromfile(f, node_count)
+    self._reported_pred_counts.fromfile(f, node_count)
+    self._reported_pred_ids.fromfile(f, pred_id_count)
+    self._reported_succ_counts.fromfile(f, node_count)
+    self._reported_succ_ids.fromfile(f, succ_id_count)
+    f.close()
+
+    if node_ids:
+      self._grow(max(node_ids))
+    for (id, t_min, t_max) in izip(node_ids, t_mins, t_maxs):
+      self._present[id] = 1
+      self._t_mins[id] = t_min
+      self._t_maxs[id] = t_max
+    self._node_count += node_count
+    self._node_ids.extend(node_ids)
+
+  def __nonzero__(self):
+    return self._node_count > 0
+
+  def __contains__(self, id):
+    return 0 <= id < len(self._present) and self._present[id] == 1
+
+  def __getitem__(self, id):
+    if id not in self:
+      raise KeyError(id)
+
+    return ChangesetGraphNode(
+        self._changeset_db[id], self._get_time_range(id),
+        set(self._get_pred_ids(id)), set(self._get_succ_ids(id)),
+        )
+
+  def get(self, id):
+    if id in self:
+      return self[id]
+    else:
+      return None
+
+  def __delitem__(self, id):
+    if id not in self:
+      raise KeyError(id)
+
+    succ_ids = self._get_succ_ids(id)
+    for succ_id in succ_ids:
+      self._pred_counts[succ_id] -= 1
+
+    self._present[id] = 0
+    self._node_count -= 1
+    self._extra_pred_ids.pop(id, None)
+    self._extra_succ_ids.pop(id, None)
+
+    if self._orphan_ids is not None:
+      self._orphan_ids.update(succ_ids)
+
+  def keys(self):
+    return list(self.iterkeys())
+
+  def iterkeys(self):
+    present = self._present
+    for id in xrange(len(present)):
+      if present[id]:
+        yield id
+
+  def __iter__(self):
+    for id in self.iterkeys():
+      yield self[id]
+
+  def _get_adjacent_ids(self, id, starts, ids, extra_ids):
+    """Return a list of the ids of the neighbors of node ID.
+
+    STARTS and IDS hold the neighbors in compressed sparse row form,
+    and EXTRA_IDS is a map {id : set(id)} of additional neighbors."""
+
+    present = self._present
+    if id < len(starts) - 1:
+      retval = [
+          adjacent_id
+          for adjacent_id in ids[starts[id]:starts[id + 1]]
+          if present[adjacent_id]
+          ]
+    else:
+      retval = []
+
+    if id in extra_ids:
+      retval.extend([
+          adjacent_id
+          for adjacent_id in extra_ids[id]
+          if present[adjacent_id]
+          ])
+
+    return retval
+
+  def _get_pred_ids(self, id):
+    if self._pred_counts is None:
+      self._freeze()
+
+    return self._get_adjacent_ids(
+        id, self._pred_starts, self._pred_ids, self._extra_pred_ids
+        )
+
+  def _get_succ_ids(self, id):
+    if self._pred_counts is None:
+      self._freeze()
+
+    return self._get_adjacent_ids(
+        id, self._succ_starts, self._succ_ids, self._extra_succ_ids
+        )
+
+  def _has_pred_ids(self, id):
+    if self._pred_counts is None:
+      self._freeze()
+
+    return self._pred_counts[id] > 0
+
+  def _get_time_range(self, id):
+    time_range = TimeRange()
+    time_range.t_min = int(self._t_mins[id])
+    time_range.t_max = int(self._t_maxs[id])
+    return time_range
+
+
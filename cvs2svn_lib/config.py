@@ -36,11 +36,17 @@ PROJECTS = 'projects.pck'
 # CVS_SYMBOLS_*_DATAFILE:
 ITEM_SERIALIZER = 'item-serializer.pck'
 
-# The first file contains the CVSRevisions in a form that can be
-# sorted to deduce preliminary Changesets.  The second file is the
-# sorted version of the first.
+# The first file contains the CVSRevisions, as a series of runs that
+# are each sorted in the order needed to deduce preliminary
+# Changesets.  The second file holds a pickled list of the (start,
+# end) offsets of the runs within the first.
 CVS_REVS_DATAFILE = 'revs.dat'
+CVS_REVS_RUNS = 'revs-runs.pck'
+
+# The same CVSRevisions and run offsets, after SortRevisionsPass has
+# merged the runs until few enough remain to be merged while reading.
 CVS_REVS_SORTED_DATAFILE = 'revs-s.dat'
+CVS_REVS_SORTED_RUNS = 'revs-s-runs.pck'
 
 # The first file contains the CVSSymbols in a form that can be sorted
 # to deduce preliminary Changesets.  The second file is the sorted
@@ -87,6 +93,15 @@ CHANGESETS_SYMBROKEN_STORE = 'changesets-symbroken.pck'
 CHANGESETS_ALLBROKEN_INDEX = 'changesets-allbroken-index.dat'
 CHANGESETS_ALLBROKEN_STORE = 'changesets-allbroken.pck'
 
+# The nodes of the changeset graph, as written by
+# CompactChangesetGraph.save(), after the RevisionChangeset loops have
+# been broken (holding only the RevisionChangesets), after the
+# SymbolChangeset loops have been broken, and after all Changeset
+# loops have been broken.
+CHANGESET_GRAPH_REVBROKEN = 'changeset-graph-revbroken.dat'
+CHANGESET_GRAPH_SYMBROKEN = 'changeset-graph-symbroken.dat'
+CHANGESET_GRAPH_ALLBROKEN = 'changeset-graph-allbroken.dat'
+
 # The RevisionChangesets in commit order.  Each line contains the
 # changeset id and timestamp of one changeset, in hexadecimal, in the
 # order that the changesets should be committed to svn.
@@ -164,6 +179,16 @@ CVS_REVS_TO_SVN_REVNUMS = 'cvs-revs-to-svn-revnums.dat'
 SVN_COMMITS_INDEX_TABLE = 'svn-commits-index.dat'
 SVN_COMMITS_STORE = 'svn-commits.pck'
 
+# The approximate amount of memory, in bytes, to use for caching the
+# CVSItems and the changesets that are read from their databases while
+# breaking changeset dependency cycles.  The same amount is used for
+# each of the two databases.
+CYCLE_BREAKING_CACHE_MEMORY = 32 * 1024 * 1024
+
+# The number of changesets whose dependencies are looked up together
+# when they are added to a changeset graph.
+CHANGESET_GRAPH_BATCH_SIZE = 1000
+
 # How many bytes to read at a time from a pipe.  128 kiB should be
 # large enough to be efficient without wasting too much memory.
 PIPE_READ_SIZE = 128 * 1024
@@ -199,8 +224,27 @@ RCS_TREES_STORE = 'rcs-trees.pck'
 
 # At any given time during OutputPass, holds the full text of each CVS
 # revision that was checked out already and still has descendants that will
-# be checked out.
-CVS_CHECKOUT_DB = 'cvs-checkout.db'
+# be checked out.  Up to CHECKOUT_STORE_MEMORY bytes of them are kept in
+# memory instead.
+CVS_CHECKOUT_DB = 'cvs-checkout.dat'
+CHECKOUT_STORE_MEMORY = 32 * 1024 * 1024
+
+# The zlib compression level used for RCS_DELTAS_STORE and
+# CVS_CHECKOUT_DB.  Their records are compressed using a dictionary
+# built from the first INTERNAL_CO_DICTIONARY_SAMPLE_SIZE bytes of
+# deltas and fulltexts, which lets a low level compress better than a
+# high level would without a dictionary.
+INTERNAL_CO_COMPRESSION_LEVEL = 1
+INTERNAL_CO_DICTIONARY_SAMPLE_SIZE = 1024 * 1024
+
+# RCS_DELTAS_STORE holds the fulltext of the first revision of each
+# line of development and a delta for each later revision.  Whenever
+# rebuilding a revision would require applying more than
+# INTERNAL_CO_MAX_DELTA_CHAIN deltas, or more than
+# INTERNAL_CO_MAX_DELTA_CHAIN_SIZE bytes of deltas, since the last
+# fulltext, the revision's fulltext is stored instead of its delta.
+INTERNAL_CO_MAX_DELTA_CHAIN = 64
+INTERNAL_CO_MAX_DELTA_CHAIN_SIZE = 4 * 1024 * 1024
 
 # End of DBs related to --use-internal-co.
 
@@ -59,6 +59,12 @@ class Ctx:
     self.file_property_setters = []
     self.revision_property_setters = []
     self.tmpdir = None
+    self.jobs = 1
+    self.parse_cache_dir = None
+    self.walker_threads = 1
+    self.sort_memory = 64
+    self.sort_compression = 'auto'
+    self.record_table_backend = 'auto'
     self.skip_cleanup = False
     self.keep_cvsignore = False
     self.cross_project_commits = True
@@ -17,9 +17,12 @@
 """This module contains a database that can store arbitrary CVSItems."""
 
 
-import re
+import struct
+import marshal
 import cPickle
 
+from cvs2svn_lib.context import Ctx
+from cvs2svn_lib.cvs_item import CVSRevision
 from cvs2svn_lib.cvs_item import CVSRevisionAdd
 from cvs2svn_lib.cvs_item import CVSRevisionChange
 from cvs2svn_lib.cvs_item import CVSRevisionDelete
@@ -30,8 +33,11 @@ from cvs2svn_lib.cvs_item import CVSTag
 from cvs2svn_lib.cvs_item import CVSTagNoop
 from cvs2svn_lib.cvs_file_items import CVSFileItems
 from cvs2svn_lib.serializer import Serializer
-from cvs2svn_lib.serializer import PrimedPickleSerializer
 from cvs2svn_lib.indexed_database import IndexedStore
+from cvs2svn_lib.sort import BUFSIZE
+from cvs2svn_lib.sort import KeyedRecordFormat
+from cvs2svn_lib.sort import SortedRunWriter
+from cvs2svn_lib.sort import iter_merged_runs
 
 
 cvs_item_primer = (
@@ -42,25 +48,626 @@ cvs_item_primer = (
     )
 
 
+class _Unencodable(Exception):
+  """A CVSItem cannot be represented in CVSItemSerializer's format."""
+
+  pass
+
+
+# The flags stored in the records of CVSItemSerializer:
+_DELTATEXT_EXISTS = 0x01
+_NTDBR = 0x02
+_PROPERTIES_CHANGED = 0x04
+_PROPERTIES_CHANGED_NONE = 0x08
+_OPENED_SYMBOLS_NONE = 0x10
+_CLOSED_SYMBOLS_NONE = 0x20
+# Both properties and properties_changed are None (as they are until
+# FilterSymbolsPass determines them):
+_PROPERTIES_NONE = _PROPERTIES_CHANGED | _PROPERTIES_CHANGED_NONE
+# The revision_reader_token is an unsigned 4-byte integer following
+# the variable part of the record:
+_TOKEN = 0x40
+# The properties and/or revision_reader_token are marshalled at the
+# end of the record:
+_EXTRA = 0x80
+
+# The struct codes for absolute and for relative ids, indexed by width
+# code:
+_ABS_CODES = 'BHI'
+_REL_CODES = 'bhi'
+
+
+def _get_abs_width(values):
+  """Return the width code for the nonnegative integers in VALUES."""
+
+  if min(values) < 0:
+    raise _Unencodable()
+  max_value = max(values)
+  if max_value < 0x100:
+    return 0
+  elif max_value < 0x10000:
+    return 1
+  elif max_value < 0x100000000:
+    return 2
+  else:
+    raise _Unencodable()
+
+
+def _get_rel_width(values):
+  """Return the width code for the signed integers in VALUES."""
+
+  lo = min(values)
+  hi = max(values)
+  if -0x80 <= lo and hi < 0x80:
+    return 0
+  elif -0x8000 <= lo and hi < 0x8000:
+    return 1
+  elif -0x80000000 <= lo and hi < 0x80000000:
+    return 2
+  else:
+    raise _Unencodable()
+
+
+def _get_rel_ids(id, ref_ids):
+  """Return REF_IDS relative to ID, with None represented by 0."""
+
+  if id in ref_ids:
+    raise _Unencodable()
+  return [ref_id is not None and ref_id - id or 0 for ref_id in ref_ids]
+
+
+def _get_symbol_ids(id, symbols_list):
+  """Return the ids in the lists of (symbol_id, cvs_symbol_id) pairs.
+
+  Return (symbol_ids, rel_ids), where REL_IDS are the cvs_symbol_ids
+  relative to ID.  The lists in SYMBOLS_LIST may be None."""
+
+  symbol_ids = []
+  rel_ids = []
+  for symbols in symbols_list:
+    if symbols:
+      for (symbol_id, cvs_symbol_id) in symbols:
+        symbol_ids.append(symbol_id)
+        rel_ids.append(cvs_symbol_id - id)
+  return (symbol_ids, rel_ids)
+
+
+class CVSItemSerializer(Serializer):
+  """A compact Serializer for CVSItems and CVSFileItems.
+
+  Each record starts with one byte identifying the class of the object
+  (its index in CLASSES).  The record of a CVSItem continues with a
+  byte holding the widths of its integers (see below), a byte of
+  flags, and a fixed, struct-packed part whose layout depends on
+  whether the item is a CVSRevision, CVSBranch or CVSTag.  The fixed
+  part includes the lengths of the variable part that follows it: the
+  lists of ids, the opened and closed symbols, and the revision or
+  branch number.
+
+  The ids of the CVSItem, its CVSFile, its metadata and its symbols
+  are stored as unsigned integers of 1, 2 or 4 bytes.  The ids of
+  other CVSItems, which are usually in the same file and therefore
+  numbered close to the item itself, are stored relative to the
+  item's id as signed integers of 1, 2 or 4 bytes, with 0 standing for
+  None.  Both widths are chosen separately for each record.  When a
+  record is read, the slots of the CVSItem are filled in directly
+  rather than via its __setstate__() method, so the layouts have to be
+  kept in step with the slots of the CVSItem classes (which
+  cvs-item-serializer-test checks).
+
+  Properties and revision_reader_tokens that are not small integers
+  are marshalled at the end of the record.  Objects that cannot be
+  represented in any of these ways (for example, because one of their
+  lists is too long, or a RevisionCollector stored an unusual
+  revision_reader_token) are pickled instead, preceded by the byte
+  PICKLED.
+
+  A CVSFileItems is stored as the id of its CVSFile, the serialized
+  CVSItems (each preceded by its length), and its marshalled
+  original_ids.
+
+  dumpf() and loadf() precede each serialized object by its length, so
+  that several objects can be stored in one file."""
+
+  # The class code that marks a pickled object:
+  PICKLED = 255
+
+  LENGTH_FORMAT = '<I'
+  LENGTH_LEN = struct.calcsize(LENGTH_FORMAT)
+
+  def __init__(self, classes=cvs_item_primer + (CVSFileItems,)):
+    """Prepare to serialize instances of CLASSES (at most 255 of them)."""
+
+    assert len(classes) < self.PICKLED
+    self.__setstate__(classes)
+
+  def __getstate__(self):
+    return self.classes
+
+  def __setstate__(self, state):
+    self.classes = state
+
+    # Ctx is a Borg, so this instance always sees the current
+    # databases:
+    self._ctx = Ctx()
+
+    # Maps {class : (class_code, dump_method)} and {class_code :
+    # (class, load_method)} for the classes that have their own
+    # layouts:
+    self._dumpers = {}
+    self._loaders = {}
+    for (i, cls) in enumerate(self.classes):
+      if issubclass(cls, CVSRevision):
+        methods = (self._dump_revision, self._load_revision)
+      elif issubclass(cls, CVSBranch):
+        methods = (self._dump_branch, self._load_branch)
+      elif issubclass(cls, CVSTag):
+        methods = (self._dump_tag, self._load_tag)
+      elif issubclass(cls, CVSFileItems):
+        methods = (self._dump_file_items, self._load_file_items)
+      else:
+        continue
+      self._dumpers[cls] = (chr(i), methods[0])
+      self._loaders[i] = (cls, methods[1])
+
+    # Lists of layouts for the fixed parts of the records of
+    # CVSRevisions, CVSBranches and CVSTags, indexed by the byte that
+    # holds the widths.  Each layout is a tuple (pack_format,
+    # unpack_format, length, rel_code, rel_size, abs_code, abs_size).
+    # PACK_FORMAT starts with the widths and flags; UNPACK_FORMAT
+    # skips the class code and widths and starts with the flags;
+    # LENGTH is the number of bytes from the start of the record to
+    # the variable part.
+    self._revision_layouts = []
+    self._branch_layouts = []
+    self._tag_layouts = []
+    for abs_code in _ABS_CODES:
+      for rel_code in _REL_CODES:
+        for (layouts, format) in [
+              # id, cvs_file_id, metadata_id, lod_id, timestamp,
+              # prev_id, next_id, first_on_branch_id, ntdbr_prev_id,
+              # ntdbr_next_id, and the lengths of tag_ids, branch_ids,
+              # branch_commit_ids, opened_symbols, closed_symbols and
+              # rev:
+              (self._revision_layouts,
+               abs_code * 4 + 'I' + rel_code * 5 + 'B' * 6),
+              # id, cvs_file_id, symbol_id, source_lod_id, source_id,
+              # next_id, and the lengths of tag_ids, branch_ids,
+              # opened_symbols and branch_number:
+              (self._branch_layouts,
+               abs_code * 4 + rel_code * 2 + 'B' * 4),
+              # id, cvs_file_id, symbol_id, source_lod_id, source_id:
+              (self._tag_layouts, abs_code * 4 + rel_code),
+              ]:
+          layouts.append((
+              '<BB' + format, '<xxB' + format,
+              struct.calcsize('<xxB' + format),
+              rel_code, struct.calcsize(rel_code),
+              abs_code, struct.calcsize(abs_code),
+              ))
+
+  def _dump_tail(self, flags, token, properties, parts):
+    """Append the revision_reader_token and properties to PARTS.
+
+    Return FLAGS, updated to describe how they were stored."""
+
+    if token is None:
+      extra_token = None
+    elif type(token) is int and 0 <= token < 0x100000000:
+      flags |= _TOKEN
+      parts.append(struct.pack('<I', token))
+      extra_token = None
+    else:
+      flags |= _EXTRA
+      extra_token = token
+
+    if properties or extra_token is not None:
+      flags |= _EXTRA
+      parts.append(marshal.dumps((properties, extra_token,)))
+
+    return flags
+
+  def _load_tail(self, cvs_item, flags, s, pos):
+    """Set the revision_reader_token of CVS_ITEM from S[POS:].
+
+    Return the properties stored in S."""
+
+    if flags & _TOKEN:
+      (cvs_item.revision_reader_token,) = struct.unpack('<I', s[pos:pos + 4])
+      pos += 4
+    else:
+      cvs_item.revision_reader_token = None
+
+    if flags & _EXTRA:
+      (properties, token) = marshal.loads(s[pos:])
+      if token is not None:
+        cvs_item.revision_reader_token = token
+      return properties
+    else:
+      return {}
+
+  def _dump_revision(self, cvs_rev):
+    id = cvs_rev.id
+    flags = 0
+    if cvs_rev.deltatext_exists:
+      flags |= _DELTATEXT_EXISTS
+    if cvs_rev.ntdbr:
+      flags |= _NTDBR
+    properties = cvs_rev.properties
+    if properties is None:
+      if cvs_rev.properties_changed is not None:
+        raise _Unencodable()
+      flags |= _PROPERTIES_NONE
+    elif cvs_rev.properties_changed is None:
+      flags |= _PROPERTIES_CHANGED_NONE
+    elif cvs_rev.properties_changed:
+      flags |= _PROPERTIES_CHANGED
+    opened_symbols = cvs_rev.opened_symbols
+    if opened_symbols is None:
+      flags |= _OPENED_SYMBOLS_NONE
+      opened_symbols = ()
+    closed_symbols = cvs_rev.closed_symbols
+    if closed_symbols is None:
+      flags |= _CLOSED_SYMBOLS_NONE
+      closed_symbols = ()
+    rev = cvs_rev.rev
+    if type(rev) is not str:
+      raise _Unencodable()
+
+    rel_values = _get_rel_ids(id, (
+        cvs_rev.prev_id, cvs_rev.next_id, cvs_rev.first_on_branch_id,
+        cvs_rev.ntdbr_prev_id, cvs_rev.ntdbr_next_id,
+        ))
+    # The relative ids in the variable part: tag_ids, branch_ids,
+    # branch_commit_ids and the cvs_symbol_ids of the opened and
+    # closed symbols, followed by the absolute symbol_ids of the
+    # opened and closed symbols:
+    list_values = [
+        ref_id - id
+        for ref_id in (
+            cvs_rev.tag_ids + cvs_rev.branch_ids + cvs_rev.branch_commit_ids
+            )
+        ]
+    if opened_symbols or closed_symbols:
+      (symbol_ids, symbol_rel_ids) = _get_symbol_ids(
+          id, (opened_symbols, closed_symbols)
+          )
+      list_values.extend(symbol_rel_ids)
+    else:
+      symbol_ids = []
+
+    abs_values = [id, cvs_rev.cvs_file.id, cvs_rev.metadata_id, cvs_rev.lod.id]
+    abs_width = _get_abs_width(abs_values + symbol_ids)
+    rel_width = _get_rel_width(rel_values + list_values)
+    timestamp = cvs_rev.timestamp
+    if type(timestamp) not in (int, long) \
+           or not 0 <= timestamp < 0x100000000:
+      raise _Unencodable()
+    lengths = [
+        len(cvs_rev.tag_ids), len(cvs_rev.branch_ids),
+        len(cvs_rev.branch_commit_ids),
+        len(opened_symbols), len(closed_symbols), len(rev),
+        ]
+    if max(lengths) > 0xff:
+      raise _Unencodable()
+
+    widths = 3 * abs_width + rel_width
+    layout = self._revision_layouts[widths]
+    parts = [None]
+    if list_values:
+      parts.append(struct.pack(
+          '<' + layout[3] * len(list_values), *list_values
+          ))
+    if symbol_ids:
+      parts.append(struct.pack(
+          '<' + layout[5] * len(symbol_ids), *symbol_ids
+          ))
+    parts.append(rev)
+    token = cvs_rev.revision_reader_token
+    if token is not None or properties:
+      flags = self._dump_tail(flags, token, properties, parts)
+    parts[0] = struct.pack(
+        layout[0], widths, flags,
+        *(abs_values + [timestamp] + rel_values + lengths)
+        )
+    return ''.join(parts)
+
+  def _load_revision(self, cls, s):
+    layout = self._revision_layouts[ord(s[1])]
+    pos = layout[2]
+    (
+        flags, id, cvs_file_id, metadata_id, lod_id, timestamp,
+        prev_id, next_id, first_on_branch_id, ntdbr_prev_id, ntdbr_next_id,
+        tag_count, branch_count, branch_commit_count,
+        opened_count, closed_count, rev_len,
+        ) = struct.unpack(layout[1], s[:pos])
+
+    cvs_rev = cls.__new__(cls)
+    cvs_rev.id = id
+    ctx = self._ctx
+    cvs_rev.cvs_file = ctx._cvs_path_db.get_path(cvs_file_id)
+    cvs_rev.timestamp = timestamp
+    cvs_rev.metadata_id = metadata_id
+    cvs_rev.lod = ctx._symbol_db.get_symbol(lod_id)
+    cvs_rev.prev_id = prev_id and id + prev_id or None
+    cvs_rev.next_id = next_id and id + next_id or None
+    cvs_rev.first_on_branch_id = \
+        first_on_branch_id and id + first_on_branch_id or None
+    cvs_rev.ntdbr_prev_id = ntdbr_prev_id and id + ntdbr_prev_id or None
+    cvs_rev.ntdbr_next_id = ntdbr_next_id and id + ntdbr_next_id or None
+    cvs_rev.deltatext_exists = (flags & _DELTATEXT_EXISTS) != 0
+    cvs_rev.ntdbr = (flags & _NTDBR) != 0
+    if flags & _PROPERTIES_CHANGED_NONE:
+      cvs_rev.properties_changed = None
+    else:
+      cvs_rev.properties_changed = (flags & _PROPERTIES_CHANGED) != 0
+
+    cvs_rev.tag_ids = []
+    cvs_rev.branch_ids = []
+    cvs_rev.branch_commit_ids = []
+    if flags & _OPENED_SYMBOLS_NONE:
+      cvs_rev.opened_symbols = None
+    else:
+      cvs_rev.opened_symbols = []
+    if flags & _CLOSED_SYMBOLS_NONE:
+      cvs_rev.closed_symbols = None
+    else:
+      cvs_rev.closed_symbols = []
+
+    symbol_count = opened_count + closed_count
+    list_count = tag_count + branch_count + branch_commit_count + symbol_count
+    if list_count:
+      end = pos + list_count * layout[4]
+      values = [
+          id + value
+          for value in struct.unpack('<' + layout[3] * list_count,
+                                     s[pos:end])
+          ]
+      pos = end
+      if tag_count:
+        cvs_rev.tag_ids = values[:tag_count]
+      if branch_count:
+        cvs_rev.branch_ids = values[tag_count:tag_count + branch_count]
+      if branch_commit_count:
+        cvs_rev.branch_commit_ids = \
+            values[tag_count + branch_count:list_count - symbol_count]
+      if symbol_count:
+        end = pos + symbol_count * layout[6]
+        symbols = zip(
+            struct.unpack('<' + layout[5] * symbol_count, s[pos:end]),
+            values[list_count - symbol_count:],
+            )
+        pos = end
+        if opened_count:
+          cvs_rev.opened_symbols = symbols[:opened_count]
+        if closed_count:
+          cvs_rev.closed_symbols = symbols[opened_count:]
+
+    end = pos + rev_len
+    cvs_rev.rev = s[pos:end]
+    if flags & (_TOKEN | _EXTRA):
+      cvs_rev.properties = self._load_tail(cvs_rev, flags, s, end)
+    else:
+      cvs_rev.revision_reader_token = None
+      cvs_rev.properties = {}
+    if flags & _PROPERTIES_NONE == _PROPERTIES_NONE:
+      cvs_rev.properties = None
+    return cvs_rev
+
+  def _dump_branch(self, cvs_branch):
+    id = cvs_branch.id
+    flags = 0
+    opened_symbols = cvs_branch.opened_symbols
+    if opened_symbols is None:
+      flags |= _OPENED_SYMBOLS_NONE
+      opened_symbols = ()
+    branch_number = cvs_branch.branch_number
+    if type(branch_number) is not str:
+      raise _Unencodable()
+
+    rel_values = _get_rel_ids(id, (cvs_branch.source_id, cvs_branch.next_id))
+    # The relative ids in the variable part: tag_ids, branch_ids and
+    # the cvs_symbol_ids of the opened symbols, followed by the
+    # absolute symbol_ids of the opened symbols:
+    list_values = [
+        ref_id - id
+        for ref_id in cvs_branch.tag_ids + cvs_branch.branch_ids
+        ]
+    if opened_symbols:
+      (symbol_ids, symbol_rel_ids) = _get_symbol_ids(id, (opened_symbols,))
+      list_values.extend(symbol_rel_ids)
+    else:
+      symbol_ids = []
+
+    abs_values = [
+        id, cvs_branch.cvs_file.id,
+        cvs_branch.symbol.id, cvs_branch.source_lod.id,
+        ]
+    abs_width = _get_abs_width(abs_values + symbol_ids)
+    rel_width = _get_rel_width(rel_values + list_values)
+    lengths = [
+        len(cvs_branch.tag_ids), len(cvs_branch.branch_ids),
+        len(opened_symbols), len(branch_number),
+        ]
+    if max(lengths) > 0xff:
+      raise _Unencodable()
+
+    widths = 3 * abs_width + rel_width
+    layout = self._branch_layouts[widths]
+    parts = [None]
+    if list_values:
+      parts.append(struct.pack(
+          '<' + layout[3] * len(list_values), *list_values
+          ))
+    if symbol_ids:
+      parts.append(struct.pack(
+          '<' + layout[5] * len(symbol_ids), *symbol_ids
+          ))
+    parts.append(branch_number)
+    token = cvs_branch.revision_reader_token
+    if token is not None:
+      flags = self._dump_tail(flags, token, None, parts)
+    parts[0] = struct.pack(
+        layout[0], widths, flags, *(abs_values + rel_values + lengths)
+        )
+    return ''.join(parts)
+
+  def _load_branch(self, cls, s):
+    layout = self._branch_layouts[ord(s[1])]
+    pos = layout[2]
+    (
+        flags, id, cvs_file_id, symbol_id, source_lod_id, source_id, next_id,
+        tag_count, branch_count, opened_count, branch_number_len,
+        ) = struct.unpack(layout[1], s[:pos])
+
+    cvs_branch = cls.__new__(cls)
+    cvs_branch.id = id
+    ctx = self._ctx
+    cvs_branch.cvs_file = ctx._cvs_path_db.get_path(cvs_file_id)
+    cvs_branch.symbol = ctx._symbol_db.get_symbol(symbol_id)
+    cvs_branch.source_lod = ctx._symbol_db.get_symbol(source_lod_id)
+    cvs_branch.source_id = source_id and id + source_id or None
+    cvs_branch.next_id = next_id and id + next_id or None
+
+    cvs_branch.tag_ids = []
+    cvs_branch.branch_ids = []
+    if flags & _OPENED_SYMBOLS_NONE:
+      cvs_branch.opened_symbols = None
+    else:
+      cvs_branch.opened_symbols = []
+
+    list_count = tag_count + branch_count + opened_count
+    if list_count:
+      end = pos + list_count * layout[4]
+      values = [
+          id + value
+          for value in struct.unpack('<' + layout[3] * list_count,
+                                     s[pos:end])
+          ]
+      pos = end
+      if tag_count:
+        cvs_branch.tag_ids = values[:tag_count]
+      if branch_count:
+        cvs_branch.branch_ids = values[tag_count:tag_count + branch_count]
+      if opened_count:
+        end = pos + opened_count * layout[6]
+        cvs_branch.opened_symbols = zip(
+            struct.unpack('<' + layout[5] * opened_count, s[pos:end]),
+            values[tag_count + branch_count:],
+            )
+        pos = end
+
+    end = pos + branch_number_len
+    cvs_branch.branch_number = s[pos:end]
+    if flags & (_TOKEN | _EXTRA):
+      self._load_tail(cvs_branch, flags, s, end)
+    else:
+      cvs_branch.revision_reader_token = None
+    return cvs_branch
+
+  def _dump_tag(self, cvs_tag):
+    id = cvs_tag.id
+    rel_values = _get_rel_ids(id, (cvs_tag.source_id,))
+    abs_values = [
+        id, cvs_tag.cvs_file.id, cvs_tag.symbol.id, cvs_tag.source_lod.id,
+        ]
+    widths = 3 * _get_abs_width(abs_values) + _get_rel_width(rel_values)
+    parts = [None]
+    token = cvs_tag.revision_reader_token
+    if token is not None:
+      flags = self._dump_tail(0, token, None, parts)
+    else:
+      flags = 0
+    parts[0] = struct.pack(
+        self._tag_layouts[widths][0], widths, flags,
+        *(abs_values + rel_values)
+        )
+    return ''.join(parts)
+
+  def _load_tag(self, cls, s):
+    layout = self._tag_layouts[ord(s[1])]
+    pos = layout[2]
+    (flags, id, cvs_file_id, symbol_id, source_lod_id, source_id) = \
+        struct.unpack(layout[1], s[:pos])
+
+    cvs_tag = cls.__new__(cls)
+    cvs_tag.id = id
+    ctx = self._ctx
+    cvs_tag.cvs_file = ctx._cvs_path_db.get_path(cvs_file_id)
+    cvs_tag.symbol = ctx._symbol_db.get_symbol(symbol_id)
+    cvs_tag.source_lod = ctx._symbol_db.get_symbol(source_lod_id)
+    cvs_tag.source_id = source_id and id + source_id or None
+    if flags & (_TOKEN | _EXTRA):
+      self._load_tail(cvs_tag, flags, s, pos)
+    else:
+      cvs_tag.revision_reader_token = None
+    return cvs_tag
+
+  def _dump_file_items(self, cvs_file_items):
+    (cvs_file_id, cvs_items, original_ids) = cvs_file_items.__getstate__()
+    parts = [struct.pack('<II', cvs_file_id, len(cvs_items))]
+    for cvs_item in cvs_items:
+      s = self.dumps(cvs_item)
+      parts.append(struct.pack(self.LENGTH_FORMAT, len(s)))
+      parts.append(s)
+    parts.append(marshal.dumps(original_ids))
+    return ''.join(parts)
+
+  def _load_file_items(self, cls, s):
+    (cvs_file_id, n) = struct.unpack('<II', s[1:9])
+    pos = 9
+    cvs_items = []
+    for i in xrange(n):
+      end = pos + self.LENGTH_LEN
+      (length,) = struct.unpack(self.LENGTH_FORMAT, s[pos:end])
+      pos = end + length
+      cvs_items.append(self.loads(s[end:pos]))
+    original_ids = marshal.loads(s[pos:])
+
+    cvs_file_items = cls.__new__(cls)
+    cvs_file_items.__setstate__((cvs_file_id, cvs_items, original_ids,))
+    return cvs_file_items
+
+  def dumps(self, object):
+    try:
+      (code, dump) = self._dumpers[object.__class__]
+      return code + dump(object)
+    except (KeyError, ValueError, struct.error, _Unencodable):
+      return chr(self.PICKLED) + cPickle.dumps(object, -1)
+
+  def loads(self, s):
+    code = ord(s[0])
+    if code == self.PICKLED:
+      return cPickle.loads(s[1:])
+    (cls, load) = self._loaders[code]
+    return load(cls, s)
+
+  def dumpf(self, f, object):
+    s = self.dumps(object)
+    f.write(struct.pack(self.LENGTH_FORMAT, len(s)) + s)
+
+  def loadf(self, f):
+    header = f.read(self.LENGTH_LEN)
+    if not header:
+      raise EOFError()
+    (length,) = struct.unpack(self.LENGTH_FORMAT, header)
+    return self.loads(f.read(length))
+
+
 class NewCVSItemStore:
   """A file of sequential CVSItems, grouped by CVSFile.
 
-  The file consists of a sequence of pickles.  The zeroth one is a
-  Serializer as described in the serializer module.  Subsequent ones
-  are pickled lists of CVSItems, each list containing all of the
-  CVSItems for a single file.
-
-  We don't use a single pickler for all items because the memo would
-  grow too large."""
+  The file starts with a pickled CVSItemSerializer.  It is followed
+  by one record per CVSFile, written by the serializer's dumpf()
+  method: the length of the record, then the CVSFileItems holding all
+  of the CVSItems for that file in the serializer's format."""
 
   def __init__(self, filename):
-    """Initialize an instance, creating the file and writing the primer."""
+    """Initialize an instance, creating the file and writing the serializer."""
 
     self.f = open(filename, 'wb')
 
-    self.serializer = PrimedPickleSerializer(
-        cvs_item_primer + (CVSFileItems,)
-        )
+    self.serializer = CVSItemSerializer()
     cPickle.dump(self.serializer, self.f, -1)
 
   def add(self, cvs_file_items):
@@ -82,7 +689,7 @@ class OldCVSItemStore:
   def __init__(self, filename):
     self.f = open(filename, 'rb')
 
-    # Read the memo from the first pickle:
+    # Read the serializer that wrote the records:
     self.serializer = cPickle.load(self.f)
 
   def iter_cvs_file_items(self):
@@ -101,100 +708,68 @@ class OldCVSItemStore:
     self.f = None
 
 
-class LinewiseSerializer(Serializer):
-  """A serializer that writes exactly one line for each object.
-
-  The actual serialization is done by a wrapped serializer; this class
-  only escapes any newlines in the serialized data then appends a
-  single newline."""
-
-  def __init__(self, wrapee):
-    self.wrapee = wrapee
-
-  @staticmethod
-  def _encode_newlines(s):
-    """Return s with newlines and backslashes encoded.
-
-    The string is returned with the following character transformations:
-
-      LF -> \n
-      CR -> \r
-      ^Z -> \z (needed for Windows)
-      \ -> \\
-
-    """
-
-    return s.replace('\\', '\\\\') \
-            .replace('\n', '\\n') \
-            .replace('\r', '\\r') \
-            .replace('\x1a', '\\z')
-
-  _escape_re = re.compile(r'(\\\\|\\n|\\r|\\z)')
-  _subst = {'\\n' : '\n', '\\r' : '\r', '\\z' : '\x1a', '\\\\' : '\\'}
-
-  @staticmethod
-  def _decode_newlines(s):
-    """Return s with newlines and backslashes decoded.
-
-    This function reverses the encoding of _encode_newlines().
-
-    """
-
-    def repl(m):
-      return LinewiseSerializer._subst[m.group(1)]
-
-    return LinewiseSerializer._escape_re.sub(repl, s)
-
-  def dumpf(self, f, object):
-    f.write(self.dumps(object))
-
-  def dumps(self, object):
-    return self._encode_newlines(self.wrapee.dumps(object)) + '\n'
-
-  def loadf(self, f):
-    return self.loads(f.readline())
-
-  def loads(self, s):
-    return self.wrapee.loads(self._decode_newlines(s[:-1]))
+# CVSRevision summaries are sorted by (metadata_id, timestamp), and
+# CVSSymbol summaries by symbol_id.  The keys are packed as 64-bit
+# big-endian integers.  Timestamps are offset by TIMESTAMP_BIAS so that
+# (hypothetical) negative timestamps also sort correctly:
+revision_record_format = KeyedRecordFormat(16)
+symbol_record_format = KeyedRecordFormat(8)
+TIMESTAMP_BIAS = 1 << 63
 
 
 class NewSortableCVSRevisionDatabase(object):
-  """A serially-accessible, sortable file for holding CVSRevisions.
+  """A serially-accessible, sorted file for holding CVSRevisions.
 
-  This class creates such files."""
+  This class creates such files.  Each CVSRevision is stored as a
+  record in revision_record_format.  The records are buffered in
+  memory (up to about MEMORY bytes at a time) and written to FILENAME
+  as a series of sorted runs; the offsets of the runs are pickled into
+  RUNS_FILENAME.  OldSortableCVSRevisionDatabase merges the runs while
+  reading them, so the file never has to be sorted as a whole."""
 
-  def __init__(self, filename, serializer):
-    self.f = open(filename, 'w')
-    self.serializer = LinewiseSerializer(serializer)
+  def __init__(self, filename, runs_filename, serializer, memory):
+    self.runs_filename = runs_filename
+    self.serializer = serializer
+    self.writer = SortedRunWriter(filename, revision_record_format, memory)
 
   def add(self, cvs_rev):
-    self.f.write(
-        '%x %08x %s' % (
-            cvs_rev.metadata_id, cvs_rev.timestamp,
+    self.writer.add(
+        revision_record_format.pack(
+            struct.pack(
+                '>QQ',
+                cvs_rev.metadata_id, cvs_rev.timestamp + TIMESTAMP_BIAS,
+                ),
             self.serializer.dumps(cvs_rev),
             )
         )
 
   def close(self):
-    self.f.close()
-    self.f = None
+    runs = self.writer.close()
+    self.writer = None
+    f = open(self.runs_filename, 'wb')
+    cPickle.dump(runs, f, -1)
+    f.close()
 
 
 class OldSortableCVSRevisionDatabase(object):
-  """A serially-accessible, sortable file for holding CVSRevisions.
+  """A serially-accessible, sorted file for holding CVSRevisions.
 
-  This class reads such files."""
+  This class reads such files, generating the CVSRevisions in order by
+  (metadata_id, timestamp)."""
 
-  def __init__(self, filename, serializer):
+  def __init__(self, filename, runs_filename, serializer):
     self.filename = filename
-    self.serializer = LinewiseSerializer(serializer)
+    self.serializer = serializer
+    f = open(runs_filename, 'rb')
+    self.runs = cPickle.load(f)
+    f.close()
 
   def __iter__(self):
-    f = open(self.filename, 'r')
-    for l in f:
-      s = l.split(' ', 2)[-1]
-      yield self.serializer.loads(s)
-    f.close()
+    header_size = revision_record_format.header_size
+    for record in iter_merged_runs(
+          self.filename, self.runs, revision_record_format
+          ):
+      yield self.serializer.loads(record[header_size:])
 
   def close(self):
     pass
@@ -203,15 +778,19 @@ class OldSortableCVSRevisionDatabase(object):
 class NewSortableCVSSymbolDatabase(object):
   """A serially-accessible, sortable file for holding CVSSymbols.
 
-  This class creates such files."""
+  This class creates such files.  Each CVSSymbol is stored as a record
+  in symbol_record_format, which can be sorted using sort_file()."""
 
   def __init__(self, filename, serializer):
-    self.f = open(filename, 'w')
-    self.serializer = LinewiseSerializer(serializer)
+    self.f = open(filename, 'wb', BUFSIZE)
+    self.serializer = serializer
 
   def add(self, cvs_symbol):
     self.f.write(
-        '%x %s' % (cvs_symbol.symbol.id, self.serializer.dumps(cvs_symbol))
+        symbol_record_format.pack(
+            struct.pack('>Q', cvs_symbol.symbol.id),
+            self.serializer.dumps(cvs_symbol),
+            )
         )
 
   def close(self):
@@ -226,23 +805,26 @@ class OldSortableCVSSymbolDatabase(object):
 
   def __init__(self, filename, serializer):
     self.filename = filename
-    self.serializer = LinewiseSerializer(serializer)
+    self.serializer = serializer
 
   def __iter__(self):
-    f = open(self.filename, 'r')
-    for l in f:
-      s = l.split(' ', 1)[-1]
-      yield self.serializer.loads(s)
+    f = open(self.filename, 'rb', BUFSIZE)
+    header_size = symbol_record_format.header_size
+    for record in symbol_record_format.iter_records(f):
+      yield self.serializer.loads(record[header_size:])
     f.close()
 
   def close(self):
     pass
 
 
-def IndexedCVSItemStore(filename, index_filename, mode):
+def IndexedCVSItemStore(
+      filename, index_filename, mode, cache_memory=0, readahead=False,
+      ):
   return IndexedStore(
       filename, index_filename, mode,
-      PrimedPickleSerializer(cvs_item_primer)
+      CVSItemSerializer(cvs_item_primer),
+      cache_memory=cache_memory, readahead=readahead,
       )
 
 
@@ -53,6 +53,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(sys.argv[0])))
 from cvs2svn_lib.rcsparser import Sink
 from cvs2svn_lib.rcsparser import parse
 from cvs2svn_lib.rcs_stream import RCSStream
+from cvs2svn_lib.rcs_stream import generate_edits
 
 
 def read_marks():
@@ -191,6 +192,9 @@ class WriteBlobSink(Sink):
         if not base_revrec.is_needed():
           revrecs_to_remove.append(base_revrec)
 
+  def accepts_deltatext_handles(self):
+    return True
+
   def set_revision_info(self, rev, log, text):
     revrec = self.revrecs.get(rev)
 
@@ -202,6 +206,7 @@ class WriteBlobSink(Sink):
       # This must be the last revision on trunk, for which the
       # fulltext is stored directly in the RCS file:
       assert self.last_revrec is None
+      text = text.read()
       if revrec.mark is not None:
         revrec.write_blob(self.blobfile, text)
       if revrec.is_needed():
@@ -214,7 +219,7 @@ class WriteBlobSink(Sink):
         self.last_revrec.write(
             self.fulltext_file, self.last_rcsstream.get_text()
             )
-      self.last_rcsstream.apply_diff(text)
+      self.last_rcsstream.apply_edits(generate_edits(*text.get_buffer()))
       if revrec.mark is not None:
         revrec.write_blob(self.blobfile, self.last_rcsstream.get_text())
       if revrec.is_needed():
@@ -238,7 +243,7 @@ class WriteBlobSink(Sink):
       base_revrec = self[base_rev]
       rcsstream = RCSStream(base_revrec.read_fulltext())
       base_revrec.refs.remove(rev)
-      rcsstream.apply_diff(text)
+      rcsstream.apply_edits(generate_edits(*text.get_buffer()))
       if revrec.mark is not None:
         revrec.write_blob(self.blobfile, rcsstream.get_text())
       if revrec.is_needed():
@@ -17,13 +17,26 @@
 """This module contains database facilities used by cvs2svn."""
 
 
+import struct
 import cPickle
 
 from cvs2svn_lib.common import DB_OPEN_READ
 from cvs2svn_lib.common import DB_OPEN_WRITE
 from cvs2svn_lib.common import DB_OPEN_NEW
+from cvs2svn_lib.common import FatalError
 from cvs2svn_lib.record_table import FileOffsetPacker
-from cvs2svn_lib.record_table import RecordTable
+from cvs2svn_lib.record_table import open_record_table
+from cvs2svn_lib.log import logger
+
+
+# Every IndexedDatabase file starts with this string.  It includes the
+# version of the file format, which has to be changed whenever the
+# format changes:
+FILE_HEADER = 'cvs2svn IndexedDatabase 2\n'
+
+# Each record in the file is preceded by its length, in this format:
+LENGTH_FORMAT = '<I'
+LENGTH_LEN = struct.calcsize(LENGTH_FORMAT)
 
 
 class IndexedDatabase:
@@ -32,14 +45,17 @@ class IndexedDatabase:
   The objects are indexed by small non-negative integers, and a
   RecordTable is used to store the index -> fileoffset map.
   fileoffset=0 is used to represent an empty record.  (An offset of 0
-  cannot occur for a legitimate record because the serializer is
+  cannot occur for a legitimate record because the file header is
   written there.)
 
-  The main file consists of a sequence of pickles (or other serialized
-  data format).  The zeroth record is a pickled Serializer.
+  The main file consists of FILE_HEADER followed by a sequence of
+  records, each of which is a pickle (or other serialized data format)
+  preceded by its length.  The zeroth record is a pickled Serializer.
   Subsequent ones are objects serialized using the serializer.  The
   offset of each object in the file is stored to an index table so
-  that the data can later be retrieved randomly.
+  that the data can later be retrieved randomly.  Because the length
+  of each record is known, get_many() can read records that are close
+  together in the file with a single read().
 
   Objects are always stored to the end of the file.  If an object is
   deleted or overwritten, the fact is recorded in the index_table but
@@ -47,13 +63,41 @@ class IndexedDatabase:
   advantage that one can create a modified version of a database that
   shares the main data file with an old version by copying the index
   file.  But it has the disadvantage that space is wasted whenever
-  objects are written multiple times."""
-
-  def __init__(self, filename, index_filename, mode, serializer=None):
+  objects are written multiple times.
+
+  Optionally, up to about CACHE_MEMORY bytes of deserialized objects
+  (measured by the size of their serialized form) can be kept in
+  memory, with the least recently used ones being evicted via the
+  CLOCK algorithm.  Cached objects are shared between callers, so they
+  must not be modified unless they are written back.  Also optionally,
+  when records are read in file order, READAHEAD_SIZE bytes are read
+  at a time and the following records are deserialized from memory."""
+
+  # The approximate overhead of a cached object, in bytes, in addition
+  # to the size of its serialized form:
+  CACHE_OVERHEAD_PER_OBJECT = 200
+
+  # The number of bytes to read at a time when records are read
+  # sequentially:
+  READAHEAD_SIZE = 65536
+
+  # get_many() reads records whose offsets differ by at most
+  # COALESCE_GAP bytes with a single read() of at most about
+  # MAX_COALESCED_READ bytes:
+  COALESCE_GAP = 16384
+  MAX_COALESCED_READ = 1024 * 1024
+
+  def __init__(
+        self, filename, index_filename, mode, serializer=None,
+        cache_memory=0, readahead=False,
+        ):
     """Initialize an IndexedDatabase, writing the serializer if necessary.
 
     SERIALIZER is only used if MODE is DB_OPEN_NEW; otherwise the
-    serializer is read from the file."""
+    serializer is read from the file.  CACHE_MEMORY is the approximate
+    number of bytes of objects to cache (0 disables the cache).  If
+    READAHEAD is True, records that are read in file order are read
+    in blocks of READAHEAD_SIZE bytes."""
 
     self.filename = filename
     self.index_filename = index_filename
@@ -67,44 +111,204 @@ class IndexedDatabase:
     else:
       raise RuntimeError('Invalid mode %r' % self.mode)
 
-    self.index_table = RecordTable(
+    self.index_table = open_record_table(
         self.index_filename, self.mode, FileOffsetPacker()
         )
 
     if self.mode == DB_OPEN_NEW:
       assert serializer is not None
       self.serializer = serializer
-      cPickle.dump(self.serializer, self.f, -1)
+      self.f.write(FILE_HEADER)
+      self.eofp = len(FILE_HEADER)
+      self._write_record(cPickle.dumps(self.serializer, -1))
     else:
+      if self.f.read(len(FILE_HEADER)) != FILE_HEADER:
+        raise FatalError(
+            '%s has an unknown format '
+            '(maybe it was written by another version of cvs2svn)'
+            % (self.filename,)
+            )
       # Read the memo from the first pickle:
-      self.serializer = cPickle.load(self.f)
+      self.fp = len(FILE_HEADER)
+      self.serializer = cPickle.loads(
+          self._read_record_from_file(len(FILE_HEADER))
+          )
 
     # Seek to the end of the file, and record that position:
     self.f.seek(0, 2)
     self.fp = self.f.tell()
     self.eofp = self.fp
 
+    self.cache_memory = cache_memory
+    self.readahead = readahead
+
+    # The object cache; a map {index : [referenced, item, cost]}.
+    # REFERENCED is set whenever the object is used, and cleared by the
+    # CLOCK hand as it passes.  COST is the approximate amount of memory
+    # used by the entry.
+    self._cache = {}
+
+    # The indexes in self._cache, in the order that they are visited by
+    # the CLOCK hand, and the index of the hand:
+    self._clock = []
+    self._hand = 0
+
+    # The approximate amount of memory currently used by self._cache:
+    self._cache_size = 0
+
+    # The file offset just past the record that was read most
+    # recently, or None:
+    self._next_offset = None
+
+    # The file offset of the readahead buffer, and its contents (or
+    # None if there is no buffer):
+    self._buffer_offset = 0
+    self._buffer = None
+
+    # Statistics, logged at DEBUG level when the database is closed:
+    self._hits = 0
+    self._misses = 0
+
   def __setitem__(self, index, item):
     """Write ITEM into the database indexed by INDEX."""
 
+    if index in self._cache:
+      self._discard(index)
     # Make sure we're at the end of the file:
     if self.fp != self.eofp:
       self.f.seek(self.eofp)
     self.index_table[index] = self.eofp
-    s = self.serializer.dumps(item)
-    self.f.write(s)
-    self.eofp += len(s)
+    self._write_record(self.serializer.dumps(item))
     self.fp = self.eofp
 
-  def _fetch(self, offset):
+  def _write_record(self, s):
+    """Write the serialized record S at the current file position.
+
+    The file position must be the end of the file."""
+
+    self.f.write(struct.pack(LENGTH_FORMAT, len(s)))
+    self.f.write(s)
+    self.eofp += LENGTH_LEN + len(s)
+
+  def _read_record_from_file(self, offset):
+    """Read the record at OFFSET directly from the file and return it.
+
+    Set self._next_offset to the offset just past the record."""
+
+    if self.fp != offset:
+      self.f.seek(offset)
+    (length,) = struct.unpack(LENGTH_FORMAT, self.f.read(LENGTH_LEN))
+    s = self.f.read(length)
+    if len(s) != length:
+      raise FatalError('%s is truncated' % (self.filename,))
+    self.fp = offset + LENGTH_LEN + length
+    self._next_offset = self.fp
+    return s
+
+  def _fill_buffer(self, offset, size):
+    """Read SIZE bytes starting at OFFSET into the readahead buffer."""
+
     if self.fp != offset:
       self.f.seek(offset)
+    self._buffer_offset = offset
+    self._buffer = self.f.read(size)
+    self.fp = offset + len(self._buffer)
+
+  def _read_record_from_buffer(self, offset):
+    """Return the record at OFFSET from the readahead buffer.
+
+    Return None if there is no buffer or the record is not entirely
+    within it.  Otherwise set self._next_offset to the offset just past
+    the record."""
+
+    buffer = self._buffer
+    if buffer is None:
+      return None
+    start = offset - self._buffer_offset
+    if not 0 <= start <= len(buffer) - LENGTH_LEN:
+      return None
+    end = (
+        start + LENGTH_LEN
+        + struct.unpack(LENGTH_FORMAT, buffer[start:start + LENGTH_LEN])[0]
+        )
+    if end > len(buffer):
+      return None
+    self._next_offset = self._buffer_offset + end
+    return buffer[start + LENGTH_LEN:end]
+
+  def _fetch(self, offset):
+    """Return the object stored at OFFSET.
+
+    Set self._next_offset to the offset just past its record."""
+
+    s = self._read_record_from_buffer(offset)
+    if s is None:
+      if self.readahead and offset == self._next_offset:
+        # The records are being read sequentially.  Read the following
+        # records, too:
+        self._fill_buffer(offset, self.READAHEAD_SIZE)
+        s = self._read_record_from_buffer(offset)
+      if s is None:
+        s = self._read_record_from_file(offset)
+    return self.serializer.loads(s)
+
+  def _discard(self, index):
+    """Remove the object with index INDEX from the cache."""
+
+    entry = self._cache.pop(index)
+    self._cache_size -= entry[2]
+    i = self._clock.index(index)
+    del self._clock[i]
+    if i < self._hand:
+      self._hand -= 1
+
+  def _evict(self):
+    """Remove one object from the cache, choosing it via CLOCK."""
+
+    clock = self._clock
+    while True:
+      if self._hand >= len(clock):
+        self._hand = 0
+      entry = self._cache[clock[self._hand]]
+      if entry[0]:
+        # Give the object a second chance:
+        entry[0] = False
+        self._hand += 1
+      else:
+        break
 
-    # There is no easy way to tell how much data will be read, so just
-    # indicate that we don't know the current file pointer:
-    self.fp = None
+    index = clock.pop(self._hand)
+    del self._cache[index]
+    self._cache_size -= entry[2]
 
-    return self.serializer.loadf(self.f)
+  def _fetch_index(self, index, offset):
+    """Return the object with index INDEX, stored at OFFSET.
+
+    Use the cache if it is enabled."""
+
+    if not self.cache_memory:
+      return self._fetch(offset)
+
+    try:
+      entry = self._cache[index]
+    except KeyError:
+      pass
+    else:
+      self._hits += 1
+      entry[0] = True
+      return entry[1]
+
+    self._misses += 1
+    item = self._fetch(offset)
+    cost = self._next_offset - offset + self.CACHE_OVERHEAD_PER_OBJECT
+    if cost <= self.cache_memory:
+      while self._cache_size + cost > self.cache_memory:
+        self._evict()
+      self._cache[index] = [True, item, cost]
+      self._clock.insert(self._hand, index)
+      self._hand += 1
+      self._cache_size += cost
+    return item
 
   def iterkeys(self):
     return self.index_table.iterkeys()
@@ -115,7 +319,7 @@ class IndexedDatabase:
 
   def __getitem__(self, index):
     offset = self.index_table[index]
-    return self._fetch(offset)
+    return self._fetch_index(index, offset)
 
   def get(self, item, default=None):
     try:
@@ -132,19 +336,55 @@ class IndexedDatabase:
     for (index, offset) in self.index_table.get_many(indexes):
       if offset is None:
         yield (index, default)
+      elif self.cache_memory and index in self._cache:
+        yield (index, self._fetch_index(index, offset))
       else:
         offsets.append((offset, index))
 
     # Sort the offsets to reduce disk seeking:
     offsets.sort()
-    for (offset,index) in offsets:
-      yield (index, self._fetch(offset))
+
+    # Read groups of records that are close to each other in the file
+    # with a single read():
+    i = 0
+    while i < len(offsets):
+      start = offsets[i][0]
+      j = i + 1
+      while j < len(offsets) \
+            and offsets[j][0] - offsets[j - 1][0] <= self.COALESCE_GAP \
+            and offsets[j][0] - start < self.MAX_COALESCED_READ:
+        j += 1
+      if j - i > 1:
+        # Guess that the last record is at most twice as long as the
+        # average distance between the records.  If it is longer, it
+        # is read separately:
+        end = offsets[j - 1][0]
+        self._fill_buffer(
+            start, end - start + 2 * (end - start) // (j - i - 1) + LENGTH_LEN
+            )
+      if self.cache_memory:
+        for (offset, index) in offsets[i:j]:
+          yield (index, self._fetch_index(index, offset))
+      else:
+        for (offset, index) in offsets[i:j]:
+          yield (index, self._fetch(offset))
+      i = j
 
   def __delitem__(self, index):
     # We don't actually free the data in self.f.
     del self.index_table[index]
+    if index in self._cache:
+      self._discard(index)
 
   def close(self):
+    if self.cache_memory or self.readahead:
+      logger.debug(
+          'Object cache for %s: %d hits, %d misses'
+          % (self, self._hits, self._misses,)
+          )
+    self._cache = None
+    self._clock = None
+    self._buffer = None
     self.index_table.close()
     self.index_table = None
     self.f.close()
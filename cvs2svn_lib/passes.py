@@ -32,9 +32,9 @@ from cvs2svn_lib.common import DB_OPEN_READ
 from cvs2svn_lib.common import DB_OPEN_WRITE
 from cvs2svn_lib.common import Timestamper
 from cvs2svn_lib.sort import sort_file
+from cvs2svn_lib.sort import reduce_runs
 from cvs2svn_lib.log import logger
 from cvs2svn_lib.pass_manager import Pass
-from cvs2svn_lib.serializer import PrimedPickleSerializer
 from cvs2svn_lib.artifact_manager import artifact_manager
 from cvs2svn_lib.cvs_path_database import CVSPathDatabase
 from cvs2svn_lib.metadata_database import MetadataDatabase
@@ -56,17 +56,20 @@ from cvs2svn_lib.cvs_item import CVSSymbol
 from cvs2svn_lib.cvs_item_database import OldCVSItemStore
 from cvs2svn_lib.cvs_item_database import IndexedCVSItemStore
 from cvs2svn_lib.cvs_item_database import cvs_item_primer
+from cvs2svn_lib.cvs_item_database import CVSItemSerializer
 from cvs2svn_lib.cvs_item_database import NewSortableCVSRevisionDatabase
 from cvs2svn_lib.cvs_item_database import OldSortableCVSRevisionDatabase
 from cvs2svn_lib.cvs_item_database import NewSortableCVSSymbolDatabase
 from cvs2svn_lib.cvs_item_database import OldSortableCVSSymbolDatabase
+from cvs2svn_lib.cvs_item_database import revision_record_format
+from cvs2svn_lib.cvs_item_database import symbol_record_format
 from cvs2svn_lib.key_generator import KeyGenerator
 from cvs2svn_lib.changeset import RevisionChangeset
 from cvs2svn_lib.changeset import OrderedChangeset
 from cvs2svn_lib.changeset import SymbolChangeset
 from cvs2svn_lib.changeset import BranchChangeset
 from cvs2svn_lib.changeset import create_symbol_changeset
-from cvs2svn_lib.changeset_graph import ChangesetGraph
+from cvs2svn_lib.compact_changeset_graph import CompactChangesetGraph
 from cvs2svn_lib.changeset_graph_link import ChangesetGraphLink
 from cvs2svn_lib.changeset_database import ChangesetDatabase
 from cvs2svn_lib.changeset_database import CVSItemToChangesetTable
@@ -97,7 +100,9 @@ class CollectRevsPass(Pass):
     logger.quiet("Examining all CVS ',v' files...")
     Ctx()._projects = {}
     Ctx()._cvs_path_db = CVSPathDatabase(DB_OPEN_NEW)
-    cd = CollectData(stats_keeper)
+    cd = CollectData(
+        stats_keeper, jobs=Ctx().jobs, parse_cache_dir=Ctx().parse_cache_dir
+        )
 
     # Key generator for CVSFiles:
     file_key_generator = KeyGenerator()
@@ -106,7 +111,10 @@ class CollectRevsPass(Pass):
       Ctx()._projects[project.id] = project
       cd.process_project(
           project,
-          walk_repository(project, file_key_generator, cd.record_fatal_error),
+          walk_repository(
+              project, file_key_generator, cd.record_fatal_error,
+              threads=Ctx().walker_threads,
+              ),
           )
     run_options.projects = None
 
@@ -441,6 +449,7 @@ class FilterSymbolsPass(Pass):
   def register_artifacts(self):
     self._register_temp_file(config.ITEM_SERIALIZER)
     self._register_temp_file(config.CVS_REVS_DATAFILE)
+    self._register_temp_file(config.CVS_REVS_RUNS)
     self._register_temp_file(config.CVS_SYMBOLS_DATAFILE)
     self._register_temp_file_needed(config.PROJECTS)
     self._register_temp_file_needed(config.SYMBOL_DB)
@@ -464,14 +473,16 @@ class FilterSymbolsPass(Pass):
     cvs_item_store = OldCVSItemStore(
         artifact_manager.get_temp_file(config.CVS_ITEMS_STORE))
 
-    cvs_item_serializer = PrimedPickleSerializer(cvs_item_primer)
+    cvs_item_serializer = CVSItemSerializer(cvs_item_primer)
     f = open(artifact_manager.get_temp_file(config.ITEM_SERIALIZER), 'wb')
     cPickle.dump(cvs_item_serializer, f, -1)
     f.close()
 
     rev_db = NewSortableCVSRevisionDatabase(
         artifact_manager.get_temp_file(config.CVS_REVS_DATAFILE),
+        artifact_manager.get_temp_file(config.CVS_REVS_RUNS),
         cvs_item_serializer,
+        Ctx().sort_memory * 1024 * 1024,
         )
 
     symbol_db = NewSortableCVSSymbolDatabase(
@@ -526,22 +537,54 @@ class FilterSymbolsPass(Pass):
     logger.quiet("Done")
 
 
+def _sort_file(input, output, key=None, record_format=None):
+  """Sort file INPUT into OUTPUT, using the sort options from Ctx()."""
+
+  ctx = Ctx()
+  sort_file(
+      input, output, key=key, record_format=record_format,
+      tempdirs=[ctx.tmpdir],
+      memory=ctx.sort_memory * 1024 * 1024,
+      jobs=ctx.jobs,
+      compress={'none' : False, 'zlib' : True, 'auto' : None}[
+          ctx.sort_compression
+          ],
+      )
+
+
 class SortRevisionsPass(Pass):
-  """Sort the revisions file."""
+  """Reduce the number of sorted runs in the revisions file if necessary.
+
+  FilterSymbolsPass writes the revisions file as a series of sorted
+  runs, which InitializeChangesetsPass merges while reading them.  This
+  pass only has to merge runs if there are too many to merge at once;
+  otherwise its output is just a hard link to (or a copy of) its
+  input."""
 
   def register_artifacts(self):
     self._register_temp_file(config.CVS_REVS_SORTED_DATAFILE)
+    self._register_temp_file(config.CVS_REVS_SORTED_RUNS)
     self._register_temp_file_needed(config.CVS_REVS_DATAFILE)
+    self._register_temp_file_needed(config.CVS_REVS_RUNS)
 
   def run(self, run_options, stats_keeper):
     logger.quiet("Sorting CVS revision summaries...")
-    sort_file(
+    f = open(artifact_manager.get_temp_file(config.CVS_REVS_RUNS), 'rb')
+    runs = cPickle.load(f)
+    f.close()
+
+    logger.verbose('The revision summaries are in %d runs.' % (len(runs),))
+    runs = reduce_runs(
         artifact_manager.get_temp_file(config.CVS_REVS_DATAFILE),
-        artifact_manager.get_temp_file(
-            config.CVS_REVS_SORTED_DATAFILE
-            ),
+        runs, revision_record_format,
+        artifact_manager.get_temp_file(config.CVS_REVS_SORTED_DATAFILE),
         tempdirs=[Ctx().tmpdir],
         )
+    f = open(
+        artifact_manager.get_temp_file(config.CVS_REVS_SORTED_RUNS), 'wb'
+        )
+    cPickle.dump(runs, f, -1)
+    f.close()
     logger.quiet("Done")
 
 
@@ -554,12 +597,12 @@ class SortSymbolsPass(Pass):
 
   def run(self, run_options, stats_keeper):
     logger.quiet("Sorting CVS symbol summaries...")
-    sort_file(
+    _sort_file(
         artifact_manager.get_temp_file(config.CVS_SYMBOLS_DATAFILE),
         artifact_manager.get_temp_file(
             config.CVS_SYMBOLS_SORTED_DATAFILE
             ),
-        tempdirs=[Ctx().tmpdir],
+        record_format=symbol_record_format,
         )
     logger.quiet("Done")
 
@@ -578,6 +621,7 @@ class InitializeChangesetsPass(Pass):
     self._register_temp_file_needed(config.CVS_PATHS_DB)
     self._register_temp_file_needed(config.ITEM_SERIALIZER)
     self._register_temp_file_needed(config.CVS_REVS_SORTED_DATAFILE)
+    self._register_temp_file_needed(config.CVS_REVS_SORTED_RUNS)
     self._register_temp_file_needed(
         config.CVS_SYMBOLS_SORTED_DATAFILE)
 
@@ -593,9 +637,8 @@ class InitializeChangesetsPass(Pass):
     changeset_items = []
 
     db = OldSortableCVSRevisionDatabase(
-        artifact_manager.get_temp_file(
-            config.CVS_REVS_SORTED_DATAFILE
-            ),
+        artifact_manager.get_temp_file(config.CVS_REVS_SORTED_DATAFILE),
+        artifact_manager.get_temp_file(config.CVS_REVS_SORTED_RUNS),
         self.cvs_item_serializer,
         )
 
@@ -842,6 +885,7 @@ class BreakRevisionChangesetCyclesPass(Pass):
     self._register_temp_file(config.CHANGESETS_REVBROKEN_STORE)
     self._register_temp_file(config.CHANGESETS_REVBROKEN_INDEX)
     self._register_temp_file(config.CVS_ITEM_TO_CHANGESET_REVBROKEN)
+    self._register_temp_file(config.CHANGESET_GRAPH_REVBROKEN)
     self._register_temp_file_needed(config.PROJECTS)
     self._register_temp_file_needed(config.SYMBOL_DB)
     self._register_temp_file_needed(config.CVS_PATHS_DB)
@@ -855,7 +899,7 @@ class BreakRevisionChangesetCyclesPass(Pass):
     old_changeset_db = ChangesetDatabase(
         artifact_manager.get_temp_file(config.CHANGESETS_STORE),
         artifact_manager.get_temp_file(config.CHANGESETS_INDEX),
-        DB_OPEN_READ)
+        DB_OPEN_READ, readahead=True)
 
     changeset_ids = old_changeset_db.keys()
 
@@ -914,7 +958,8 @@ class BreakRevisionChangesetCyclesPass(Pass):
     Ctx()._cvs_items_db = IndexedCVSItemStore(
         artifact_manager.get_temp_file(config.CVS_ITEMS_SORTED_STORE),
         artifact_manager.get_temp_file(config.CVS_ITEMS_SORTED_INDEX_TABLE),
-        DB_OPEN_READ)
+        DB_OPEN_READ,
+        cache_memory=config.CYCLE_BREAKING_CACHE_MEMORY, readahead=True)
 
     shutil.copyfile(
         artifact_manager.get_temp_file(
@@ -929,19 +974,25 @@ class BreakRevisionChangesetCyclesPass(Pass):
     changeset_db = ChangesetDatabase(
         artifact_manager.get_temp_file(config.CHANGESETS_REVBROKEN_STORE),
         artifact_manager.get_temp_file(config.CHANGESETS_REVBROKEN_INDEX),
-        DB_OPEN_NEW)
+        DB_OPEN_NEW,
+        cache_memory=config.CYCLE_BREAKING_CACHE_MEMORY)
 
-    self.changeset_graph = ChangesetGraph(
+    self.changeset_graph = CompactChangesetGraph(
         changeset_db, cvs_item_to_changeset_id
         )
 
     max_changeset_id = 0
     for changeset in self.get_source_changesets():
       changeset_db.store(changeset)
-      if isinstance(changeset, RevisionChangeset):
-        self.changeset_graph.add_changeset(changeset)
       max_changeset_id = max(max_changeset_id, changeset.id)
 
+    # Add the RevisionChangesets to the graph in id order:
+    self.changeset_graph.add_changesets(
+        changeset
+        for changeset in changeset_db.itervalues()
+        if isinstance(changeset, RevisionChangeset)
+        )
+
     self.changeset_key_generator = KeyGenerator(max_changeset_id + 1)
 
     self.processed_changeset_logger = ProcessedChangesetLogger()
@@ -955,6 +1006,9 @@ class BreakRevisionChangesetCyclesPass(Pass):
     self.processed_changeset_logger.flush()
     del self.processed_changeset_logger
 
+    self.changeset_graph.save(
+        artifact_manager.get_temp_file(config.CHANGESET_GRAPH_REVBROKEN)
+        )
     self.changeset_graph.close()
     self.changeset_graph = None
     Ctx()._cvs_items_db.close()
@@ -979,7 +1033,7 @@ class RevisionTopologicalSortPass(Pass):
     self._register_temp_file_needed(config.CVS_ITEMS_SORTED_INDEX_TABLE)
     self._register_temp_file_needed(config.CHANGESETS_REVBROKEN_STORE)
     self._register_temp_file_needed(config.CHANGESETS_REVBROKEN_INDEX)
-    self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET_REVBROKEN)
+    self._register_temp_file_needed(config.CHANGESET_GRAPH_REVBROKEN)
 
   def get_source_changesets(self, changeset_db):
     changeset_ids = changeset_db.keys()
@@ -994,20 +1048,15 @@ class RevisionTopologicalSortPass(Pass):
         DB_OPEN_READ,
         )
 
-    changeset_graph = ChangesetGraph(
-        changeset_db,
-        CVSItemToChangesetTable(
-            artifact_manager.get_temp_file(
-                config.CVS_ITEM_TO_CHANGESET_REVBROKEN
-                ),
-            DB_OPEN_READ,
-            )
+    # BreakRevisionChangesetCyclesPass saved the nodes of the
+    # RevisionChangesets:
+    changeset_graph = CompactChangesetGraph(changeset_db, None)
+    changeset_graph.load(
+        artifact_manager.get_temp_file(config.CHANGESET_GRAPH_REVBROKEN)
         )
 
     for changeset in self.get_source_changesets(changeset_db):
-      if isinstance(changeset, RevisionChangeset):
-        changeset_graph.add_changeset(changeset)
-      else:
+      if not isinstance(changeset, RevisionChangeset):
         yield changeset
 
     changeset_ids = []
@@ -1065,6 +1114,7 @@ class BreakSymbolChangesetCyclesPass(Pass):
     self._register_temp_file(config.CHANGESETS_SYMBROKEN_STORE)
     self._register_temp_file(config.CHANGESETS_SYMBROKEN_INDEX)
     self._register_temp_file(config.CVS_ITEM_TO_CHANGESET_SYMBROKEN)
+    self._register_temp_file(config.CHANGESET_GRAPH_SYMBROKEN)
     self._register_temp_file_needed(config.PROJECTS)
     self._register_temp_file_needed(config.SYMBOL_DB)
     self._register_temp_file_needed(config.CVS_PATHS_DB)
@@ -1078,7 +1128,7 @@ class BreakSymbolChangesetCyclesPass(Pass):
     old_changeset_db = ChangesetDatabase(
         artifact_manager.get_temp_file(config.CHANGESETS_REVSORTED_STORE),
         artifact_manager.get_temp_file(config.CHANGESETS_REVSORTED_INDEX),
-        DB_OPEN_READ)
+        DB_OPEN_READ, readahead=True)
 
     changeset_ids = old_changeset_db.keys()
 
@@ -1136,7 +1186,8 @@ class BreakSymbolChangesetCyclesPass(Pass):
     Ctx()._cvs_items_db = IndexedCVSItemStore(
         artifact_manager.get_temp_file(config.CVS_ITEMS_SORTED_STORE),
         artifact_manager.get_temp_file(config.CVS_ITEMS_SORTED_INDEX_TABLE),
-        DB_OPEN_READ)
+        DB_OPEN_READ,
+        cache_memory=config.CYCLE_BREAKING_CACHE_MEMORY, readahead=True)
 
     shutil.copyfile(
         artifact_manager.get_temp_file(
@@ -1151,19 +1202,30 @@ class BreakSymbolChangesetCyclesPass(Pass):
     changeset_db = ChangesetDatabase(
         artifact_manager.get_temp_file(config.CHANGESETS_SYMBROKEN_STORE),
         artifact_manager.get_temp_file(config.CHANGESETS_SYMBROKEN_INDEX),
-        DB_OPEN_NEW)
+        DB_OPEN_NEW,
+        cache_memory=config.CYCLE_BREAKING_CACHE_MEMORY)
 
-    self.changeset_graph = ChangesetGraph(
+    self.changeset_graph = CompactChangesetGraph(
         changeset_db, cvs_item_to_changeset_id
         )
 
+    # The OrderedChangesets are added to the graph, too, so that the
+    # graph can be saved for BreakAllChangesetCyclesPass.  But they are
+    # removed from it again before it is consumed:
+    ordered_changeset_ids = []
     max_changeset_id = 0
     for changeset in self.get_source_changesets():
       changeset_db.store(changeset)
-      if isinstance(changeset, SymbolChangeset):
-        self.changeset_graph.add_changeset(changeset)
+      if isinstance(changeset, OrderedChangeset):
+        ordered_changeset_ids.append(changeset.id)
       max_changeset_id = max(max_changeset_id, changeset.id)
 
+    self.changeset_graph.add_changesets(changeset_db.itervalues())
+
+    for changeset_id in ordered_changeset_ids:
+      del self.changeset_graph[changeset_id]
+    del ordered_changeset_ids
+
     self.changeset_key_generator = KeyGenerator(max_changeset_id + 1)
 
     self.processed_changeset_logger = ProcessedChangesetLogger()
@@ -1177,6 +1239,9 @@ class BreakSymbolChangesetCyclesPass(Pass):
     self.processed_changeset_logger.flush()
     del self.processed_changeset_logger
 
+    self.changeset_graph.save(
+        artifact_manager.get_temp_file(config.CHANGESET_GRAPH_SYMBROKEN)
+        )
     self.changeset_graph.close()
     self.changeset_graph = None
     Ctx()._cvs_items_db.close()
@@ -1193,6 +1258,7 @@ class BreakAllChangesetCyclesPass(Pass):
     self._register_temp_file(config.CHANGESETS_ALLBROKEN_STORE)
     self._register_temp_file(config.CHANGESETS_ALLBROKEN_INDEX)
     self._register_temp_file(config.CVS_ITEM_TO_CHANGESET_ALLBROKEN)
+    self._register_temp_file(config.CHANGESET_GRAPH_ALLBROKEN)
     self._register_temp_file_needed(config.PROJECTS)
     self._register_temp_file_needed(config.SYMBOL_DB)
     self._register_temp_file_needed(config.CVS_PATHS_DB)
@@ -1201,12 +1267,13 @@ class BreakAllChangesetCyclesPass(Pass):
     self._register_temp_file_needed(config.CHANGESETS_SYMBROKEN_STORE)
     self._register_temp_file_needed(config.CHANGESETS_SYMBROKEN_INDEX)
     self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET_SYMBROKEN)
+    self._register_temp_file_needed(config.CHANGESET_GRAPH_SYMBROKEN)
 
   def get_source_changesets(self):
     old_changeset_db = ChangesetDatabase(
         artifact_manager.get_temp_file(config.CHANGESETS_SYMBROKEN_STORE),
         artifact_manager.get_temp_file(config.CHANGESETS_SYMBROKEN_INDEX),
-        DB_OPEN_READ)
+        DB_OPEN_READ, readahead=True)
 
     changeset_ids = old_changeset_db.keys()
 
@@ -1356,7 +1423,8 @@ class BreakAllChangesetCyclesPass(Pass):
     Ctx()._cvs_items_db = IndexedCVSItemStore(
         artifact_manager.get_temp_file(config.CVS_ITEMS_SORTED_STORE),
         artifact_manager.get_temp_file(config.CVS_ITEMS_SORTED_INDEX_TABLE),
-        DB_OPEN_READ)
+        DB_OPEN_READ,
+        cache_memory=config.CYCLE_BREAKING_CACHE_MEMORY, readahead=True)
 
     shutil.copyfile(
         artifact_manager.get_temp_file(
@@ -1371,11 +1439,17 @@ class BreakAllChangesetCyclesPass(Pass):
     self.changeset_db = ChangesetDatabase(
         artifact_manager.get_temp_file(config.CHANGESETS_ALLBROKEN_STORE),
         artifact_manager.get_temp_file(config.CHANGESETS_ALLBROKEN_INDEX),
-        DB_OPEN_NEW)
+        DB_OPEN_NEW,
+        cache_memory=config.CYCLE_BREAKING_CACHE_MEMORY)
 
-    self.changeset_graph = ChangesetGraph(
+    # BreakSymbolChangesetCyclesPass saved the nodes of all of the
+    # changesets:
+    self.changeset_graph = CompactChangesetGraph(
         self.changeset_db, self.cvs_item_to_changeset_id
         )
+    self.changeset_graph.load(
+        artifact_manager.get_temp_file(config.CHANGESET_GRAPH_SYMBROKEN)
+        )
 
     # A map {changeset_id : ordinal} for OrderedChangesets:
     self.ordinals = {}
@@ -1386,7 +1460,6 @@ class BreakAllChangesetCyclesPass(Pass):
     max_changeset_id = 0
     for changeset in self.get_source_changesets():
       self.changeset_db.store(changeset)
-      self.changeset_graph.add_changeset(changeset)
       if isinstance(changeset, OrderedChangeset):
         ordered_changeset_map[changeset.ordinal] = changeset.id
         self.ordinals[changeset.id] = changeset.ordinal
@@ -1455,6 +1528,9 @@ class BreakAllChangesetCyclesPass(Pass):
         self.break_cycle(self.changeset_graph.find_cycle(id))
 
     del self.processed_changeset_logger
+    self.changeset_graph.save(
+        artifact_manager.get_temp_file(config.CHANGESET_GRAPH_ALLBROKEN)
+        )
     self.changeset_graph.close()
     self.changeset_graph = None
     self.cvs_item_to_changeset_id = None
@@ -1475,7 +1551,7 @@ class TopologicalSortPass(Pass):
     self._register_temp_file_needed(config.CVS_ITEMS_SORTED_INDEX_TABLE)
     self._register_temp_file_needed(config.CHANGESETS_ALLBROKEN_STORE)
     self._register_temp_file_needed(config.CHANGESETS_ALLBROKEN_INDEX)
-    self._register_temp_file_needed(config.CVS_ITEM_TO_CHANGESET_ALLBROKEN)
+    self._register_temp_file_needed(config.CHANGESET_GRAPH_ALLBROKEN)
 
   def get_source_changesets(self, changeset_db):
     for changeset_id in changeset_db.keys():
@@ -1489,19 +1565,15 @@ class TopologicalSortPass(Pass):
         artifact_manager.get_temp_file(config.CHANGESETS_ALLBROKEN_INDEX),
         DB_OPEN_READ)
 
-    changeset_graph = ChangesetGraph(
-        changeset_db,
-        CVSItemToChangesetTable(
-            artifact_manager.get_temp_file(
-                config.CVS_ITEM_TO_CHANGESET_ALLBROKEN
-                ),
-            DB_OPEN_READ,
-            ),
+    # BreakAllChangesetCyclesPass saved the nodes of all of the
+    # changesets:
+    changeset_graph = CompactChangesetGraph(changeset_db, None)
+    changeset_graph.load(
+        artifact_manager.get_temp_file(config.CHANGESET_GRAPH_ALLBROKEN)
         )
     symbol_changeset_ids = set()
 
     for changeset in self.get_source_changesets(changeset_db):
-      changeset_graph.add_changeset(changeset)
       if isinstance(changeset, SymbolChangeset):
         symbol_changeset_ids.add(changeset.id)
 
@@ -1639,6 +1711,13 @@ class CreateRevsPass(Pass):
     logger.quiet("Done")
 
 
+def _symbol_openings_closings_sort_key(line):
+  # (This is a module-level function so that it can be passed to
+  # sorting worker processes.)
+  line = line.split(' ', 2)
+  return (int(line[0], 16), int(line[1]), line[2],)
+
+
 class SortSymbolOpeningsClosingsPass(Pass):
   """This pass was formerly known as pass6."""
 
@@ -1649,17 +1728,12 @@ class SortSymbolOpeningsClosingsPass(Pass):
   def run(self, run_options, stats_keeper):
     logger.quiet("Sorting symbolic name source revisions...")
 
-    def sort_key(line):
-      line = line.split(' ', 2)
-      return (int(line[0], 16), int(line[1]), line[2],)
-
-    sort_file(
+    _sort_file(
         artifact_manager.get_temp_file(config.SYMBOL_OPENINGS_CLOSINGS),
         artifact_manager.get_temp_file(
             config.SYMBOL_OPENINGS_CLOSINGS_SORTED
             ),
-        key=sort_key,
-        tempdirs=[Ctx().tmpdir],
+        key=_symbol_openings_closings_sort_key,
         )
     logger.quiet("Done")
 
@@ -1761,6 +1835,8 @@ class OutputPass(Pass):
       svn_commit = Ctx()._persistence_manager.get_svn_commit(svn_revnum)
 
     Ctx().output_option.cleanup()
+    if Ctx().revision_reader is not None:
+      Ctx().revision_reader.record_statistics(stats_keeper)
     Ctx()._persistence_manager.close()
 
     Ctx()._symbol_db.close()
@@ -23,7 +23,7 @@ from cvs2svn_lib.common import DB_OPEN_READ
 from cvs2svn_lib.common import SVN_INVALID_REVNUM
 from cvs2svn_lib.artifact_manager import artifact_manager
 from cvs2svn_lib.record_table import SignedIntegerPacker
-from cvs2svn_lib.record_table import RecordTable
+from cvs2svn_lib.record_table import open_record_table
 from cvs2svn_lib.serializer import PrimedPickleSerializer
 from cvs2svn_lib.indexed_database import IndexedDatabase
 from cvs2svn_lib.svn_commit import SVNRevisionCommit
@@ -65,7 +65,7 @@ class PersistenceManager:
         artifact_manager.get_temp_file(config.SVN_COMMITS_INDEX_TABLE),
         artifact_manager.get_temp_file(config.SVN_COMMITS_STORE),
         mode, serializer)
-    self.cvs2svn_db = RecordTable(
+    self.cvs2svn_db = open_record_table(
         artifact_manager.get_temp_file(config.CVS_REVS_TO_SVN_REVNUMS),
         mode, SignedIntegerPacker(SVN_INVALID_REVNUM))
 
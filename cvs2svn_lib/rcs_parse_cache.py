@@ -0,0 +1,149 @@
+# (Be in -*- python -*- mode.)
+#
+# ====================================================================
+# Copyright (c) 2000-2009 CollabNet.  All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.  The terms
+# are also available at http://subversion.tigris.org/license-1.html.
+# If newer versions of this license are posted there, you may use a
+# newer version instead, at your option.
+#
+# This software consists of voluntary contributions made by many
+# individuals.  For exact contribution history, see the revision
+# history and logs, available at http://cvs2svn.tigris.org/.
+# ====================================================================
+
+"""This module contains a persistent cache of parsed RCS files.
+
+The cache lives in a directory that survives between conversions.  It
+holds one entry per RCS file, stored in a file whose name is derived
+from the RCS file's path.  Each entry records the size, mtime, and
+SHA-1 digest of the RCS file that it was computed from; an entry is
+only used if all three still match."""
+
+
+import os
+import errno
+import tempfile
+import cPickle
+
+try:
+  from hashlib import sha1
+except ImportError:
+  from sha import new as sha1
+
+from cvs2svn_lib.common import FatalError
+
+
+class RCSParseCache:
+  """A directory holding the results of parsing RCS files.
+
+  The values stored in the cache must be picklable.  Instances of this
+  class are themselves picklable, so that they can be handed to worker
+  processes."""
+
+  # Increment this whenever the format of the cached values changes,
+  # to invalidate all existing entries:
+  FORMAT_VERSION = 1
+
+  # The size of the blocks in which RCS files are read for hashing:
+  BUFSIZE = 256 * 1024
+
+  def __init__(self, directory):
+    self.directory = directory
+
+    if not os.path.isdir(self.directory):
+      try:
+        os.makedirs(self.directory)
+      except OSError, e:
+        raise FatalError(
+            'Cannot create parse cache directory %r: %s'
+            % (self.directory, e.strerror,)
+            )
+
+  def _get_entry_path(self, rcs_path):
+    name = sha1(os.path.abspath(rcs_path)).hexdigest()
+    return os.path.join(self.directory, name[:2], name[2:])
+
+  def get_signature(self, rcs_path):
+    """Return a signature identifying the current contents of RCS_PATH.
+
+    The signature is a tuple (size, mtime, digest)."""
+
+    f = open(rcs_path, 'rb')
+    try:
+      st = os.fstat(f.fileno())
+      digest = sha1()
+      while True:
+        s = f.read(self.BUFSIZE)
+        if not s:
+          break
+        digest.update(s)
+    finally:
+      f.close()
+
+    return (st.st_size, st.st_mtime, digest.hexdigest(),)
+
+  def lookup(self, rcs_path):
+    """Look up the cached value for the file at RCS_PATH.
+
+    Return a tuple (signature, value), where SIGNATURE is the current
+    signature of the file (for use with store()) and VALUE is the
+    cached value, or None if there is no valid cache entry."""
+
+    signature = self.get_signature(rcs_path)
+
+    try:
+      f = open(self._get_entry_path(rcs_path), 'rb')
+    except IOError:
+      return (signature, None)
+
+    try:
+      try:
+        (format_version, entry_rcs_path, entry_signature, value) = \
+            cPickle.load(f)
+      except Exception:
+        # A corrupt or truncated entry is treated as a miss:
+        return (signature, None)
+    finally:
+      f.close()
+
+    if (format_version, entry_rcs_path, entry_signature) \
+           != (self.FORMAT_VERSION, os.path.abspath(rcs_path), signature):
+      return (signature, None)
+
+    return (signature, value)
+
+  def store(self, rcs_path, signature, value):
+    """Store VALUE as the cached value for RCS_PATH.
+
+    SIGNATURE is the signature that was returned by lookup() (i.e., the
+    signature of the file contents from which VALUE was computed).  The
+    entry is written to a temporary file and then renamed into place,
+    so concurrent readers never see a partial entry."""
+
+    entry_path = self._get_entry_path(rcs_path)
+    entry_dir = os.path.dirname(entry_path)
+    try:
+      os.mkdir(entry_dir)
+    except OSError, e:
+      if e.errno != errno.EEXIST:
+        raise
+
+    (fd, tmp_path) = tempfile.mkstemp(dir=entry_dir)
+    f = os.fdopen(fd, 'wb')
+    try:
+      cPickle.dump(
+          (self.FORMAT_VERSION, os.path.abspath(rcs_path), signature, value,),
+          f, -1
+          )
+    finally:
+      f.close()
+
+    try:
+      os.rename(tmp_path, entry_path)
+    except OSError:
+      # On Windows, rename() does not replace an existing file:
+      os.remove(entry_path)
+      os.rename(tmp_path, entry_path)
@@ -21,17 +21,17 @@ from cStringIO import StringIO
 import re
 
 
+# A line, including its terminating \n (if any):
+line_re = re.compile(r'[^\n]*\n|[^\n]+')
+
+
 def msplit(s):
   """Split S into an array of lines.
 
   Only \n is a line separator. The line endings are part of the lines."""
 
   # return s.splitlines(True) clobbers \r
-  re = [ i + "\n" for i in s.split("\n") ]
-  re[-1] = re[-1][:-1]
-  if not re[-1]:
-    del re[-1]
-  return re
+  return line_re.findall(s)
 
 
 class MalformedDeltaException(Exception):
@@ -40,10 +40,32 @@ class MalformedDeltaException(Exception):
   pass
 
 
-ed_command_re = re.compile(r'^([ad])(\d+)\s(\d+)\n$')
+ed_command_re = re.compile(r'([ad])(\d+)[ \t\r\v\f](\d+)\n')
+
+# Regular expressions matching a number of consecutive lines, keyed by
+# that number; see _get_lines_re():
+_lines_res = {}
+
+# The largest number of lines for which _get_lines_re() caches a
+# regular expression itself.  Larger ones are left to re's own cache:
+_LINES_RES_MAX_CACHED = 256
+
+
+def _get_lines_re(count):
+  """Return a regular expression matching COUNT consecutive lines.
+
+  COUNT must be positive.  Only the last line of a delta may lack its
+  terminating \n."""
 
+  lines_re = re.compile(
+      r'(?:[^\n]*\n){%d}(?:[^\n]*\n|[^\n]+\Z)' % (count - 1,)
+      )
+  if count <= _LINES_RES_MAX_CACHED:
+    _lines_res[count] = lines_re
+  return lines_re
 
-def generate_edits(diff):
+
+def generate_edits(diff, start=0, end=None, escaped=False):
   """Generate edit commands from an RCS diff block.
 
   DIFF is a string holding an entire RCS file delta.  Generate a tuple
@@ -57,28 +79,51 @@ def generate_edits(diff):
           line INPUT_POS.
 
   In all cases, INPUT_POS is expressed as a zero-offset line number
-  within the input revision."""
-
-  diff = msplit(diff)
-  i = 0
-
-  while i < len(diff):
-    m = ed_command_re.match(diff[i])
+  within the input revision.
+
+  DIFF can also be any string-like object that supports slicing,
+  find(), and regular expression matching (for example an mmap), in
+  which case only DIFF[START:END] is used.  The delta is scanned in
+  place: the ed commands are matched at their positions in DIFF, the
+  end of each add block is found by matching its lines with a regular
+  expression, and only the added lines are copied out of DIFF.  If ESCAPED is true, the delta
+  is still in RCS @-string form, and '@@' sequences are unescaped in
+  the added lines (ed commands never contain '@')."""
+
+  if end is None:
+    end = len(diff)
+  unescape = escaped and diff.find('@@', start, end) != -1
+  pos = start
+
+  while pos < end:
+    m = ed_command_re.match(diff, pos, end)
     if not m:
       raise MalformedDeltaException('Bad ed command')
-    i += 1
-    command = m.group(1)
-    start = int(m.group(2))
-    count = int(m.group(3))
+    pos = m.end()
+    (command, line, count) = m.groups()
     if command == 'd':
       # "d" - Delete command
-      yield ('d', start - 1, count)
+      yield ('d', int(line) - 1, int(count))
     else:
-      # "a" - Add command
-      if i + count > len(diff):
+      # "a" - Add command.  Skip the added lines to find the end of
+      # the block, then copy them out of DIFF:
+      count = int(count)
+      if count == 0:
+        yield ('a', int(line), [])
+        continue
+      lines_re = _lines_res.get(count)
+      if lines_re is None:
+        lines_re = _get_lines_re(count)
+      m = lines_re.match(diff, pos, end)
+      if not m:
         raise MalformedDeltaException('Add block truncated')
-      yield ('a', start, diff[i:i + count])
-      i += count
+      block_end = m.end()
+      if unescape and diff.find('@@', pos, block_end) != -1:
+        lines = line_re.findall(diff[pos:block_end].replace('@@', '@'))
+      else:
+        lines = line_re.findall(diff, pos, block_end)
+      pos = block_end
+      yield ('a', int(line), lines)
 
 
 def merge_blocks(blocks):
@@ -260,17 +305,25 @@ class RCSStream:
     if copied_lines:
       yield ('c', copied_lines, copied_lines)
 
-  def apply_diff(self, diff):
-    """Apply the RCS diff DIFF to the current file content."""
+  def apply_edits(self, edits):
+    """Apply EDITS to the current file content.
+
+    EDITS is an iterable over RCS edits, as generated by
+    generate_edits()."""
 
     lines = []
 
-    blocks = self.generate_blocks(generate_edits(diff))
+    blocks = self.generate_blocks(edits)
     for (command, old_lines, new_lines) in blocks:
       lines += new_lines
 
     self._lines = lines
 
+  def apply_diff(self, diff):
+    """Apply the RCS diff DIFF to the current file content."""
+
+    self.apply_edits(generate_edits(diff))
+
   def apply_and_invert_edits(self, edits):
     """Apply EDITS and generate their inverse.
 
@@ -293,6 +346,17 @@ class RCSStream:
 
     return generate_edits_from_blocks(invert_blocks(blocks))
 
+  def invert_edits(self, edits):
+    """Apply EDITS and return their inverse as an RCS diff.
+
+    Apply EDITS to the current file content.  Simultaneously generate
+    an RCS diff suitable for reverting the change, and return it as a
+    string."""
+
+    inverse_diff = StringIO()
+    write_edits(inverse_diff, self.apply_and_invert_edits(edits))
+    return inverse_diff.getvalue()
+
   def invert_diff(self, diff):
     """Apply DIFF and generate its inverse.
 
@@ -300,10 +364,6 @@ class RCSStream:
     Simultaneously generate an RCS diff suitable for reverting the
     change, and return it as a string."""
 
-    inverse_diff = StringIO()
-    write_edits(
-        inverse_diff, self.apply_and_invert_edits(generate_edits(diff))
-        )
-    return inverse_diff.getvalue()
+    return self.invert_edits(generate_edits(diff))
 
 
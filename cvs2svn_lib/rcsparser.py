@@ -35,6 +35,19 @@ def select_texttools_parser():
   selected_parser = cvs2svn_rcsparse.texttools.Parser
 
 
+def select_fast_parser():
+  """Configure this module to use the fast (regular expression) parser.
+
+  The fast parser maps RCS files into memory and tokenizes them using
+  compiled regular expressions.  It is faster than the Python parser
+  but, unlike the texttools parser, only needs the Python standard
+  library."""
+
+  global selected_parser
+  import cvs2svn_rcsparse.fast
+  selected_parser = cvs2svn_rcsparse.fast.Parser
+
+
 def select_python_parser():
   """Configure this module to use the Python parser.
 
@@ -51,7 +64,10 @@ def select_parser():
   try:
     select_texttools_parser()
   except ImportError:
-    select_python_parser()
+    try:
+      select_fast_parser()
+    except ImportError:
+      select_python_parser()
 
 
 def parse(file, sink):
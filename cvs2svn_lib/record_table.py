@@ -33,6 +33,7 @@ been written by filling them with packer.empty_value.  If a record is
 read which contains packer.empty_value, then a KeyError is raised."""
 
 
+import sys
 import os
 import types
 import struct
@@ -219,13 +220,31 @@ class AbstractRecordTable:
 
 
 class RecordTable(AbstractRecordTable):
+  """A RecordTable that accesses its file via a cache of pages.
+
+  The file is read and written in pages of about PAGE_SIZE bytes.  Up
+  to about CACHE_MEMORY bytes' worth of pages are kept in memory.
+  When the cache is full, pages are evicted using the CLOCK algorithm
+  (an approximation of least-recently-used); pages that have been
+  modified are written back to disk when they are evicted or when the
+  table is flushed."""
+
   # The approximate amount of memory that should be used for the cache
   # for each instance of this class:
   CACHE_MEMORY = 4 * 1024 * 1024
 
-  # Empirically, each entry in the cache table has an overhead of
-  # about 96 bytes on a 32-bit computer.
-  CACHE_OVERHEAD_PER_ENTRY = 96
+  # The approximate size of a page, in bytes.  (A page always holds a
+  # whole number of records.)
+  PAGE_SIZE = 4096
+
+  # The approximate overhead of a cached page, in bytes, in addition
+  # to the size of its contents:
+  CACHE_OVERHEAD_PER_PAGE = 200
+
+  # Records that are modified are kept in a dict until there are
+  # enough of them to be worth merging into the page's string.  The
+  # approximate overhead of each entry in such a dict, in bytes:
+  CACHE_OVERHEAD_PER_RECORD = 96
 
   def __init__(self, filename, mode, packer, cache_memory=CACHE_MEMORY):
     AbstractRecordTable.__init__(self, filename, mode, packer)
@@ -239,17 +258,35 @@ class RecordTable(AbstractRecordTable):
       raise RuntimeError('Invalid mode %r' % self.mode)
     self.cache_memory = cache_memory
 
-    # Number of items that can be stored in the write cache.
-    self._max_memory_cache = (
-        self.cache_memory
-        / (self.CACHE_OVERHEAD_PER_ENTRY + self._record_len))
-
-    # Read and write cache; a map {i : (dirty, s)}, where i is an
-    # index, dirty indicates whether the value has to be written to
-    # disk, and s is the packed value for the index.  Up to
-    # self._max_memory_cache items can be stored here.  When the cache
-    # fills up, it is written to disk in one go and then cleared.
-    self._cache = {}
+    self._records_per_page = max(1, self.PAGE_SIZE // self._record_len)
+    self._page_len = self._records_per_page * self._record_len
+    self._page_cost = self._page_len + self.CACHE_OVERHEAD_PER_PAGE
+    self._record_cost = self._record_len + self.CACHE_OVERHEAD_PER_RECORD
+    # The number of modified records at which they are merged into
+    # the page's string:
+    self._max_modified = max(1, self._records_per_page // 8)
+
+    # The page cache; a map {page_number : [referenced, dirty, data,
+    # modified]}.  REFERENCED is set whenever the page is used, and
+    # cleared by the CLOCK hand as it passes.  DIRTY is True iff the
+    # page has to be written back to disk.  DATA is a string holding
+    # the packed records of the page, except that the records whose
+    # numbers (within the page) are keys of the dict MODIFIED have been
+    # replaced by the corresponding values.
+    self._pages = {}
+
+    # The page numbers in self._pages, in the order that they are
+    # visited by the CLOCK hand, and the index of the hand:
+    self._clock = []
+    self._hand = 0
+
+    # The approximate amount of memory currently used by self._pages:
+    self._cache_size = 0
+
+    # Statistics, logged at DEBUG level when the table is closed:
+    self._hits = 0
+    self._misses = 0
+    self._pages_written = 0
 
     # The index just beyond the last record ever written:
     self._limit = os.path.getsize(self.filename) // self._record_len
@@ -257,110 +294,216 @@ class RecordTable(AbstractRecordTable):
     # The index just beyond the last record ever written to disk:
     self._limit_written = self._limit
 
+  def _merge_modified(self, entry):
+    """Merge the modified records of cache ENTRY into its string."""
+
+    modified = entry[3]
+    rl = self._record_len
+    data = entry[2]
+    pieces = []
+    pos = 0
+    for j in sorted(modified):
+      pieces.append(data[pos:j * rl])
+      pieces.append(modified[j])
+      pos = (j + 1) * rl
+    pieces.append(data[pos:])
+    entry[2] = ''.join(pieces)
+    self._cache_size -= len(modified) * self._record_cost
+    entry[3] = {}
+
+  def _write_page(self, page_number, entry):
+    """Write the page PAGE_NUMBER, with cache ENTRY, to disk."""
+
+    if entry[3]:
+      self._merge_modified(entry)
+
+    start = page_number * self._records_per_page
+    end = min(start + self._records_per_page, self._limit)
+    f = self.f
+    if start > self._limit_written:
+      # Fill the gap between the end of the file and the start of the
+      # page with empty_values:
+      f.seek(self._limit_written * self._record_len)
+      f.write(self.packer.empty_value * (start - self._limit_written))
+    else:
+      f.seek(start * self._record_len)
+    f.write(entry[2][:(end - start) * self._record_len])
+    self._limit_written = max(self._limit_written, end)
+    entry[1] = False
+    self._pages_written += 1
+
+  def _read_page(self, page_number):
+    """Read page PAGE_NUMBER from disk and add it to the cache.
+
+    Return its cache entry."""
+
+    self._misses += 1
+    start = page_number * self._records_per_page
+    if start < self._limit_written:
+      self.f.seek(start * self._record_len)
+      data = self.f.read(self._page_len)
+    else:
+      data = ''
+    if len(data) < self._page_len:
+      # Records beyond the end of the file are empty:
+      data += self.packer.empty_value * (
+          self._records_per_page - len(data) // self._record_len
+          )
+
+    while self._cache_size + self._page_cost > self.cache_memory \
+          and self._pages:
+      self._evict_page()
+
+    entry = [True, False, data, {}]
+    self._pages[page_number] = entry
+    self._clock.insert(self._hand, page_number)
+    self._hand += 1
+    self._cache_size += self._page_cost
+    return entry
+
+  def _evict_page(self):
+    """Remove one page from the cache, choosing it via CLOCK."""
+
+    clock = self._clock
+    while True:
+      if self._hand >= len(clock):
+        self._hand = 0
+      entry = self._pages[clock[self._hand]]
+      if entry[0]:
+        # Give the page a second chance:
+        entry[0] = False
+        self._hand += 1
+      else:
+        break
+
+    page_number = clock.pop(self._hand)
+    if entry[1]:
+      self._write_page(page_number, entry)
+    del self._pages[page_number]
+    self._cache_size -= self._page_cost + len(entry[3]) * self._record_cost
+
   def flush(self):
+    """Write all modified pages to disk.  They remain in the cache."""
+
     logger.debug('Flushing cache for %s' % (self,))
 
-    pairs = [(i, s) for (i, (dirty, s)) in self._cache.items() if dirty]
-
-    if pairs:
-      pairs.sort()
-      old_i = None
-      f = self.f
-      for (i, s) in pairs:
-        if i == old_i:
-          # No seeking needed
-          pass
-        elif i <= self._limit_written:
-          # Just jump there:
-          f.seek(i * self._record_len)
-        else:
-          # Jump to the end of the file then write _empty_values until
-          # we reach the correct location:
-          f.seek(self._limit_written * self._record_len)
-          while self._limit_written < i:
-            f.write(self.packer.empty_value)
-            self._limit_written += 1
-        f.write(s)
-        old_i = i + 1
-        self._limit_written = max(self._limit_written, old_i)
+    dirty_page_numbers = [
+        page_number
+        for (page_number, entry) in self._pages.iteritems()
+        if entry[1]
+        ]
+    if dirty_page_numbers:
+      dirty_page_numbers.sort()
+      for page_number in dirty_page_numbers:
+        self._write_page(page_number, self._pages[page_number])
 
       self.f.flush()
 
-    self._cache.clear()
-
   def _set_packed_record(self, i, s):
     if self.mode == DB_OPEN_READ:
       raise RecordTableAccessError()
     if i < 0:
       raise KeyError()
-    self._cache[i] = (True, s)
-    if len(self._cache) >= self._max_memory_cache:
-      self.flush()
+    (page_number, j) = divmod(i, self._records_per_page)
     self._limit = max(self._limit, i + 1)
+    try:
+      entry = self._pages[page_number]
+    except KeyError:
+      entry = self._read_page(page_number)
+    else:
+      self._hits += 1
+      entry[0] = True
+
+    entry[1] = True
+    modified = entry[3]
+    if j not in modified:
+      self._cache_size += self._record_cost
+    modified[j] = s
+    if len(modified) >= self._max_modified:
+      self._merge_modified(entry)
+
+    # Make room if necessary.  (If this page is itself evicted, the new
+    # record is written to disk.)
+    while self._cache_size > self.cache_memory and self._pages:
+      self._evict_page()
 
   def _get_packed_record(self, i):
+    if not 0 <= i < self._limit:
+      raise KeyError(i)
+    (page_number, j) = divmod(i, self._records_per_page)
     try:
-      return self._cache[i][1]
+      entry = self._pages[page_number]
     except KeyError:
-      if not 0 <= i < self._limit_written:
-        raise KeyError(i)
-      self.f.seek(i * self._record_len)
-      s = self.f.read(self._record_len)
-      self._cache[i] = (False, s)
-      if len(self._cache) >= self._max_memory_cache:
-        self.flush()
+      entry = self._read_page(page_number)
+    else:
+      self._hits += 1
+      entry[0] = True
 
-      return s
+    if entry[3]:
+      try:
+        return entry[3][j]
+      except KeyError:
+        pass
+    return entry[2][j * self._record_len:(j + 1) * self._record_len]
 
   def close(self):
     self.flush()
-    self._cache = None
+    logger.debug(
+        'Page cache for %s: %d hits, %d misses, %d pages written'
+        % (self, self._hits, self._misses, self._pages_written,)
+        )
+    self._pages = None
+    self._clock = None
     self.f.close()
     self.f = None
 
 
 class MmapRecordTable(AbstractRecordTable):
+  """A RecordTable that accesses its file via a memory map.
+
+  The file is enlarged geometrically (by GROWTH_FACTOR, in multiples
+  of GROWTH_INCREMENT bytes) as records are added, and truncated to
+  the records that were actually written when the table is closed.  A
+  table opened with DB_OPEN_READ is mapped read-only."""
+
   GROWTH_INCREMENT = 65536
+  GROWTH_FACTOR = 2
 
   def __init__(self, filename, mode, packer):
     AbstractRecordTable.__init__(self, filename, mode, packer)
     if self.mode == DB_OPEN_NEW:
       self.python_file = open(self.filename, 'wb+')
-      self.python_file.write('\0' * self.GROWTH_INCREMENT)
-      self.python_file.flush()
-      self._filesize = self.GROWTH_INCREMENT
-      self.f = mmap.mmap(
-          self.python_file.fileno(), self._filesize,
-          access=mmap.ACCESS_WRITE
-          )
-
-      # The index just beyond the last record ever written:
-      self._limit = 0
+      access = mmap.ACCESS_WRITE
     elif self.mode == DB_OPEN_WRITE:
       self.python_file = open(self.filename, 'rb+')
-      self._filesize = os.path.getsize(self.filename)
-      self.f = mmap.mmap(
-          self.python_file.fileno(), self._filesize,
-          access=mmap.ACCESS_WRITE
-          )
-
-      # The index just beyond the last record ever written:
-      self._limit = os.path.getsize(self.filename) // self._record_len
+      access = mmap.ACCESS_WRITE
     elif self.mode == DB_OPEN_READ:
       self.python_file = open(self.filename, 'rb')
-      self._filesize = os.path.getsize(self.filename)
-      self.f = mmap.mmap(
-          self.python_file.fileno(), self._filesize,
-          access=mmap.ACCESS_READ
-          )
-
-      # The index just beyond the last record ever written:
-      self._limit = os.path.getsize(self.filename) // self._record_len
+      access = mmap.ACCESS_READ
     else:
       raise RuntimeError('Invalid mode %r' % self.mode)
 
+    # The index just beyond the last record ever written:
+    self._limit = os.path.getsize(self.filename) // self._record_len
+
+    self._filesize = os.path.getsize(self.filename)
+    if access == mmap.ACCESS_WRITE and self._filesize == 0:
+      # An empty file cannot be mapped:
+      self._filesize = self.GROWTH_INCREMENT
+      self.python_file.truncate(self._filesize)
+
+    if self._filesize == 0:
+      # An empty file cannot be mapped, but there is nothing to read
+      # anyway:
+      self.f = None
+    else:
+      self.f = mmap.mmap(
+          self.python_file.fileno(), self._filesize, access=access
+          )
+
   def flush(self):
-    self.f.flush()
+    if self.f is not None and self.mode != DB_OPEN_READ:
+      self.f.flush()
 
   def _set_packed_record(self, i, s):
     if self.mode == DB_OPEN_READ:
@@ -373,7 +516,8 @@ class MmapRecordTable(AbstractRecordTable):
       new_size = (i + 1) * self._record_len
       if new_size > self._filesize:
         self._filesize = (
-            (new_size + self.GROWTH_INCREMENT - 1)
+            (max(new_size, self._filesize * self.GROWTH_FACTOR)
+             + self.GROWTH_INCREMENT - 1)
             // self.GROWTH_INCREMENT
             * self.GROWTH_INCREMENT
             )
@@ -392,8 +536,50 @@ class MmapRecordTable(AbstractRecordTable):
     return self.f[i * self._record_len:(i + 1) * self._record_len]
 
   def close(self):
-    self.flush()
-    self.f.close()
+    if self.f is not None:
+      self.flush()
+      self.f.close()
+      self.f = None
+    if self.mode != DB_OPEN_READ:
+      # Remove the space that was reserved for growth, so that the
+      # size of the file determines the number of records when it is
+      # reopened:
+      self.python_file.truncate(self._limit * self._record_len)
     self.python_file.close()
+    self.python_file = None
+
+
+def _mmap_is_safe():
+  """Return True iff mmap should be used for RecordTables by default.
+
+  Memory-mapping the tables of a large conversion can exhaust the
+  virtual address space of a 32-bit process, so mmap is only chosen
+  automatically for 64-bit processes on Linux."""
+
+  return sys.platform.startswith('linux') and sys.maxsize > 2**32
+
+
+def open_record_table(filename, mode, packer):
+  """Open a RecordTable using the backend chosen by the run options.
+
+  Ctx().record_table_backend is 'file' (RecordTable), 'mmap'
+  (MmapRecordTable), or 'auto' (MmapRecordTable on 64-bit Linux and
+  RecordTable otherwise)."""
+
+  from cvs2svn_lib.context import Ctx
+
+  backend = Ctx().record_table_backend
+  if backend == 'auto':
+    if _mmap_is_safe():
+      backend = 'mmap'
+    else:
+      backend = 'file'
+
+  if backend == 'mmap':
+    return MmapRecordTable(filename, mode, packer)
+  elif backend == 'file':
+    return RecordTable(filename, mode, packer)
+  else:
+    raise RuntimeError('Invalid record table backend %r' % (backend,))
 
 
@@ -18,7 +18,10 @@
 
 
 import os
+import sys
 import stat
+import threading
+import Queue
 
 from cvs2svn_lib.common import path_join
 from cvs2svn_lib.common import FatalError
@@ -31,21 +34,171 @@ from cvs2svn_lib.cvs_path import CVSDirectory
 from cvs2svn_lib.cvs_path import CVSFile
 
 
+try:
+  # The scandir module (a backport of Python 3's os.scandir()) uses
+  # the d_type field returned by readdir() to tell directories from
+  # files without calling stat():
+  from scandir import scandir
+except ImportError:
+  scandir = None
+
+
+class _DirectoryListing(object):
+  """The contents of one directory of the CVS repository.
+
+  Members:
+
+    entries -- a sorted list of tuples (fname, is_dir, file_stat) for
+        each entry in the directory.  IS_DIR is True iff the entry is
+        a directory (following symlinks, like os.path.isdir()).
+        FILE_STAT is the result of os.stat() for files whose names end
+        in ',v', or None if it has not been determined.
+
+    fnames -- a set containing the names of all of the entries.
+
+  Only a single stat() call is made per ',v' file and none for other
+  entries if their type can be determined from the directory itself."""
+
+  def __init__(self, path):
+    self.entries = []
+
+    if scandir is not None:
+      for entry in scandir(path):
+        fname = entry.name
+        try:
+          is_dir = entry.is_dir()
+        except OSError:
+          is_dir = False
+        file_stat = None
+        if not is_dir and fname.endswith(',v'):
+          try:
+            file_stat = entry.stat()
+          except OSError:
+            pass
+        self.entries.append((fname, is_dir, file_stat,))
+    else:
+      for fname in os.listdir(path):
+        try:
+          file_stat = os.stat(os.path.join(path, fname))
+        except OSError:
+          is_dir = False
+          file_stat = None
+        else:
+          is_dir = stat.S_ISDIR(file_stat.st_mode)
+          if is_dir or not fname.endswith(',v'):
+            file_stat = None
+        self.entries.append((fname, is_dir, file_stat,))
+
+    self.entries.sort()
+    self.fnames = set([entry[0] for entry in self.entries])
+
+
+class _PendingListing(object):
+  """A _DirectoryListing that is being read by a background thread."""
+
+  def __init__(self, path):
+    self.path = path
+    self._done = threading.Event()
+    self._listing = None
+    self._exc_info = None
+
+  def run(self):
+    try:
+      self._listing = _DirectoryListing(self.path)
+    except:
+      self._exc_info = sys.exc_info()
+    self._done.set()
+
+  def get(self):
+    """Wait for the listing to be read, then return it.
+
+    If reading the directory raised an exception, re-raise it here."""
+
+    self._done.wait()
+    if self._exc_info is not None:
+      (exc_type, exc_value, exc_traceback) = self._exc_info
+      self._exc_info = None
+      raise exc_type, exc_value, exc_traceback
+    return self._listing
+
+
+class _DirectoryLister(object):
+  """Read _DirectoryListings, optionally using a pool of threads.
+
+  If THREADS is greater than one, prefetch() hands directories to a
+  pool of that many threads, so that their listings (which might be
+  slow to read, for example over NFS) can be read while earlier parts
+  of the repository are being processed.  Otherwise, prefetch() does
+  nothing and the directories are read when get() is called."""
+
+  def __init__(self, threads=1):
+    # A map {path : _PendingListing} for the directories that have
+    # been prefetched but not yet retrieved:
+    self._pending = {}
+
+    self._threads = []
+    if threads > 1:
+      self._queue = Queue.Queue()
+      for i in range(threads):
+        thread = threading.Thread(target=self._work)
+        thread.setDaemon(True)
+        thread.start()
+        self._threads.append(thread)
+
+  def _work(self):
+    while True:
+      pending = self._queue.get()
+      if pending is None:
+        return
+      pending.run()
+
+  def prefetch(self, path):
+    """Start reading the directory at PATH in the background."""
+
+    if self._threads and path not in self._pending:
+      pending = _PendingListing(path)
+      self._pending[path] = pending
+      self._queue.put(pending)
+
+  def get(self, path):
+    """Return the _DirectoryListing for the directory at PATH."""
+
+    pending = self._pending.pop(path, None)
+    if pending is None:
+      return _DirectoryListing(path)
+    else:
+      return pending.get()
+
+  def close(self):
+    """Stop the threads.
+
+    Listings that are still queued are read before the threads exit."""
+
+    for thread in self._threads:
+      self._queue.put(None)
+    for thread in self._threads:
+      thread.join()
+    self._threads = []
+    self._pending = {}
+
+
 class _RepositoryWalker(object):
-  def __init__(self, file_key_generator, error_handler):
+  def __init__(self, file_key_generator, error_handler, lister):
     self.file_key_generator = file_key_generator
     self.error_handler = error_handler
+    self.lister = lister
 
   def _get_cvs_file(
-        self, parent_directory, basename,
-        file_in_attic=False, leave_in_attic=False,
+        self, parent_directory, basename, file_stat=None,
+        file_in_attic=False, leave_in_attic=False, logical_fnames=None,
         ):
     """Return a CVSFile describing the file with name BASENAME.
 
     PARENT_DIRECTORY is the CVSDirectory instance describing the
     directory that physically holds this file in the filesystem.
     BASENAME must be the base name of a *,v file within
-    PARENT_DIRECTORY.
+    PARENT_DIRECTORY.  FILE_STAT, if known, is the result of
+    os.stat() for the file.
 
     FILE_IN_ATTIC is a boolean telling whether the specified file is
     in an Attic subdirectory.  If FILE_IN_ATTIC is True, then:
@@ -54,7 +207,8 @@ class _RepositoryWalker(object):
       the filename.
 
     - Otherwise, raise FileInAndOutOfAtticException if a file with the
-      same filename appears outside of Attic.
+      same filename appears outside of Attic.  LOGICAL_FNAMES is the
+      set of names in the directory containing the Attic.
 
     The CVSFile is assigned a new unique id.  All of the CVSFile
     information is filled in except mode (which can only be determined
@@ -81,13 +235,14 @@ class _RepositoryWalker(object):
       non_attic_filename = os.path.join(
           logical_parent_directory.rcs_path, basename,
           )
-      if os.path.exists(non_attic_filename):
+      if basename in logical_fnames:
         raise FileInAndOutOfAtticException(non_attic_filename, filename)
     else:
       in_attic = False
       logical_parent_directory = parent_directory
 
-    file_stat = os.stat(filename)
+    if file_stat is None:
+      file_stat = os.stat(filename)
 
     # The size of the file in bytes:
     file_size = file_stat.st_size
@@ -102,13 +257,16 @@ class _RepositoryWalker(object):
         in_attic, file_executable, file_size, None, None
         )
 
-  def _get_attic_file(self, parent_directory, basename):
+  def _get_attic_file(
+        self, parent_directory, basename, file_stat, logical_fnames
+        ):
     """Return a CVSFile object for the Attic file at BASENAME.
 
     PARENT_DIRECTORY is the CVSDirectory that physically contains the
     file on the filesystem (i.e., the Attic directory).  It is not
     necessarily the parent_directory of the CVSFile that will be
-    returned.
+    returned.  FILE_STAT and LOGICAL_FNAMES are as for
+    _get_cvs_file().
 
     Return CVSFile, whose parent directory is usually
     PARENT_DIRECTORY.parent_directory, but might be PARENT_DIRECTORY
@@ -116,7 +274,8 @@ class _RepositoryWalker(object):
 
     try:
       return self._get_cvs_file(
-          parent_directory, basename, file_in_attic=True,
+          parent_directory, basename, file_stat,
+          file_in_attic=True, logical_fnames=logical_fnames,
           )
     except FileInAndOutOfAtticException, e:
       if Ctx().retain_conflicting_attic_files:
@@ -131,14 +290,18 @@ class _RepositoryWalker(object):
       # Either way, return a CVSFile object so that the rest of the
       # file processing can proceed:
       return self._get_cvs_file(
-          parent_directory, basename, file_in_attic=True, leave_in_attic=True,
+          parent_directory, basename, file_stat,
+          file_in_attic=True, leave_in_attic=True,
           )
 
-  def _generate_attic_cvs_files(self, cvs_directory, exclude_paths):
+  def _generate_attic_cvs_files(
+        self, cvs_directory, exclude_paths, logical_fnames
+        ):
     """Generate CVSFiles for the files in Attic directory CVS_DIRECTORY.
 
     Also yield CVS_DIRECTORY if any files are being retained in the
-    Attic.
+    Attic.  LOGICAL_FNAMES is the set of names in the directory
+    containing the Attic.
 
     Silently ignore subdirectories named '.svn' or 'CVS', but emit a
     warning if any other directories are found within the Attic
@@ -146,16 +309,15 @@ class _RepositoryWalker(object):
 
     retained_attic_files = []
 
-    fnames = os.listdir(cvs_directory.rcs_path)
-    fnames.sort()
-    for fname in fnames:
+    listing = self.lister.get(cvs_directory.rcs_path)
+    for (fname, is_dir, file_stat) in listing.entries:
       pathname = os.path.join(cvs_directory.rcs_path, fname)
       path_in_repository = path_join(cvs_directory.get_cvs_path(), fname)
       if path_in_repository in exclude_paths:
         logger.normal(
             "Excluding file from conversion: %s" % (path_in_repository,)
             )
-      elif os.path.isdir(pathname):
+      elif is_dir:
         if fname == '.svn' or fname == 'CVS':
           logger.debug(
               "Directory %s found within Attic; ignoring" % (pathname,)
@@ -165,7 +327,9 @@ class _RepositoryWalker(object):
               "Directory %s found within Attic; ignoring" % (pathname,)
               )
       elif fname.endswith(',v'):
-        cvs_file = self._get_attic_file(cvs_directory, fname)
+        cvs_file = self._get_attic_file(
+            cvs_directory, fname, file_stat, logical_fnames
+            )
         if cvs_file.parent_directory == cvs_directory:
           # This file will be retained in the Attic directory.
           retained_attic_files.append(cvs_file)
@@ -207,9 +371,17 @@ class _RepositoryWalker(object):
     # Non-Attic subdirectories of cvs_directory (to be recursed into):
     dirs = []
 
-    fnames = os.listdir(cvs_directory.rcs_path)
-    fnames.sort()
-    for fname in fnames:
+    listing = self.lister.get(cvs_directory.rcs_path)
+
+    # Start reading the subdirectories that will be needed (this is a
+    # no-op unless the lister is using threads):
+    for (fname, is_dir, file_stat) in listing.entries:
+      if is_dir and fname != '.svn' and fname != 'CVS' \
+             and path_join(cvs_directory.get_cvs_path(), fname) \
+                 not in exclude_paths:
+        self.lister.prefetch(os.path.join(cvs_directory.rcs_path, fname))
+
+    for (fname, is_dir, file_stat) in listing.entries:
       pathname = os.path.join(cvs_directory.rcs_path, fname)
       path_in_repository = path_join(cvs_directory.get_cvs_path(), fname)
       if path_in_repository in exclude_paths:
@@ -217,7 +389,7 @@ class _RepositoryWalker(object):
             "Excluding file from conversion: %s" % (path_in_repository,)
             )
         pass
-      elif os.path.isdir(pathname):
+      elif is_dir:
         if fname == 'Attic':
           attic_dir = fname
         elif fname == '.svn' or fname == 'CVS':
@@ -225,7 +397,7 @@ class _RepositoryWalker(object):
         else:
           dirs.append(fname)
       elif fname.endswith(',v'):
-        cvs_file = self._get_cvs_file(cvs_directory, fname)
+        cvs_file = self._get_cvs_file(cvs_directory, fname, file_stat)
         rcsfiles[cvs_file.rcs_basename] = cvs_file.rcs_path
         yield cvs_file
       else:
@@ -242,7 +414,9 @@ class _RepositoryWalker(object):
           cvs_directory.project, cvs_directory, 'Attic',
           )
 
-      for cvs_path in self._generate_attic_cvs_files(attic_directory, exclude_paths):
+      for cvs_path in self._generate_attic_cvs_files(
+            attic_directory, exclude_paths, listing.fnames
+            ):
         if isinstance(cvs_path, CVSFile) \
                and cvs_path.parent_directory == cvs_directory:
           attic_rcsfiles[cvs_path.rcs_basename] = cvs_path.rcs_path
@@ -294,7 +468,7 @@ class _RepositoryWalker(object):
         yield cvs_path
 
 
-def walk_repository(project, file_key_generator, error_handler):
+def walk_repository(project, file_key_generator, error_handler, threads=1):
   """Generate CVSDirectories and CVSFiles within PROJECT.
 
   Use FILE_KEY_GENERATOR to generate the IDs used for files.  If there
@@ -318,16 +492,23 @@ def walk_repository(project, file_key_generator, error_handler):
   * Check for filenames that contain characters not allowed by
     Subversion.
 
+  If THREADS is greater than one, read the directories using that many
+  threads.  The output does not depend on the number of threads.
+
   """
 
   root_cvs_directory = CVSDirectory(
       file_key_generator.gen_id(), project, None, ''
       )
   project.root_cvs_directory_id = root_cvs_directory.id
-  repository_walker = _RepositoryWalker(file_key_generator, error_handler)
+  lister = _DirectoryLister(threads)
+  repository_walker = _RepositoryWalker(
+      file_key_generator, error_handler, lister
+      )
   for cvs_path in repository_walker.generate_cvs_paths(
         root_cvs_directory, project.exclude_paths
         ):
     yield cvs_path
+  lister.close()
 
 
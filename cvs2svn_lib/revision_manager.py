@@ -140,4 +140,11 @@ class RevisionReader(object):
 
     pass
 
+  def record_statistics(self, stats_keeper):
+    """Record statistics about the work done since start() in STATS_KEEPER.
+
+    This method is called after finish()."""
+
+    pass
+
 
@@ -714,6 +714,108 @@ class RunOptions(object):
             ) % (tempfile.gettempdir(),),
         metavar='PATH',
         ))
+    group.add_option(ContextOption(
+        '--jobs', type='int',
+        action='store',
+        help=(
+            'number of processes to use for parsing the RCS files and '
+            'sorting intermediate files (default 1)'
+            ),
+        man_help=(
+            'Use \\fIn\\fR worker processes to parse the RCS files in '
+            'CollectRevsPass and to sort the intermediate data files.  '
+            'The conversion results are identical regardless of the '
+            'number of processes.  Default: 1.'
+            ),
+        metavar='N',
+        ))
+    group.add_option(ContextOption(
+        '--parse-cache', type='string',
+        action='store', dest='parse_cache_dir',
+        help=(
+            'directory in which to cache the results of parsing the RCS '
+            'files between conversions'
+            ),
+        man_help=(
+            'Keep the results of parsing the RCS files in directory '
+            '\\fIpath\\fR, and reuse them in later conversions for files '
+            'whose size, modification time, and contents have not changed.  '
+            'The cache can be shared between conversions that use '
+            'different options.  It is created if it does not exist.'
+            ),
+        metavar='PATH',
+        ))
+    group.add_option(ContextOption(
+        '--walker-threads', type='int',
+        action='store',
+        help=(
+            'number of threads to use for reading the directories of the '
+            'CVS repository (default 1)'
+            ),
+        man_help=(
+            'Use \\fIn\\fR threads to read the directories of the CVS '
+            'repository in CollectRevsPass.  This can speed up the '
+            'conversion of repositories on slow (e.g., network) '
+            'filesystems.  The conversion results are identical '
+            'regardless of the number of threads.  Default: 1.'
+            ),
+        metavar='N',
+        ))
+    group.add_option(ContextOption(
+        '--sort-memory', type='int',
+        action='store',
+        help=(
+            'approximate amount of memory, in MiB, to use for each run '
+            'when sorting intermediate files (default 64)'
+            ),
+        man_help=(
+            'Use about \\fIn\\fR MiB of memory for each run when sorting '
+            'the intermediate data files.  Larger values mean fewer '
+            'temporary files and merge passes.  The conversion results '
+            'do not depend on this value.  Default: 64.'
+            ),
+        metavar='N',
+        ))
+    group.add_option(ContextOption(
+        '--sort-compression', type='choice',
+        choices=['none', 'zlib', 'auto'],
+        action='store',
+        help=(
+            'whether to compress the temporary files used for sorting.  '
+            'MODE is "none", "zlib", or "auto" (default; compress only if '
+            'the files might not fit on the disk otherwise)'
+            ),
+        man_help=(
+            'Specify whether to compress the temporary files that are '
+            'written while sorting the intermediate data files.  '
+            '\\fImode\\fR must be \'none\', \'zlib\' (use fast zlib '
+            'compression, which reduces disk space and I/O at the cost of '
+            'some CPU time), or \'auto\' (use zlib compression only if '
+            'the uncompressed files might not fit into the free space in '
+            'the temporary directory).  The default is \'auto\'.'
+            ),
+        metavar='MODE',
+        ))
+    group.add_option(ContextOption(
+        '--record-table-backend', type='choice',
+        choices=['file', 'mmap', 'auto'],
+        action='store',
+        help=(
+            'how to access the fixed-length index tables.  BACKEND is '
+            '"file", "mmap", or "auto" (default; use mmap on 64-bit Linux)'
+            ),
+        man_help=(
+            'Specify how to access the index tables that map CVS items '
+            'and other objects to fixed-length records.  \\fIbackend\\fR '
+            'must be \'file\' (read and write the files via a cache of '
+            'pages), \'mmap\' (map the files into memory, which is faster '
+            'but needs a lot of virtual address space for large '
+            'conversions), or \'auto\' (use \'mmap\' for 64-bit processes '
+            'on Linux and \'file\' otherwise).  The default is \'auto\'.  '
+            'The conversion results do not depend on this value.'
+            ),
+        metavar='BACKEND',
+        ))
     self.parser.set_default('co_executable', config.CO_EXECUTABLE)
     group.add_option(IncompatibleOption(
         '--co', type='string',
@@ -1100,6 +1202,15 @@ class RunOptions(object):
     if not self.projects:
       raise FatalError('No project specified.')
 
+    if ctx.jobs < 1:
+      raise FatalError('The number of jobs must be at least 1.')
+
+    if ctx.walker_threads < 1:
+      raise FatalError('The number of walker threads must be at least 1.')
+
+    if ctx.sort_memory < 1:
+      raise FatalError('The sort memory must be at least 1 MiB.')
+
   def verify_option_compatibility(self):
     """Verify that no options incompatible with --options were used.
 
@@ -76,8 +76,19 @@ class PrimedPickleSerializer(Serializer):
   instead of the whole object.  (Note that the memos needed for
   pickling and unpickling are different.)
 
-  A new pickler/unpickler is created for each use, each time with the
-  memo initialized appropriately for pickling or unpickling."""
+  A single pickler, writing to a reusable buffer, is used for all
+  objects.  It runs in 'fast' mode, meaning that it never adds entries
+  to its memo, so the memo remains in the primed state from one object
+  to the next and neither the pickler nor its memo has to be recreated
+  for each object.  Since the resulting pickles contain no PUT
+  opcodes, unpickling them doesn't modify the memo either, so the
+  unpicklers can share the primed memo without copying it.  The price
+  is that an object referred to more than once within a single pickled
+  object is stored (and restored) as independent copies.
+
+  Objects that contain reference cycles cannot be pickled in fast
+  mode; they are pickled with a new, conventional pickler and a copy
+  of the primed memo instead."""
 
   def __init__(self, primer):
     """Prepare to make picklers/unpicklers with the specified primer.
@@ -86,61 +97,228 @@ class PrimedPickleSerializer(Serializer):
     which can be an arbitrary object (e.g., a list of objects that are
     expected to occur frequently in the objects to be serialized)."""
 
+    self.primer = primer
+    self._prime()
+
+  def _prime(self):
     f = cStringIO.StringIO()
     pickler = cPickle.Pickler(f, -1)
-    pickler.dump(primer)
+    pickler.dump(self.primer)
     self.pickler_memo = pickler.memo
 
     unpickler = cPickle.Unpickler(cStringIO.StringIO(f.getvalue()))
     unpickler.load()
     self.unpickler_memo = unpickler.memo
+    self._unpickler_memo_keys = set(self.unpickler_memo.keys())
 
-  def dumpf(self, f, object):
-    """Serialize OBJECT to file-like object F."""
+    self._buffer = cStringIO.StringIO()
+    self._reset_pickler()
+
+  def _reset_pickler(self):
+    self._pickler = cPickle.Pickler(self._buffer, -1)
+    self._pickler.fast = 1
+    self._pickler.memo = self.pickler_memo
 
+  def __getstate__(self):
+    # The memos and the pickler are keyed by object ids, which are
+    # only meaningful within this process; regenerate them from the
+    # primer when unpickling.
+    return self.primer
+
+  def __setstate__(self, state):
+    self.primer = state
+    self._prime()
+
+  def _dump_cyclic(self, object):
+    f = cStringIO.StringIO()
     pickler = cPickle.Pickler(f, -1)
     pickler.memo = self.pickler_memo.copy()
     pickler.dump(object)
+    return f.getvalue()
+
+  def dumpf(self, f, object):
+    """Serialize OBJECT to file-like object F."""
+
+    f.write(self.dumps(object))
 
   def dumps(self, object):
     """Return a string containing OBJECT in serialized form."""
 
-    f = cStringIO.StringIO()
-    self.dumpf(f, object)
-    return f.getvalue()
+    try:
+      try:
+        self._pickler.dump(object)
+        return self._buffer.getvalue()
+      except ValueError:
+        # Fast mode refuses to pickle self-referential objects.  The
+        # failed attempt leaves the pickler in an undefined state, so
+        # replace it.
+        self._reset_pickler()
+        return self._dump_cyclic(object)
+    finally:
+      self._buffer.reset()
+      self._buffer.truncate()
+
+  def _clean_unpickler_memo(self):
+    """Remove entries added to the shared unpickler memo.
+
+    Only the pickles of self-referential objects contain PUT opcodes,
+    so this is rarely needed."""
+
+    for key in self.unpickler_memo.keys():
+      if key not in self._unpickler_memo_keys:
+        del self.unpickler_memo[key]
 
   def loadf(self, f):
     """Return the next object deserialized from file-like object F."""
 
     unpickler = cPickle.Unpickler(f)
-    unpickler.memo = self.unpickler_memo.copy()
-    return unpickler.load()
+    unpickler.memo = self.unpickler_memo
+    object = unpickler.load()
+    if len(self.unpickler_memo) != len(self._unpickler_memo_keys):
+      self._clean_unpickler_memo()
+    return object
 
   def loads(self, s):
     """Return the object deserialized from string S."""
 
-    return self.loadf(cStringIO.StringIO(s))
+    unpickler = cPickle.Unpickler(cStringIO.StringIO(s))
+    unpickler.memo = self.unpickler_memo
+    object = unpickler.load()
+    if len(self.unpickler_memo) != len(self._unpickler_memo_keys):
+      self._clean_unpickler_memo()
+    return object
 
 
 class CompressingSerializer(Serializer):
-  """This class wraps other Serializers to compress their serialized data."""
-
-  def __init__(self, wrapee):
+  """This class wraps other Serializers to compress their serialized data.
+
+  Small records compress poorly on their own, so the compressor can be
+  primed with a preset dictionary that is built from a sample of
+  records and stored with the serializer.  The zlib module of Python 2
+  has no interface to zlib's preset dictionaries, so they are
+  emulated: a compressor and a decompressor are each fed the
+  dictionary once, and every record is compressed or decompressed by
+  a copy of them.  Records compressed with a dictionary are raw
+  deflate streams that can only be read by a serializer that uses the
+  same dictionary.
+
+  Copying the compressor costs more than compressing a small record,
+  and small records hardly shrink anyway.  So records shorter than
+  MIN_COMPRESSED_SIZE are stored uncompressed, and the first byte of
+  each record tells whether it is compressed."""
+
+  # Deflate can refer back at most 32 KiB, so a larger dictionary
+  # would be useless:
+  MAX_DICTIONARY_SIZE = 32 * 1024
+
+  # The zlib memLevel of the primed compressor.  The lower it is, the
+  # smaller the compressor's state that is copied for each record.  At
+  # 4, copying takes about half the time that it takes at the default
+  # of 8, and compression is almost as good:
+  MEM_LEVEL = 4
+
+  MIN_COMPRESSED_SIZE = 64
+
+  # The first byte of each record:
+  _STORED = '\0'
+  _COMPRESSED = '\1'
+
+  def __init__(self, wrapee, level=9, samples=None):
     """Constructor.  WRAPEE is the Serializer whose bitstream ought to be
-    compressed."""
+    compressed.  LEVEL is the zlib compression level.  If SAMPLES is
+    specified, it is a sequence of objects typical of those that will
+    be serialized, from which a preset dictionary is built."""
 
     self.wrapee = wrapee
+    self.level = level
+    if samples is None:
+      self.dictionary = None
+    else:
+      self.dictionary = self._build_dictionary(
+          [self.wrapee.dumps(sample) for sample in samples]
+          )
+    self._prime()
+
+  def _build_dictionary(self, strings):
+    """Return a dictionary for compressing strings like STRINGS, or None.
+
+    The dictionary consists of the lines that occur in more than one
+    of STRINGS, preferring those that account for the most bytes.
+    The most valuable lines are placed at the end of the dictionary,
+    where references to them are cheapest."""
+
+    counts = {}
+    for s in strings:
+      for line in set(s.splitlines(True)):
+        counts[line] = counts.get(line, 0) + 1
+
+    lines = [
+        (count * len(line), line)
+        for (line, count) in counts.iteritems()
+        if count > 1
+        ]
+    lines.sort()
+    lines.reverse()
+
+    dictionary = []
+    size = 0
+    for (score, line) in lines:
+      if size + len(line) <= self.MAX_DICTIONARY_SIZE:
+        dictionary.append(line)
+        size += len(line)
+
+    if not dictionary:
+      return None
+    dictionary.reverse()
+    return ''.join(dictionary)
+
+  def _prime(self):
+    if self.dictionary is None:
+      self._compressor = None
+      self._decompressor = None
+    else:
+      self._compressor = zlib.compressobj(
+          self.level, zlib.DEFLATED, -15, self.MEM_LEVEL
+          )
+      prefix = self._compressor.compress(self.dictionary)
+      prefix += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+      self._decompressor = zlib.decompressobj(-15)
+      self._decompressor.decompress(prefix)
+
+  def __getstate__(self):
+    return (self.wrapee, self.level, self.dictionary,)
+
+  def __setstate__(self, state):
+    (self.wrapee, self.level, self.dictionary,) = state
+    self._prime()
+
+  def _compress(self, s):
+    if len(s) < self.MIN_COMPRESSED_SIZE:
+      return self._STORED + s
+    elif self._compressor is None:
+      return self._COMPRESSED + zlib.compress(s, self.level)
+    else:
+      compressor = self._compressor.copy()
+      return self._COMPRESSED + compressor.compress(s) + compressor.flush()
+
+  def _decompress(self, s):
+    if s[0] == self._STORED:
+      return s[1:]
+    elif self._decompressor is None:
+      return zlib.decompress(s[1:])
+    else:
+      return self._decompressor.copy().decompress(s[1:])
 
   def dumpf(self, f, object):
-    marshal.dump(zlib.compress(self.wrapee.dumps(object), 9), f)
+    marshal.dump(self._compress(self.wrapee.dumps(object)), f)
 
   def dumps(self, object):
-    return marshal.dumps(zlib.compress(self.wrapee.dumps(object), 9))
+    return marshal.dumps(self._compress(self.wrapee.dumps(object)))
 
   def loadf(self, f):
-    return self.wrapee.loads(zlib.decompress(marshal.load(f)))
+    return self.wrapee.loads(self._decompress(marshal.load(f)))
 
   def loads(self, s):
-    return self.wrapee.loads(zlib.decompress(marshal.loads(s)))
+    return self.wrapee.loads(self._decompress(marshal.loads(s)))
 
 
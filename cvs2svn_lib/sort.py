@@ -33,11 +33,37 @@ import shutil
 import heapq
 import itertools
 import tempfile
+import struct
+import zlib
+from cStringIO import StringIO
+
+from cvs2svn_lib.common import FatalError
+from cvs2svn_lib.common import InternalError
+from cvs2svn_lib.log import logger
 
 
 # The buffer size to use for open files:
 BUFSIZE = 64 * 1024
 
+# The approximate number of bytes of memory, beyond the characters
+# themselves, that each line occupies while it is held in a run (the
+# string object header plus its slot in the list and in the list of
+# sort keys):
+LINE_OVERHEAD = 64
+
+# The number of bytes at the start of the input that are examined to
+# estimate the average line length when the input is divided among
+# worker processes:
+SAMPLE_SIZE = 64 * 1024
+
+# The zlib compression level to use for compressed temporary files.
+# The lowest level is by far the fastest, and it already shrinks the
+# files that cvs2svn sorts several-fold:
+COMPRESSION_LEVEL = 1
+
+# The number of bytes of a compressed file to decompress at a time:
+COMPRESSED_READ_SIZE = 16 * 1024
+
 
 def get_default_max_merge():
   """Return the default maximum number of files to merge at once."""
@@ -95,24 +121,367 @@ def merge(iterables, key=None):
       heapq.heappush(values, (key(value), index, value, iterator))
 
 
-def merge_files_onepass(input_filenames, output_filename, key=None):
+class _CompressedFileWriter:
+  """A write-only file whose contents are compressed using zlib."""
+
+  def __init__(self, filename):
+    self._file = open(filename, 'wb', BUFSIZE)
+    self._compressor = zlib.compressobj(COMPRESSION_LEVEL)
+
+  def write(self, s):
+    self._file.write(self._compressor.compress(s))
+
+  def writelines(self, lines):
+    # Pass the lines to the compressor in batches, to reduce the
+    # overhead per call:
+    compress = self._compressor.compress
+    write = self._file.write
+    batch = []
+    size = 0
+    for line in lines:
+      batch.append(line)
+      size += len(line)
+      if size >= BUFSIZE:
+        write(compress(''.join(batch)))
+        batch = []
+        size = 0
+    if batch:
+      write(compress(''.join(batch)))
+
+  def close(self):
+    try:
+      self._file.write(self._compressor.flush())
+    finally:
+      self._file.close()
+
+
+class _CompressedFileReader:
+  """A read-only file written by _CompressedFileWriter.
+
+  The contents can be read using read() or by iterating over the
+  lines."""
+
+  def __init__(self, filename):
+    self._file = open(filename, 'rb', BUFSIZE)
+    self._decompressor = zlib.decompressobj()
+    # Decompressed data that has not been read yet:
+    self._buffer = ''
+
+  def read(self, size):
+    """Return the next SIZE bytes (or fewer, at the end of the file)."""
+
+    while len(self._buffer) < size and self._decompressor is not None:
+      data = self._file.read(COMPRESSED_READ_SIZE)
+      if data:
+        self._buffer += self._decompressor.decompress(data)
+      else:
+        self._buffer += self._decompressor.flush()
+        self._decompressor = None
+
+    retval = self._buffer[:size]
+    self._buffer = self._buffer[size:]
+    return retval
+
+  def __iter__(self):
+    # The incomplete last line of the text read so far:
+    pending = ''
+    while True:
+      text = self.read(BUFSIZE)
+      if not text:
+        if pending:
+          yield pending
+        break
+      lines = StringIO(pending + text).readlines()
+      if lines[-1].endswith('\n'):
+        pending = ''
+      else:
+        pending = lines.pop()
+      for line in lines:
+        yield line
+
+  def close(self):
+    self._file.close()
+
+
+def _open_file(filename, mode, compressed=False):
+  """Open FILENAME for reading ('rb') or writing ('wb').
+
+  If COMPRESSED is True, the file contents are compressed; the
+  returned object then only supports read() and iteration (when
+  reading) or write() and writelines() (when writing), plus close()."""
+
+  if not compressed:
+    return open(filename, mode, BUFSIZE)
+  elif mode == 'rb':
+    return _CompressedFileReader(filename)
+  else:
+    return _CompressedFileWriter(filename)
+
+
+class KeyedRecordFormat:
+  """A binary file format for records that are sorted by a fixed-width key.
+
+  Each record consists of a key of KEY_SIZE bytes, the length of the
+  payload as a four-byte big-endian integer, and the payload itself.
+  Records are sorted by comparing only their keys, as strings, so keys
+  should be composed of big-endian unsigned integers (e.g., using
+  struct.pack('>...')).  Records with equal keys are left in their
+  original order.  Unlike lines, records do not need any escaping.
+
+  Pass an instance as the RECORD_FORMAT argument of sort_file() to
+  sort a file of such records."""
+
+  def __init__(self, key_size):
+    self.key_size = key_size
+    self.header_size = key_size + 4
+
+  def pack(self, key, payload):
+    """Return the record with the specified KEY and PAYLOAD."""
+
+    return key + struct.pack('>I', len(payload)) + payload
+
+  def get_key(self, record):
+    return record[:self.key_size]
+
+  def get_payload(self, record):
+    return record[self.header_size:]
+
+  def iter_records(self, f):
+    """Generate the records in file-like object F, which must support read().
+
+    Each record is generated whole, including its key and length."""
+
+    header_size = self.header_size
+    key_size = self.key_size
+    unpack = struct.unpack
+    buf = ''
+    buf_len = 0
+    pos = 0
+    while True:
+      if buf_len - pos < header_size:
+        buf = buf[pos:] + f.read(BUFSIZE)
+        buf_len = len(buf)
+        pos = 0
+        if buf_len < header_size:
+          if buf:
+            raise InternalError('Truncated record header in sort file')
+          return
+
+      end = pos + header_size + unpack(
+          '>I', buf[pos + key_size:pos + header_size]
+          )[0]
+      if end > buf_len:
+        buf = buf[pos:]
+        end -= pos
+        pos = 0
+        buf += f.read(max(BUFSIZE, end - len(buf)))
+        buf_len = len(buf)
+        if end > buf_len:
+          raise InternalError('Truncated record in sort file')
+
+      yield buf[pos:end]
+      pos = end
+
+
+class SortedRunWriter:
+  """Write records to a file as a sequence of sorted runs.
+
+  Records are collected in memory until they occupy about MEMORY bytes
+  (see LINE_OVERHEAD).  Then they are sorted by the keys of
+  RECORD_FORMAT and appended to the file as a run.  The runs can be
+  read back in sorted order using iter_merged_runs(), without ever
+  sorting the whole file."""
+
+  def __init__(self, filename, record_format, memory):
+    self.record_format = record_format
+    self.memory = memory
+    # Remove any old file first rather than truncating it, in case
+    # another name (see reduce_runs()) is linked to it:
+    if os.path.exists(filename):
+      os.remove(filename)
+    self._file = open(filename, 'wb', BUFSIZE)
+    self._records = []
+    self._size = 0
+    self._pos = 0
+    # A list of tuples (start, end) of the runs written so far:
+    self._runs = []
+
+  def add(self, record):
+    self._records.append(record)
+    self._size += len(record) + LINE_OVERHEAD
+    if self._size >= self.memory:
+      self._write_run()
+
+  def _write_run(self):
+    if self._records:
+      self._records.sort(key=self.record_format.get_key)
+      start = self._pos
+      for record in self._records:
+        self._pos += len(record)
+      self._file.writelines(self._records)
+      self._runs.append((start, self._pos,))
+      self._records = []
+      self._size = 0
+
+  def close(self):
+    """Write any remaining records and close the file.
+
+    Return a list of (start, end) tuples giving the file offsets of the
+    runs, suitable for passing to iter_merged_runs()."""
+
+    self._write_run()
+    self._file.close()
+    self._file = None
+    logger.verbose('Wrote %d sorted runs.' % (len(self._runs),))
+    return self._runs
+
+
+class _RangeReader:
+  """A read-only view of the bytes [START, END) of a file."""
+
+  def __init__(self, filename, start, end):
+    self._file = open(filename, 'rb', BUFSIZE)
+    self._file.seek(start)
+    self._remaining = end - start
+
+  def read(self, size):
+    data = self._file.read(min(size, self._remaining))
+    self._remaining -= len(data)
+    return data
+
+  def close(self):
+    self._file.close()
+
+
+def iter_merged_runs(filename, runs, record_format):
+  """Generate the records in RUNS of FILENAME in sorted order.
+
+  RUNS is a list of (start, end) tuples, as returned by
+  SortedRunWriter.close(), each delimiting a sorted run of records in
+  RECORD_FORMAT.  The runs are merged on the fly; records with equal
+  keys are generated in the order that they were written.  No more
+  than DEFAULT_MAX_MERGE runs should be merged at once (see
+  reduce_runs())."""
+
+  readers = [_RangeReader(filename, start, end) for (start, end) in runs]
+  for record in merge(
+        [record_format.iter_records(reader) for reader in readers],
+        record_format.get_key,
+        ):
+    yield record
+  for reader in readers:
+    reader.close()
+
+
+def _link_or_copy(src, dst):
+  """Make DST a hard link to SRC if possible, otherwise a copy."""
+
+  if os.path.exists(dst):
+    os.remove(dst)
+  try:
+    os.link(src, dst)
+  except (AttributeError, OSError):
+    shutil.copyfile(src, dst)
+
+
+def reduce_runs(
+      filename, runs, record_format, output_filename,
+      max_merge=DEFAULT_MAX_MERGE, tempdirs=[],
+      ):
+  """Merge the sorted RUNS in FILENAME until at most MAX_MERGE remain.
+
+  FILENAME and RUNS are as for iter_merged_runs().  Groups of runs are
+  merged into new files (intermediate generations are created in
+  TEMPDIRS), the last of which is OUTPUT_FILENAME.  If no merging is
+  needed, OUTPUT_FILENAME is made a hard link to (or a copy of)
+  FILENAME.  FILENAME itself is left unchanged.  Return the list of
+  runs in OUTPUT_FILENAME."""
+
+  if len(runs) <= max_merge:
+    _link_or_copy(filename, output_filename)
+    return runs
+
+  tempfiles = tempfile_generator(tempdirs)
+  generations = 0
+  input_filename = filename
+  while len(runs) > max_merge:
+    generations += 1
+    logger.verbose(
+        'Merge generation %d: merging %d runs in groups of up to %d...'
+        % (generations, len(runs), max_merge,)
+        )
+    if len(runs) <= max_merge * max_merge:
+      new_filename = output_filename
+    else:
+      new_filename = tempfiles.next()
+    f = open(new_filename, 'wb', BUFSIZE)
+    try:
+      new_runs = []
+      pos = 0
+      for i in range(0, len(runs), max_merge):
+        start = pos
+        for record in iter_merged_runs(
+              input_filename, runs[i:i + max_merge], record_format
+              ):
+          f.write(record)
+          pos += len(record)
+        new_runs.append((start, pos,))
+    finally:
+      f.close()
+    if input_filename != filename:
+      os.remove(input_filename)
+    input_filename = new_filename
+    runs = new_runs
+
+  return runs
+
+
+def _iter_records(f, record_format):
+  """Iterate over the records in F.
+
+  The records are lines if RECORD_FORMAT is None."""
+
+  if record_format is None:
+    return iter(f)
+  else:
+    return record_format.iter_records(f)
+
+
+def merge_files_onepass(
+    input_filenames, output_filename, key=None,
+    compressed_inputs=False, compressed_output=False, record_format=None,
+    ):
   """Merge a number of input files into one output file.
 
   This is a merge in the sense of mergesort; namely, it is assumed
   that the input files are each sorted, and (under that assumption)
-  the output file will also be sorted."""
+  the output file will also be sorted.  COMPRESSED_INPUTS and
+  COMPRESSED_OUTPUT tell whether the input files are, and the output
+  file should be, compressed.  If RECORD_FORMAT is specified, the files
+  consist of records in that format (e.g., KeyedRecordFormat) rather
+  than lines, and KEY is ignored."""
+
+  if record_format is not None:
+    key = record_format.get_key
 
   input_filenames = list(input_filenames)
-  if len(input_filenames) == 1:
+  if len(input_filenames) == 1 and compressed_inputs == compressed_output:
     shutil.move(input_filenames[0], output_filename)
   else:
-    output_file = file(output_filename, 'wb', BUFSIZE)
+    output_file = _open_file(output_filename, 'wb', compressed_output)
     try:
       chunks = []
       try:
         for input_filename in input_filenames:
-          chunks.append(open(input_filename, 'rb', BUFSIZE))
-        output_file.writelines(merge(chunks, key))
+          chunks.append(
+              _open_file(input_filename, 'rb', compressed_inputs)
+              )
+        output_file.writelines(
+            merge(
+                [_iter_records(chunk, record_format) for chunk in chunks],
+                key,
+                )
+            )
       finally:
         for chunk in chunks:
           try:
@@ -155,7 +524,8 @@ def tempfile_generator(tempdirs=[]):
 
 def _merge_file_generation(
     input_filenames, delete_inputs, key=None,
-    max_merge=DEFAULT_MAX_MERGE, tempfiles=None,
+    max_merge=DEFAULT_MAX_MERGE, tempfiles=None, pool=None,
+    compress=False, record_format=None,
     ):
   """Merge multiple input files into fewer output files.
 
@@ -171,6 +541,14 @@ def _merge_file_generation(
   If temporary files need to be used, they will be created using the
   specified TEMPFILES tempfile generator.
 
+  If POOL is specified, it should be a multiprocessing.Pool; the
+  groups, which are independent of each other, are then merged
+  concurrently by its worker processes.  (KEY must then be picklable.)
+
+  If COMPRESS is True, the input files are compressed and the output
+  files are compressed, too.  RECORD_FORMAT is as for
+  merge_files_onepass().
+
   Generate the names of the output files."""
 
   if max_merge <= 1:
@@ -183,11 +561,35 @@ def _merge_file_generation(
   if len(filenames) <= 1:
     raise ValueError('It makes no sense to merge a single file')
 
+  if pool is not None:
+    pending = []
+    while filenames:
+      group = filenames[:max_merge]
+      del filenames[:max_merge]
+      group_output = tempfiles.next()
+      pending.append((
+          group, group_output,
+          pool.apply_async(
+              merge_files_onepass,
+              (group, group_output, key, compress, compress, record_format,)
+              ),
+          ))
+    for (group, group_output, async_result) in pending:
+      async_result.get()
+      if delete_inputs:
+        _try_delete_files(group)
+      yield group_output
+    return
+
   while filenames:
     group = filenames[:max_merge]
     del filenames[:max_merge]
     group_output = tempfiles.next()
-    merge_files_onepass(group, group_output, key=key)
+    merge_files_onepass(
+        group, group_output, key=key,
+        compressed_inputs=compress, compressed_output=compress,
+        record_format=record_format,
+        )
     if delete_inputs:
       _try_delete_files(group)
     yield group_output
@@ -195,7 +597,8 @@ def _merge_file_generation(
 
 def merge_files(
     input_filenames, output_filename, key=None, delete_inputs=False,
-    max_merge=DEFAULT_MAX_MERGE, tempfiles=None,
+    max_merge=DEFAULT_MAX_MERGE, tempfiles=None, pool=None,
+    compress=False, record_format=None,
     ):
   """Merge a number of input files into one output file.
 
@@ -209,67 +612,370 @@ def merge_files(
   they are no longer needed.
 
   If temporary files need to be used, they will be created using the
-  specified TEMPFILES tempfile generator."""
+  specified TEMPFILES tempfile generator.
+
+  If POOL is specified, the intermediate merge generations are carried
+  out by its worker processes (see _merge_file_generation()).  The
+  final merge into OUTPUT_FILENAME is always done by this process.
+
+  If COMPRESS is True, the input files are compressed (as are the runs
+  written by sort_file()), and the intermediate files are written
+  compressed as well.  OUTPUT_FILENAME is never compressed.
+
+  If RECORD_FORMAT is specified, the files consist of records in that
+  format (e.g., KeyedRecordFormat) rather than lines, and KEY is
+  ignored.
+
+  Return the number of merge generations that were needed (counting
+  the final merge into OUTPUT_FILENAME)."""
 
   filenames = list(input_filenames)
   if not filenames:
     # Create an empty file:
     open(output_filename, 'wb').close()
+    return 0
+
+  if tempfiles is None:
+    tempfiles = tempfile_generator()
+  generations = 0
+  while len(filenames) > max_merge:
+    # Reduce the number of files by performing groupwise merges:
+    generations += 1
+    logger.verbose(
+        'Merge generation %d: merging %d files in groups of up to %d...'
+        % (generations, len(filenames), max_merge,)
+        )
+    filenames = list(
+        _merge_file_generation(
+            filenames, delete_inputs, key=key,
+            max_merge=max_merge, tempfiles=tempfiles, pool=pool,
+            compress=compress, record_format=record_format,
+            )
+        )
+    # After the first iteration, we are only working with temporary
+    # files so they can definitely be deleted them when we are done
+    # with them:
+    delete_inputs = True
+
+  # The last merge writes the results directly into the output
+  # file:
+  generations += 1
+  logger.verbose(
+      'Merge generation %d: merging %d files into the output file...'
+      % (generations, len(filenames),)
+      )
+  merge_files_onepass(
+      filenames, output_filename, key=key, compressed_inputs=compress,
+      record_format=record_format,
+      )
+  if delete_inputs:
+    _try_delete_files(filenames)
+
+  return generations
+
+
+def _read_runs(input_iterator, buffer_size=32000, memory=None):
+  """Split the records from INPUT_ITERATOR into pieces small enough to sort.
+
+  If MEMORY is specified, it is the approximate number of bytes that a
+  piece may occupy in memory (see LINE_OVERHEAD); otherwise, each piece
+  contains BUFFER_SIZE records.  Every piece contains at least one
+  record.  Generate the pieces as lists of records (usually lines)."""
+
+  if memory is None:
+    while True:
+      current_chunk = list(itertools.islice(input_iterator, buffer_size))
+      if not current_chunk:
+        break
+      yield current_chunk
   else:
-    if tempfiles is None:
-      tempfiles = tempfile_generator()
-    while len(filenames) > max_merge:
-      # Reduce the number of files by performing groupwise merges:
-      filenames = list(
-          _merge_file_generation(
-              filenames, delete_inputs, key=key,
-              max_merge=max_merge, tempfiles=tempfiles
-              )
+    current_chunk = []
+    size = 0
+    for line in input_iterator:
+      current_chunk.append(line)
+      size += len(line) + LINE_OVERHEAD
+      if size >= memory:
+        yield current_chunk
+        current_chunk = []
+        size = 0
+    if current_chunk:
+      yield current_chunk
+
+
+def _sort_range(input, start, end, key, output, compress, record_format):
+  """Sort the lines of file INPUT that start within bytes [START, END).
+
+  Write the sorted lines to file OUTPUT (compressed if COMPRESS is
+  True) and return the number of lines.  If RECORD_FORMAT is
+  specified, the range must consist of whole records in that format,
+  which are sorted instead of lines.  This function is run in worker
+  processes by _sort_file_parallel()."""
+
+  input_file = open(input, 'rb')
+  try:
+    if record_format is not None:
+      input_file.seek(start)
+      lines = list(
+          record_format.iter_records(StringIO(input_file.read(end - start)))
           )
-      # After the first iteration, we are only working with temporary
-      # files so they can definitely be deleted them when we are done
-      # with them:
-      delete_inputs = True
-
-    # The last merge writes the results directly into the output
-    # file:
-    merge_files_onepass(filenames, output_filename, key=key)
-    if delete_inputs:
+      key = record_format.get_key
+    else:
+      if start > 0:
+        # Skip the rest of any line that started before START (it
+        # belongs to the previous range):
+        input_file.seek(start - 1)
+        input_file.readline()
+      pos = input_file.tell()
+      if pos >= end:
+        lines = []
+      else:
+        data = input_file.read(end - pos)
+        if not data.endswith('\n'):
+          # Include the remainder of the last line:
+          data += input_file.readline()
+        lines = StringIO(data).readlines()
+        del data
+  finally:
+    input_file.close()
+
+  lines.sort(key=key)
+  output_file = _open_file(output, 'wb', compress)
+  try:
+    output_file.writelines(lines)
+  finally:
+    output_file.close()
+  return len(lines)
+
+
+def _get_range_size(input, memory):
+  """Return the number of bytes of file INPUT to put in each run.
+
+  Estimate the average line length from the start of the file, and
+  choose the size so that a run occupies about MEMORY bytes of memory
+  (accounting for LINE_OVERHEAD in the same way as _read_runs()).
+  Runs are never made smaller than BUFSIZE, because it is not worth
+  handing less than that to a worker process."""
+
+  f = open(input, 'rb')
+  try:
+    sample = f.read(SAMPLE_SIZE)
+  finally:
+    f.close()
+
+  line_length = float(len(sample)) / max(1, sample.count('\n'))
+  return max(
+      BUFSIZE, int(memory * line_length / (line_length + LINE_OVERHEAD))
+      )
+
+
+def _iter_record_ranges(input, record_format, memory):
+  """Divide file INPUT, consisting of records, into ranges for sorting.
+
+  Each range holds whole records occupying about MEMORY bytes of memory
+  (accounting for LINE_OVERHEAD in the same way as _read_runs()).
+  Generate the ranges as tuples (start, end) of file offsets."""
+
+  f = open(input, 'rb', BUFSIZE)
+  try:
+    start = pos = 0
+    size = 0
+    for record in record_format.iter_records(f):
+      pos += len(record)
+      size += len(record) + LINE_OVERHEAD
+      if size >= memory:
+        yield (start, pos)
+        start = pos
+        size = 0
+    if pos > start:
+      yield (start, pos)
+  finally:
+    f.close()
+
+
+def _temporary_files_fit(input, tempdirs):
+  """Return True iff sorting INPUT uncompressed should fit in TEMPDIRS.
+
+  At the worst point of a sort, the runs and the output of the first
+  merge generation exist at the same time, taking up to about twice
+  the size of the input.  If the free space cannot be determined,
+  assume that it is sufficient."""
+
+  if not tempdirs:
+    tempdirs = [tempfile.gettempdir()]
+  needed = 2 * os.path.getsize(input) // len(tempdirs)
+
+  for tempdir in tempdirs:
+    try:
+      st = os.statvfs(tempdir)
+    except (AttributeError, OSError):
+      return True
+    if st.f_bavail * st.f_frsize < needed:
+      return False
+
+  return True
+
+
+def _create_pool(jobs):
+  try:
+    import multiprocessing
+  except ImportError:
+    raise FatalError(
+        'The --jobs option requires the multiprocessing module\n'
+        '(Python 2.6 or later).'
+        )
+
+  return multiprocessing.Pool(jobs)
+
+
+def _sort_file_parallel(
+      input, output, key, buffer_size, tempfiles, max_merge, memory, jobs,
+      compress, record_format,
+      ):
+  """Sort INPUT to OUTPUT using JOBS worker processes.
+
+  The input file is divided into byte ranges (adjusted to line
+  boundaries by the workers), each of which is sorted into a run by a
+  worker process.  (A file of records has to be scanned to find the
+  record boundaries.)  The intermediate merge generations are also
+  distributed among the workers; only the final merge is done in this
+  process.  Because each run consists of consecutive lines of the
+  input, the output is identical to that of a serial sort."""
+
+  if memory is None:
+    # Approximate BUFFER_SIZE lines per run:
+    memory = buffer_size * (LINE_OVERHEAD + 100)
+  if record_format is None:
+    range_size = _get_range_size(input, memory)
+    ranges = [
+        (start, start + range_size)
+        for start in range(0, os.path.getsize(input), range_size)
+        ]
+  else:
+    ranges = _iter_record_ranges(input, record_format, memory)
+
+  pool = _create_pool(jobs)
+  try:
+    pending = []
+    filenames = []
+    try:
+      for (start, end) in ranges:
+        filename = tempfiles.next()
+        filenames.append(filename)
+        pending.append((
+            filename,
+            pool.apply_async(
+                _sort_range,
+                (
+                    input, start, end, key, filename, compress,
+                    record_format,
+                    ),
+                ),
+            ))
+
+      runs = []
+      line_count = 0
+      for (filename, async_result) in pending:
+        n = async_result.get()
+        if n:
+          line_count += n
+          runs.append(filename)
+        else:
+          _try_delete_files([filename])
+
+      logger.verbose(
+          'Sorted %d records into %d runs using %d processes.'
+          % (line_count, len(runs), jobs,)
+          )
+
+      generations = merge_files(
+          runs, output, key=key,
+          delete_inputs=True, max_merge=max_merge, tempfiles=tempfiles,
+          pool=pool, compress=compress, record_format=record_format,
+          )
+      logger.verbose('Merged the runs in %d generations.' % (generations,))
+    finally:
       _try_delete_files(filenames)
+  finally:
+    pool.close()
+    pool.join()
 
 
 def sort_file(
       input, output, key=None,
       buffer_size=32000, tempdirs=[], max_merge=DEFAULT_MAX_MERGE,
+      memory=None, jobs=1, compress=False, record_format=None,
       ):
+  """Sort the lines of file INPUT, writing the result to file OUTPUT.
+
+  The input is split into runs that are sorted in memory and written
+  to temporary files in TEMPDIRS, which are then merged.  If MEMORY is
+  specified, it is the approximate number of bytes of memory that may
+  be used for each run; otherwise, each run holds BUFFER_SIZE lines.
+  If KEY is specified, it should be a function that returns the sort
+  key for a line.  Lines with equal keys retain their relative order.
+
+  If JOBS is greater than one, that many worker processes are used to
+  sort the runs and to carry out the intermediate merges; each of them
+  may use MEMORY bytes.  KEY must then be picklable (e.g., a
+  module-level function).  The output is the same as for a serial
+  sort.
+
+  If COMPRESS is True, the temporary files are compressed, which saves
+  disk space and I/O at the cost of some CPU time.  If it is None,
+  they are compressed only if they might not fit into the free space
+  in TEMPDIRS otherwise.
+
+  If RECORD_FORMAT is specified, the input consists of records in that
+  format (e.g., KeyedRecordFormat) rather than lines.  The records are
+  sorted by the keys that RECORD_FORMAT extracts, and KEY is ignored."""
+
+  if compress is None:
+    compress = not _temporary_files_fit(input, tempdirs)
+  if compress:
+    logger.verbose('Compressing the temporary files.')
+
   tempfiles = tempfile_generator(tempdirs)
 
+  if jobs > 1:
+    _sort_file_parallel(
+        input, output, key, buffer_size, tempfiles, max_merge, memory, jobs,
+        compress, record_format,
+        )
+    return
+
+  if record_format is not None:
+    key = record_format.get_key
+
   filenames = []
+  line_count = 0
 
   input_file = file(input, 'rb', BUFSIZE)
   try:
     try:
-      input_iterator = iter(input_file)
-      while True:
-        current_chunk = list(itertools.islice(input_iterator, buffer_size))
-        if not current_chunk:
-          break
+      records = _iter_records(input_file, record_format)
+      for current_chunk in _read_runs(records, buffer_size, memory):
+        line_count += len(current_chunk)
         current_chunk.sort(key=key)
         filename = tempfiles.next()
         filenames.append(filename)
-        f = open(filename, 'w+b', BUFSIZE)
+        f = _open_file(filename, 'wb', compress)
         try:
           f.writelines(current_chunk)
         finally:
           f.close()
+        del current_chunk
     finally:
       input_file.close()
 
-    merge_files(
+    logger.verbose(
+        'Sorted %d records into %d runs.' % (line_count, len(filenames),)
+        )
+
+    generations = merge_files(
         filenames, output, key=key,
         delete_inputs=True, max_merge=max_merge, tempfiles=tempfiles,
+        compress=compress, record_format=record_format,
         )
+    logger.verbose('Merged the runs in %d generations.' % (generations,))
   finally:
     _try_delete_files(filenames)
-
-
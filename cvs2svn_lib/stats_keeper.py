@@ -36,6 +36,7 @@ class StatsKeeper:
     self._last_rev_date = 0
     self._pass_timings = { }
     self._stats_reflect_exclude = False
+    self._checkout_store_peak_sizes = None
     self.reset_cvs_rev_info()
 
   def log_duration_for_pass(self, duration, pass_num, pass_name):
@@ -94,6 +95,9 @@ class StatsKeeper:
   def svn_rev_count(self):
     return self._svn_rev_count
 
+  def set_checkout_store_peak_sizes(self, memory_size, file_size):
+    self._checkout_store_peak_sizes = (memory_size, file_size,)
+
   def __getstate__(self):
     state = self.__dict__.copy()
     # This can get kinda large, so we don't store it:
@@ -120,6 +124,11 @@ class StatsKeeper:
     if self._svn_rev_count is not None:
       f.write('Total SVN Commits:      %10i\n' % self._svn_rev_count)
 
+    if self._checkout_store_peak_sizes is not None:
+      (memory_size, file_size,) = self._checkout_store_peak_sizes
+      f.write('Checkout Memory in KB:  %10i\n' % (memory_size / 1024,))
+      f.write('Checkout File in KB:    %10i\n' % (file_size / 1024,))
+
     f.write(
         'First Revision Date:    %s\n' % (time.ctime(self._first_rev_date),)
         )
@@ -25,6 +25,8 @@ import os
 import shutil
 import unittest
 import subprocess
+import tempfile
+import mmap
 
 SRCPATH = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', '..'))
 sys.path.insert(0, SRCPATH)
@@ -34,6 +36,8 @@ import unittest
 from cvs2svn_lib.rcsparser import Sink
 from cvs2svn_lib.rcsparser import parse
 from cvs2svn_lib.rcs_stream import RCSStream
+from cvs2svn_lib.rcs_stream import generate_edits
+from cvs2svn_lib.rcs_stream import MalformedDeltaException
 
 TMPDIR = os.path.join(SRCPATH, 'cvs2svn-tmp')
 
@@ -99,6 +103,12 @@ class RCSStreamTestCase(unittest.TestCase):
     s2.invert_diff(delta)
     self.assertEqual(s2.get_text(), new)
 
+    # Apply the delta in @-string form, embedded in a larger buffer:
+    escaped = 'xx@' + delta.replace('@', '@@') + '@yy'
+    s3 = RCSStream(old)
+    s3.apply_edits(generate_edits(escaped, 3, len(escaped) - 3, True))
+    self.assertEqual(s3.get_text(), new)
+
   def runTest(self):
     self.assert_(os.path.isfile(self.filename + ',v'))
     recorder = RCSRecorder()
@@ -130,8 +140,80 @@ class RCSStreamTestCase(unittest.TestCase):
     shutil.rmtree(os.path.dirname(self.filename))
 
 
+class GenerateEditsTestCase(unittest.TestCase):
+  """Test generate_edits() on deltas embedded in larger buffers.
+
+  These tests do not need RCS's 'ci' program."""
+
+  delta = (
+      'd1 2\n'
+      'a3 2\n'
+      'x@@y\n'
+      'z\n'
+      'a4 0\n'
+      'd5 1\n'
+      'a9 3\n'
+      '@@\n'
+      '\n'
+      'no newline'
+      )
+
+  edits = [
+      ('d', 0, 2),
+      ('a', 3, ['x@y\n', 'z\n']),
+      ('a', 4, []),
+      ('d', 4, 1),
+      ('a', 9, ['@\n', '\n', 'no newline']),
+      ]
+
+  def check(self, buf, start, end, escaped, expected):
+    self.assertEqual(
+        list(generate_edits(buf, start, end, escaped)), expected
+        )
+
+  def runTest(self):
+    buf = 'a3 1\nxx@' + self.delta + '@yy\n'
+    start = buf.index('@') + 1
+    end = buf.rindex('@')
+    self.check(buf, start, end, True, self.edits)
+
+    # The same in an mmap:
+    f = tempfile.TemporaryFile()
+    try:
+      f.write(buf)
+      f.flush()
+      m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        self.check(m, start, end, True, self.edits)
+      finally:
+        m.close()
+    finally:
+      f.close()
+
+    # Without unescaping:
+    unescaped = self.delta.replace('@@', '@')
+    self.check(unescaped, 0, None, False, self.edits)
+
+    self.check('', 0, None, False, [])
+    # The last line of a block must not be stolen from the text after
+    # END:
+    self.assertRaises(
+        MalformedDeltaException,
+        list, generate_edits('a1 2\nx\ny\n', 0, 7),
+        )
+    self.assertRaises(
+        MalformedDeltaException,
+        list, generate_edits('a1 3\nx\ny', 0),
+        )
+    self.assertRaises(
+        MalformedDeltaException,
+        list, generate_edits('d1 1\nq1 1\n', 0),
+        )
+
+
 suite = unittest.TestSuite()
 
+suite.addTest(GenerateEditsTestCase())
 
 def add_test_pair(name, v1, v2):
   suite.addTest(RCSStreamTestCase(name, name, v1, v2))
@@ -164,6 +246,8 @@ add_test('enlarge-at-start', 'a\nb\nc\n', 'a1\na2\nb\nc\n')
 add_test('enlarge-in-middle', 'a\nb\nc\n', 'a\nb1\nb2\nc\n')
 add_test('enlarge-at-end', 'a\nb\nc\n', 'a\nb\nc1\nc2\n')
 
+add_test('at-signs', 'a@b\nc\n', 'a@@b\n@\nc\n')
+
 
 unittest.TextTestRunner(verbosity=2).run(suite)
 
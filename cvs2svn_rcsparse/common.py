@@ -189,6 +189,20 @@ class Sink:
     """
     pass
 
+  def accepts_deltatext_handles(self):
+    """Reports whether the sink wants handles rather than deltatexts.
+
+    If this function returns true, the parser does not read the
+    deltatexts into memory.  Instead, it skips over them and passes a
+    DeltatextHandle as the TEXT argument of set_revision_info().  The
+    text can then be fetched from the handle if it is needed, but only
+    until parse() returns.  This can save a lot of time for sinks that
+    only need the log messages.
+
+    This function is called once, before the deltatexts are parsed.
+    """
+    return 0
+
   def set_revision_info(self, revision, log, text):
     """Reports the log message and contents of a CVS revision.
 
@@ -199,7 +213,8 @@ class Sink:
     LOG is a string containing the log message.  This may be multi-line.
     TEXT is the contents of the file in this revision, either as full-text or
     as a diff.  This is usually multi-line, and often quite large and/or
-    binary.
+    binary.  If accepts_deltatext_handles() returned true, TEXT is a
+    DeltatextHandle instead.
     """
     pass
 
@@ -212,6 +227,78 @@ class Sink:
     pass
 
 
+# --------------------------------------------------------------------------
+#
+# HANDLES FOR DELTATEXTS THAT HAVE NOT BEEN READ
+#
+
+class DeltatextHandle:
+  """A reference to a deltatext that the parser skipped over.
+
+  OFFSET and LENGTH describe the location of the raw (still
+  @@-escaped) contents of the string within the RCS file.  If the
+  token stream holds the file contents in memory (e.g., as an mmap),
+  BUF is that object and BASE is the file offset of its first byte;
+  otherwise BUF is None and the text is read from FILE.  The handle is
+  true iff the deltatext is not empty.
+  """
+
+  def __init__(self, file, offset, length, buf=None, base=0):
+    self.file = file
+    self.offset = offset
+    self.length = length
+    self.buf = buf
+    self.base = base
+
+  def __nonzero__(self):
+    return self.length != 0
+
+  def get_buffer(self):
+    """Return the raw deltatext without unnecessary copying.
+
+    Return a tuple (BUF, START, END, ESCAPED).  BUF is a string-like
+    object that supports slicing, find(), and regular expression
+    matching, and the deltatext is BUF[START:END].  If ESCAPED is
+    true, '@' characters within it are still doubled."""
+
+    if self.buf is not None:
+      start = self.offset - self.base
+      return (self.buf, start, start + self.length, 1)
+
+    if not self.length:
+      return ('', 0, 0, 0)
+    pos = self.file.tell()
+    self.file.seek(self.offset)
+    raw = self.file.read(self.length)
+    self.file.seek(pos)
+    return (raw, 0, len(raw), 1)
+
+  def read(self):
+    "Read the deltatext and return it as a string."
+
+    (buf, start, end, escaped) = self.get_buffer()
+    text = buf[start:end]
+    if escaped:
+      text = string.replace(text, '@@', '@')
+    return text
+
+
+class StringDeltatextHandle:
+  """A DeltatextHandle for a token stream that cannot skip deltatexts."""
+
+  def __init__(self, text):
+    self.text = text
+
+  def __nonzero__(self):
+    return self.text != ''
+
+  def get_buffer(self):
+    return (self.text, 0, len(self.text), 0)
+
+  def read(self):
+    return self.text
+
+
 # --------------------------------------------------------------------------
 #
 # EXCEPTIONS USED BY RCSPARSE
@@ -434,7 +521,31 @@ class _Parser:
     self.ts.match('desc')
     self.sink.set_description(self.ts.get())
 
+  def parse_rcs_deltatext_handles(self):
+    skip_string = getattr(self.ts, 'skip_string', None)
+    # A token stream that holds the whole file in memory reveals it as
+    # a tuple (buf, base) so that the handles can refer to it directly:
+    (buf, base) = getattr(self.ts, 'contents', (None, 0))
+    while 1:
+      revision = self.ts.get()
+      if revision is None:
+        # EOF
+        break
+      self.ts.match('log')
+      log = self.ts.get()
+      self.ts.match('text')
+      if skip_string is None:
+        text = StringDeltatextHandle(self.ts.get())
+      else:
+        (offset, length) = skip_string()
+        text = DeltatextHandle(self.ts.rcsfile, offset, length, buf, base)
+      ### need to add code to chew up "newphrase"
+      self.sink.set_revision_info(revision, log, text)
+
   def parse_rcs_deltatext(self):
+    if self.sink.accepts_deltatext_handles():
+      self.parse_rcs_deltatext_handles()
+      return
     while 1:
       revision = self.ts.get()
       if revision is None:
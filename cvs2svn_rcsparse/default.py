@@ -136,6 +136,67 @@ class _TokenStream:
 
       return string.join(chunks, '')
 
+  def skip_string(self):
+    """Skip over the next token, which must be an @-string.
+
+    The string is not unescaped or even stored.  Return a tuple
+    (offset, length) describing the location of its raw contents
+    (between the delimiting '@' characters) within the file."""
+
+    buf = self.buf
+    lbuf = len(buf)
+    idx = self.idx
+
+    while 1:
+      if idx == lbuf:
+        buf = self.rcsfile.read(self.CHUNK_SIZE)
+        if buf == '':
+          raise RuntimeError, 'EOF'
+        lbuf = len(buf)
+        idx = 0
+
+      if buf[idx] not in string.whitespace:
+        break
+
+      idx = idx + 1
+
+    if buf[idx] != '@':
+      raise common.RCSExpected(buf[idx], '@')
+
+    idx = idx + 1
+
+    # The file position always corresponds to the end of buf:
+    offset = self.rcsfile.tell() - lbuf + idx
+
+    while 1:
+      if idx == lbuf:
+        idx = 0
+        buf = self.rcsfile.read(self.CHUNK_SIZE)
+        if buf == '':
+          raise RuntimeError, 'EOF'
+        lbuf = len(buf)
+      i = string.find(buf, '@', idx)
+      if i == -1:
+        idx = lbuf
+        continue
+      if i == lbuf - 1:
+        idx = 0
+        buf = '@' + self.rcsfile.read(self.CHUNK_SIZE)
+        if buf == '@':
+          raise RuntimeError, 'EOF'
+        lbuf = len(buf)
+        continue
+      if buf[i + 1] == '@':
+        idx = i + 2
+        continue
+
+      length = self.rcsfile.tell() - lbuf + i - offset
+
+      self.buf = buf
+      self.idx = i + 1
+
+      return (offset, length)
+
 #  _get = get
 #  def get(self):
     token = self._get()
@@ -0,0 +1,204 @@
+# -*-python-*-
+#
+# Copyright (C) 1999-2014 The ViewCVS Group. All Rights Reserved.
+#
+# By using this file, you agree to the terms and conditions set forth in
+# the LICENSE.html file which can be found at the top level of the ViewVC
+# distribution or at http://viewvc.org/license-1.html.
+#
+# For more information, visit http://viewvc.org/
+#
+# -----------------------------------------------------------------------
+#
+# This parser is not part of the upstream ViewVC distribution.  It maps
+# the RCS file into memory and lets compiled regular expressions
+# (rather than a Python loop over characters) find the tokens, so it
+# is considerably faster than the default parser while depending only
+# on the Python standard library.
+#
+# -----------------------------------------------------------------------
+
+import os
+import re
+import mmap
+
+import common
+
+
+# Whitespace and token characters are defined as in
+# default._TokenStream:
+_ws = r'[ \t\n\r\x0b\x0c]*'
+_token = r'[;:]|[^ \t\n\r\x0b\x0c;:@][^ \t\n\r\x0b\x0c;:]*'
+_string_contents = r'[^@]*(?:@@[^@]*)*'
+
+# Match the next token.  Group 1 is an ordinary token and group 2 the
+# (still escaped) contents of an @-string.
+_token_re = re.compile(
+    r'%s(?:(%s)|@(%s)@)' % (_ws, _token, _string_contents,)
+    )
+
+# Like _token_re, but used with findall() to tokenize the admin and
+# tree sections in bulk.  Group 3 matches an @-string that is not
+# terminated before the end of the region, along with everything after
+# it, so that it can only appear in the last match.
+_bulk_token_re = re.compile(
+    r'%s(?:(%s)|@(%s)@|(@.*))' % (_ws, _token, _string_contents,),
+    re.DOTALL
+    )
+
+# A 'desc' keyword following a semicolon; i.e., the likely end of the
+# tree section.  It is only a candidate because it might be part of an
+# @-string.
+_desc_re = re.compile(r';%s(desc)(?=[ \t\n\r\x0b\x0c@])' % (_ws,))
+
+
+class _RegexTokenStream:
+  # Files smaller than this are read into a string rather than mapped,
+  # because for small files mmap's setup costs more than it saves.
+  MMAP_THRESHOLD = 256 * 1024
+
+  def __init__(self, file):
+    self.rcsfile = file
+    (self.buf, self.idx, self.base) = self._map_file(file)
+    self.lbuf = len(self.buf)
+    if self.idx == self.lbuf:
+      raise RuntimeError, 'EOF'
+
+    # Let DeltatextHandles refer to the contents without copying them:
+    self.contents = (self.buf, self.base)
+
+    # Tokens that have been read but not yet consumed, in reverse order:
+    self.tokens = [ ]
+    self._tokenize_header()
+
+  def _map_file(self, file):
+    """Return (buf, idx, base) describing the remainder of FILE.
+
+    BUF is a string-like object (an mmap or a string) holding the
+    contents of FILE, IDX is the index within BUF of FILE's current
+    position, and BASE is the file offset corresponding to index 0 of
+    BUF.  Fall back to reading the file if it cannot be mapped (e.g.,
+    if it is not a real file)."""
+
+    pos = file.tell()
+    try:
+      fileno = file.fileno()
+      if os.fstat(fileno).st_size >= self.MMAP_THRESHOLD:
+        return (mmap.mmap(fileno, 0, access=mmap.ACCESS_READ), pos, 0)
+    except (AttributeError, EnvironmentError, ValueError, OverflowError):
+      pass
+    return (file.read(), 0, pos)
+
+  def _tokenize_header(self):
+    """Tokenize the admin and tree sections in a single pass.
+
+    These sections consist of many short tokens, so it pays to let
+    findall() do the work.  The region that is tokenized ends just
+    after the first 'desc' keyword.  If that turns out to lie within an
+    @-string, do nothing and let get() take it one token at a time."""
+
+    buf = self.buf
+    m = _desc_re.search(buf, self.idx)
+    if m is None:
+      return
+    end = m.end(1)
+
+    found = _bulk_token_re.findall(buf, self.idx, end)
+    if not found or found[-1][2]:
+      return
+
+    if buf.find('@@', self.idx, end) != -1:
+      tokens = [
+          token or s.replace('@@', '@')
+          for (token, s, unused) in found
+          ]
+    else:
+      tokens = [token or s for (token, s, unused) in found]
+
+    tokens.reverse()
+    self.tokens = tokens
+    self.idx = end
+
+  def _eof(self):
+    """Handle a failure to match a token at the current position.
+
+    Only whitespace can be skipped, so this means either the end of
+    the file or an @-string that is never terminated."""
+
+    if self.buf.find('@', self.idx) != -1:
+      raise RuntimeError, 'EOF'
+    self.idx = self.lbuf
+
+  def get(self):
+    "Get the next token from the RCS file."
+
+    if self.tokens:
+      return self.tokens.pop()
+
+    m = _token_re.match(self.buf, self.idx)
+    if m is None:
+      # signal EOF by returning None as the token
+      self._eof()
+      return None
+
+    self.idx = m.end()
+    token = m.group(1)
+    if token is not None:
+      if self.idx == self.lbuf:
+        # like the default parser, ignore an unterminated token at EOF
+        return None
+      return token
+
+    token = m.group(2)
+    if '@@' in token:
+      token = token.replace('@@', '@')
+    return token
+
+  def skip_string(self):
+    """Skip over the next token, which must be an @-string.
+
+    The string is not unescaped or even copied.  Return a tuple
+    (offset, length) describing the location of its raw contents
+    (between the delimiting '@' characters) within the file."""
+
+    if self.tokens:
+      # Only the header is tokenized in advance, and this is never
+      # called for header tokens.
+      raise common.RCSExpected(self.tokens.pop(), '@')
+
+    m = _token_re.match(self.buf, self.idx)
+    if m is None:
+      self._eof()
+      raise RuntimeError, 'EOF'
+    if m.group(2) is None:
+      raise common.RCSExpected(m.group(1), '@')
+
+    self.idx = m.end()
+    return (self.base + m.start(2), m.end(2) - m.start(2))
+
+  def match(self, match):
+    "Try to match the next token from the input buffer."
+
+    if self.tokens:
+      token = self.tokens.pop()
+    else:
+      token = self.get()
+    if token != match:
+      raise common.RCSExpected(token, match)
+
+  def unget(self, token):
+    "Put this token back, for the next get() to return."
+
+    self.tokens.append(token)
+
+  def mget(self, count):
+    "Return multiple tokens. 'next' is at the end."
+    result = [ ]
+    for i in range(count):
+      result.append(self.get())
+    result.reverse()
+    return result
+
+
+class Parser(common._Parser):
+  stream_class = _RegexTokenStream
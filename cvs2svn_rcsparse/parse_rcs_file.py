@@ -47,6 +47,10 @@ class LoggingSink:
   def __init__(self, f):
     self.f = f
 
+  def accepts_deltatext_handles(self):
+    # This is a query rather than a callback, so don't log it:
+    return 0
+
   def __getattr__(self, name):
     return Logger(self.f, name)
 
@@ -24,15 +24,24 @@ import glob
 from cStringIO import StringIO
 from difflib import Differ
 
-# Since there is nontrivial logic in __init__.py, we have to import
-# parse() via that file.  First make sure that the directory
-# containing this script is in the path:
+# Make sure that the directory containing this script is in the path:
 script_dir = os.path.dirname(sys.argv[0])
 sys.path.insert(0, script_dir)
 
-from __init__ import parse
 from parse_rcs_file import LoggingSink
 
+import default
+import fast
+
+parsers = [('default', default.Parser), ('fast', fast.Parser)]
+
+try:
+    import texttools
+except ImportError:
+    pass
+else:
+    parsers.append(('texttools', texttools.Parser))
+
 
 test_dir = os.path.join(script_dir, 'test-data')
 
@@ -41,30 +50,31 @@ filelist.sort()
 
 all_tests_ok = 1
 
-for filename in filelist:
-    sys.stderr.write('%s: ' % (filename,))
-    f = StringIO()
-    try:
-        parse(open(filename, 'rb'), LoggingSink(f))
-    except Exception, e:
-        sys.stderr.write('Error parsing file: %s!\n' % (e,))
-        all_tests_ok = 0
-    else:
-        output = f.getvalue()
-
-        expected_output_filename = filename[:-2] + '.out'
-        expected_output = open(expected_output_filename, 'rb').read()
-
-        if output == expected_output:
-            sys.stderr.write('OK\n')
-        else:
-            sys.stderr.write('Output does not match expected output!\n')
-            differ = Differ()
-            for diffline in differ.compare(
-                expected_output.splitlines(1), output.splitlines(1)
-                ):
-                sys.stderr.write(diffline)
+for (parser_name, parser_class) in parsers:
+    for filename in filelist:
+        sys.stderr.write('%s (%s parser): ' % (filename, parser_name,))
+        f = StringIO()
+        try:
+            parser_class().parse(open(filename, 'rb'), LoggingSink(f))
+        except Exception, e:
+            sys.stderr.write('Error parsing file: %s!\n' % (e,))
             all_tests_ok = 0
+        else:
+            output = f.getvalue()
+
+            expected_output_filename = filename[:-2] + '.out'
+            expected_output = open(expected_output_filename, 'rb').read()
+
+            if output == expected_output:
+                sys.stderr.write('OK\n')
+            else:
+                sys.stderr.write('Output does not match expected output!\n')
+                differ = Differ()
+                for diffline in differ.compare(
+                    expected_output.splitlines(1), output.splitlines(1)
+                    ):
+                    sys.stderr.write(diffline)
+                all_tests_ok = 0
 
 if all_tests_ok:
     sys.exit(0)
@@ -2214,6 +2214,88 @@ def individual_passes():
     raise Failure()
 
 
+@Cvs2SvnTestFunction
+def parallel_collect():
+  "parse the RCS files in parallel"
+  conv = ensure_conversion('main')
+  conv2 = ensure_conversion('main', args=['--jobs=3'])
+
+  if conv.logs != conv2.logs:
+    raise Failure()
+
+
+@Cvs2SvnTestFunction
+def parse_cache():
+  "reuse cached RCS parse results"
+  cache_dir = os.path.join(tmp_dir, 'parse-cache')
+  if os.path.exists(cache_dir):
+    shutil.rmtree(cache_dir)
+
+  conv = ensure_conversion('main')
+  # The first conversion fills the cache:
+  conv2 = ensure_conversion('main', args=['--parse-cache=%s' % cache_dir])
+  if conv.logs != conv2.logs:
+    raise Failure()
+
+  # The second conversion, with different options, uses it:
+  conv3 = ensure_conversion('main', args=['--trunk-only'])
+  conv4 = ensure_conversion(
+      'main', args=['--parse-cache=%s' % cache_dir, '--trunk-only']
+      )
+  if conv3.logs != conv4.logs:
+    raise Failure()
+
+
+@Cvs2SvnTestFunction
+def walker_threads():
+  "read the repository directories using threads"
+  conv = ensure_conversion('main')
+  conv2 = ensure_conversion('main', args=['--walker-threads=4'])
+  if conv.logs != conv2.logs:
+    raise Failure()
+
+  # Attic conflicts must still be detected:
+  ensure_conversion(
+      'file-in-attic-too', args=['--walker-threads=4'],
+      error_re=(
+          r'.*A CVS repository cannot contain both '
+          r'(.*)' + re.escape(os.sep) + r'(.*) '
+          + r'and '
+          r'\1' + re.escape(os.sep) + r'Attic' + re.escape(os.sep) + r'\2'
+          )
+      )
+
+
+@Cvs2SvnTestFunction
+def sort_memory():
+  "sort the intermediate files in small runs"
+  conv = ensure_conversion('main')
+  conv2 = ensure_conversion('main', args=['--sort-memory=1'])
+  if conv.logs != conv2.logs:
+    raise Failure()
+
+  # The same, with the runs sorted and merged by worker processes:
+  conv3 = ensure_conversion('main', args=['--sort-memory=1', '--jobs=3'])
+  if conv.logs != conv3.logs:
+    raise Failure()
+
+  # The same, with compressed temporary files:
+  conv4 = ensure_conversion(
+      'main', args=['--sort-memory=1', '--sort-compression=zlib']
+      )
+  if conv.logs != conv4.logs:
+    raise Failure()
+
+
+@Cvs2SvnTestFunction
+def record_table_backend():
+  "access the index tables via mmap and via files"
+  conv = ensure_conversion('main', args=['--record-table-backend=file'])
+  conv2 = ensure_conversion('main', args=['--record-table-backend=mmap'])
+  if conv.logs != conv2.logs:
+    raise Failure()
+
+
 @Cvs2SvnTestFunction
 def resync_bug():
   "reveal a big bug in our resync algorithm"
@@ -3344,6 +3426,33 @@ def internal_co_keywords():
     raise Failure()
 
 
+@Cvs2SvnTestFunction
+def internal_co_snapshots():
+  "internal co with fulltexts in place of some deltas"
+
+  # The options files lower the limits on the number and the size of
+  # the deltas that have to be applied to rebuild a revision, so that
+  # InternalRevisionCollector stores fulltexts in place of many deltas.
+  # The output must not change.  The conversions are run with warnings
+  # enabled: if the refcounts of the text records were too high, the
+  # leftover revisions would be reported, which makes the conversion
+  # fail; and if a text record were freed too early, checking out a
+  # revision that depends on it would fail.
+  conv = ensure_conversion(
+      'main', options_file='cvs2svn-internal-co.options',
+      dumpfile='internal-co.dump', verbosity='-qq',
+      )
+  lines = list(open(conv.dumpfile, 'rb'))
+  for limit in ['chain', 'size']:
+    conv2 = ensure_conversion(
+        'main', options_file='cvs2svn-internal-co-%s.options' % (limit,),
+        dumpfile='internal-co-%s.dump' % (limit,), verbosity='-qq',
+        )
+    # Compare all lines following the repository UUID:
+    if list(open(conv2.dumpfile, 'rb'))[3:] != lines[3:]:
+      raise Failure()
+
+
 @Cvs2SvnTestFunction
 def timestamp_chaos():
   "test timestamp adjustments"
@@ -4279,6 +4388,12 @@ test_list = [
     log_message_eols,
     missing_vendor_branch,
     newphrases,
+    parallel_collect,
+    parse_cache,
+    walker_threads,
+    sort_memory,
+    record_table_backend,
+    internal_co_snapshots,
     ]
 
 if __name__ == '__main__':